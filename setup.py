@@ -38,7 +38,10 @@ setup(name='tgminer',
           'console_scripts': [
               'tgminer = tgminer.tgminer:main',
               'tgminer-search = tgminer.search:main',
-              'tgminer-markov = tgminer.markov:main'
+              'tgminer-markov = tgminer.markov:main',
+              'tgminer-index = tgminer.index:main',
+              'tgminer-stats = tgminer.stats:main',
+              'tgminer-replay = tgminer.replay:main'
           ]
       },
       classifiers=[
@@ -0,0 +1,185 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import datetime
+import multiprocessing
+import shutil
+import tempfile
+import threading
+import unittest
+
+import fasteners
+
+import tgminer.backend
+import tgminer.flood
+
+MESSAGES = ['A catalogue of happiness',
+            'The dialogue was long',
+            'Running in the rain',
+            'happiness.is.a.word',
+            'Another catalog entry']
+
+USERNAMES = ['bobby', 'robert', 'bob_smith', 'alice', 'bobby']
+
+
+def make_documents(ngram_fields: str = None) -> list:
+    documents = []
+    for i, (message, username) in enumerate(zip(MESSAGES, USERNAMES)):
+        documents.append(dict(message=message, username=username, alias=username.title(),
+                              chat='test-chat', to_id='-1001', chat_id=-1001, from_id=100 + i,
+                              message_id=i, message_key=f'-1001:{i}', media_type='', account='test',
+                              timestamp=datetime.datetime(2020, 1, 1 + i),
+                              date=datetime.datetime(2020, 1, 1 + i),
+                              ngram_fields=ngram_fields))
+    return documents
+
+
+class BackendTestCase(unittest.TestCase):
+    NGRAM_FIELDS = 'message username'
+
+    def setUp(self):
+        self.indexes = {}
+        self._dirs = []
+
+        for name, backend in (('whoosh', tgminer.backend.WhooshIndex), ('sqlite', tgminer.backend.SQLiteIndex)):
+            data_dir = tempfile.mkdtemp()
+            self._dirs.append(data_dir)
+            index = backend(data_dir, create=True)
+            index.add_many(make_documents(self.NGRAM_FIELDS))
+            self.indexes[name] = index
+
+    def tearDown(self):
+        for index in self.indexes.values():
+            index.close()
+        for data_dir in self._dirs:
+            shutil.rmtree(data_dir)
+
+    def keys(self, backend: str, query) -> set:
+        return {hit['message_key'] for hit in self.indexes[backend].search(query)}
+
+
+class NgramRoutingTest(BackendTestCase):
+    QUERIES = ['message:*appiness', '*ogue', '*atalog*', 'happ*', 'catalog*', '*unning',
+               'username:*bob*', 'username:bob*', 'username:*ert', 'username:*_smith']
+
+    def test_routed_queries_are_term_queries(self):
+        for text in self.QUERIES:
+            query = tgminer.backend.parse_query(text, ['message', 'username'])
+            self.assertEqual(type(query).__name__, 'Term', text)
+            self.assertTrue(query.fieldname.endswith('_ngram'), text)
+
+    def test_routed_results_match_unrouted(self):
+        for backend in self.indexes:
+            for text in self.QUERIES:
+                unrouted = self.keys(backend, tgminer.backend.parse_query(text))
+                routed = self.keys(backend, tgminer.backend.parse_query(text, ['message', 'username']))
+                self.assertTrue(unrouted, f'{backend}: {text}')
+                self.assertEqual(routed, unrouted, f'{backend}: {text}')
+
+
+class ContainsTest(BackendTestCase):
+    def test_contains(self):
+        for backend, index in self.indexes.items():
+            self.assertTrue(index.contains('-1001:0'), backend)
+            self.assertFalse(index.contains('-1001:99'), backend)
+
+    def test_contains_does_not_wait_for_writes(self):
+        for backend, index in self.indexes.items():
+            results = []
+
+            # the write lock is held for the whole of add_many, including the commit
+            with index._lock:
+                lookup = threading.Thread(target=lambda: results.append(index.contains('-1001:1')))
+                lookup.start()
+                lookup.join(5)
+
+            self.assertEqual(results, [True], backend)
+
+
+class QueryParityTest(BackendTestCase):
+    QUERIES = ['catalogue', 'message:running', 'username:bobby', 'chat_id:-1001',
+               'message:happ*', 'username:bob*',
+               'message:*alog*', 'username:*ob*',
+               '"catalogue of happiness"', 'message:"the dialogue"',
+               'NOT username:bobby', 'happiness NOT catalogue', 'happiness AND NOT username:alice',
+               'message_id:[1 TO 3]', 'message_id:{1 TO 3}', 'message_id:[2 TO]', 'from_id:[101 TO 102]',
+               'date:[20200102 TO 20200104]', 'timestamp:[2020-01-02 TO 2020-01-03]', 'username:[b TO c]',
+               'date:>20200103']
+
+    def test_sqlite_results_match_whoosh(self):
+        for text in self.QUERIES:
+            query = tgminer.backend.parse_query(text)
+            self.assertEqual(self.keys('sqlite', query), self.keys('whoosh', query), text)
+
+    def test_iter_values_match(self):
+        names = ['username', 'media_type', 'timestamp']
+
+        for query in (None, tgminer.backend.parse_query('happ*')):
+            whoosh_values = sorted(self.indexes['whoosh'].iter_values(query, names))
+            sqlite_values = sorted(self.indexes['sqlite'].iter_values(query, names))
+            self.assertTrue(whoosh_values)
+            self.assertEqual(sqlite_values, whoosh_values, query)
+
+
+class RepeatsTest(BackendTestCase):
+    def test_flood_filter_counts_land_on_stored_documents(self):
+        documents = {fields['message_key']: fields for fields in make_documents(self.NGRAM_FIELDS)}
+
+        for backend, index in self.indexes.items():
+            flood_filter = tgminer.flood.FloodFilter(60, 10, 0.5, 2, 10,
+                                                     lambda key, repeats: index.set_repeats(documents[key], repeats))
+
+            self.assertFalse(flood_filter.check(-1001, 'A catalogue of happiness', '-1001:0', now=0))
+            self.assertTrue(flood_filter.check(-1001, 'a CATALOGUE of happiness!', '-1001:5', now=1))
+            self.assertTrue(flood_filter.check(-1001, 'A catalogue of  happiness', '-1001:6', now=2))
+            flood_filter.drain()
+
+            repeats = {hit['message_key']: hit.get('repeats', None)
+                       for hit in index.search(tgminer.backend.parse_query('catalogue'))}
+            self.assertEqual(repeats, {'-1001:0': 2}, backend)
+
+    def test_missing_documents_are_not_added(self):
+        fields = dict(make_documents(self.NGRAM_FIELDS)[0], message_key='-1001:99', message_id=99)
+
+        for backend, index in self.indexes.items():
+            index.set_repeats(fields, 3)
+            self.assertFalse(index.contains('-1001:99'), backend)
+
+
+def _try_interprocess_lock(lock_path: str) -> bool:
+    lock = fasteners.InterProcessLock(lock_path)
+    acquired = lock.acquire(blocking=False)
+    if acquired:
+        lock.release()
+    return acquired
+
+
+class SessionTest(BackendTestCase):
+    def test_session_does_not_hold_interprocess_lock(self):
+        index = self.indexes['whoosh']
+        # file locks are per process, so another process has to try for it
+        with index.session(), multiprocessing.Pool(1) as pool:
+            self.assertTrue(pool.apply(_try_interprocess_lock, (index._lock_path,)))
+            self.assertEqual(self.keys('whoosh', tgminer.backend.parse_query('catalog*')), {'-1001:0', '-1001:4'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import io
+import os
+import tempfile
+import threading
+import unittest
+
+import tgminer.cio
+
+
+class OutputFile(io.FileIO):
+    """A temporary file which is not a terminal, so enc_print writes utf-8 to it."""
+
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp()
+        super().__init__(fd, 'r+')
+
+    def close(self):
+        super().close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def lines(self) -> list:
+        self.seek(0)
+        return self.read().decode('utf-8').splitlines()
+
+
+class BlockingFile(OutputFile):
+    """Blocks writes until released, like a terminal which stopped reading."""
+
+    def __init__(self):
+        super().__init__()
+        self.writing = threading.Event()
+        self.release = threading.Event()
+
+    def write(self, data: bytes) -> int:
+        self.writing.set()
+        self.release.wait(10)
+        return super().write(data)
+
+
+class ConsoleSinkTest(unittest.TestCase):
+    def test_close_prints_buffered_lines(self):
+        with OutputFile() as file:
+            sink = tgminer.cio.ConsoleSink(10, file=file)
+
+            for i in range(5):
+                self.assertTrue(sink.write(f'line {i}'))
+            sink.close()
+
+            self.assertEqual(file.lines(), [f'line {i}' for i in range(5)])
+
+    def test_dropped_line_summary(self):
+        with BlockingFile() as file:
+            sink = tgminer.cio.ConsoleSink(2, file=file)
+
+            # the thread takes the first line and blocks printing it
+            sink.write('first')
+            self.assertTrue(file.writing.wait(10))
+
+            self.assertTrue(sink.write('second'))
+            self.assertTrue(sink.write('third'))
+            self.assertFalse(sink.write('fourth'))
+            self.assertFalse(sink.write('fifth'))
+
+            file.release.set()
+            sink.close()
+
+            self.assertEqual(file.lines(),
+                             ['first', 'second', 'third', '... 2 line(s) dropped, the console could not keep up ...'])
+
+    def test_closed_file_does_not_stop_the_thread(self):
+        file = OutputFile()
+        file.close()
+
+        sink = tgminer.cio.ConsoleSink(10, file=file)
+        sink.write('lost')
+        sink.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
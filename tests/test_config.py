@@ -0,0 +1,96 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import tgminer.config
+
+
+class ConfigTestCase(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.data_dir, 'config.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def write(self, **options):
+        config = dict(api_key=dict(id=1, hash='x'), data_dir=self.data_dir)
+        config.update(options)
+        with open(self.path, 'w') as file:
+            json.dump(config, file)
+
+
+class ReloadTest(ConfigTestCase):
+    def test_restart_only_options_keep_their_values(self):
+        self.write(chat_stdout=False, download_workers=2)
+        config = tgminer.config.TGMinerConfig(self.path)
+
+        self.write(chat_stdout=True, download_workers=8)
+        new_config, ignored = config.reload()
+
+        self.assertTrue(new_config.chat_stdout)
+        self.assertEqual(new_config.download_workers, 2)
+        self.assertEqual(ignored, ['download_workers'])
+
+    def test_checked_with_the_options_that_take_effect(self):
+        self.write(index_message_storage=tgminer.config.MESSAGE_STORAGE_RAW_LOG)
+        config = tgminer.config.TGMinerConfig(self.path)
+
+        # raw log storage is still in use, so the raw logs cannot be turned off
+        self.write(index_message_storage=tgminer.config.MESSAGE_STORAGE_RAW_LOG, write_raw_logs=False)
+        with self.assertRaises(tgminer.config.TGMinerConfigException):
+            config.reload()
+
+        self.write(index_message_storage=tgminer.config.MESSAGE_STORAGE_INDEX, write_raw_logs=False)
+        with self.assertRaises(tgminer.config.TGMinerConfigException):
+            config.reload()
+
+    def test_restart_only_change_does_not_reject_reload(self):
+        self.write(write_raw_logs=False)
+        config = tgminer.config.TGMinerConfig(self.path)
+
+        # raw log storage would need the raw logs, but only takes effect after a restart
+        self.write(index_message_storage=tgminer.config.MESSAGE_STORAGE_RAW_LOG, write_raw_logs=False)
+        new_config, ignored = config.reload()
+
+        self.assertEqual(new_config.index_message_storage, tgminer.config.MESSAGE_STORAGE_INDEX)
+        self.assertEqual(ignored, ['index_message_storage'])
+
+
+class ValidationTest(ConfigTestCase):
+    def test_chat_stdout_buffer(self):
+        self.write(chat_stdout_buffer=0)
+
+        with self.assertRaises(tgminer.config.TGMinerConfigException) as raised:
+            tgminer.config.TGMinerConfig(self.path)
+
+        self.assertIn('chat_stdout_buffer', str(raised.exception))
+        self.assertIn('line', str(raised.exception))
+        self.assertNotIn('Count', str(raised.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import shutil
+import tempfile
+import types
+import unittest
+
+import tgminer.directory
+
+
+def make_user(user_id: int, username: str) -> types.SimpleNamespace:
+    return types.SimpleNamespace(id=user_id, username=username, first_name=username.title(), last_name=None)
+
+
+class ChatDirectoryTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.data_dir, tgminer.directory.DIRECTORY_FILE_NAME)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_seen_users_are_not_peers(self):
+        directory = tgminer.directory.ChatDirectory(self.path, 3600)
+        directory.set_peers([dict(id=1, username='contact', first_name='Contact', last_name=None)])
+
+        directory.remember_user(make_user(2, 'stranger'))
+        directory.remember_user(make_user(1, 'renamed_contact'))
+        directory.save()
+
+        directory = tgminer.directory.ChatDirectory(self.path, 3600)
+
+        self.assertEqual([peer['username'] for peer in directory.peers()], ['renamed_contact'])
+        self.assertEqual(directory.user(2).username, 'stranger')
+        self.assertIsNone(directory.user(3))
+
+    def test_refreshing_peers_keeps_seen_users(self):
+        directory = tgminer.directory.ChatDirectory(self.path, 3600)
+        directory.remember_user(make_user(2, 'stranger'))
+        directory.set_peers([])
+
+        self.assertEqual(directory.peers(), [])
+        self.assertEqual(directory.user(2).username, 'stranger')
+
+
+if __name__ == '__main__':
+    unittest.main()
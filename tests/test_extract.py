@@ -0,0 +1,112 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import codecs
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+import tgminer.extract
+
+DOCX_DOCUMENT = ('<?xml version="1.0" encoding="UTF-8"?>'
+                 '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+                 '<w:p><w:r><w:t>First </w:t></w:r><w:r><w:t>paragraph</w:t></w:r></w:p>'
+                 '<w:p><w:r><w:t>Second paragraph</w:t></w:r></w:p>'
+                 '</w:body></w:document>')
+
+ODT_CONTENT = ('<?xml version="1.0" encoding="UTF-8"?>'
+               '<office:document-content xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+               'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0"><office:body><office:text>'
+               '<text:h>A heading</text:h><text:p>Some <text:span>styled</text:span> text</text:p>'
+               '</office:text></office:body></office:document-content>')
+
+
+class ExtractTextTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def write(self, name: str, data) -> str:
+        path = os.path.join(self.data_dir, name)
+        with open(path, 'wb') as file:
+            file.write(data.encode('utf-8') if isinstance(data, str) else data)
+        return path
+
+    def write_zip(self, name: str, member: str, data: str) -> str:
+        path = os.path.join(self.data_dir, name)
+        with zipfile.ZipFile(path, 'w') as archive:
+            archive.writestr(member, data)
+        return path
+
+    def test_plain_text(self):
+        path = self.write('a.txt', codecs.BOM_UTF16_LE + 'hello world'.encode('utf-16-le'))
+        self.assertEqual(tgminer.extract.extract_text(path, 'text/plain'), 'hello world')
+
+    def test_char_limit(self):
+        path = self.write('a.txt', 'x' * 200000)
+
+        self.assertEqual(len(tgminer.extract.extract_text(path, 'text/plain', max_chars=100)), 100)
+        self.assertEqual(len(tgminer.extract.extract_text(path, 'text/plain')), 200000)
+
+    def test_time_limit(self):
+        path = self.write('a.html', '<p>paragraph</p>' * 100000)
+
+        text = tgminer.extract.extract_text(path, 'text/html', timeout=0.000001)
+        self.assertLess(len(text), len('paragraph\n') * 100000)
+
+    def test_html(self):
+        path = self.write('a.html', '<html><head><title>Title</title><style>p { color: red }</style>'
+                                    '<script>var x = 1;</script></head>'
+                                    '<body><p>One<br>Two</p><div>Three</div></body></html>')
+
+        self.assertEqual(tgminer.extract.extract_text(path, 'text/html; charset=utf-8'), 'Title\nOne\nTwo\nThree\n')
+
+    def test_docx(self):
+        path = self.write_zip('a.docx', 'word/document.xml', DOCX_DOCUMENT)
+
+        self.assertEqual(tgminer.extract.extract_text(path, tgminer.extract.DOCX_MIME_TYPE),
+                         'First paragraph\nSecond paragraph\n')
+
+    def test_odt(self):
+        path = self.write_zip('a.odt', 'content.xml', ODT_CONTENT)
+
+        self.assertEqual(tgminer.extract.extract_text(path, tgminer.extract.ODT_MIME_TYPE),
+                         'A heading\nSome styled text\n')
+
+    def test_unreadable_documents(self):
+        self.assertFalse(tgminer.extract.can_extract('image/png'))
+
+        with self.assertRaises(tgminer.extract.ExtractionError):
+            tgminer.extract.extract_text(self.write('a.png', b'\x89PNG'), 'image/png')
+
+        with self.assertRaises(tgminer.extract.ExtractionError):
+            tgminer.extract.extract_text(self.write('a.docx', b'not a zip file'), tgminer.extract.DOCX_MIME_TYPE)
+
+        with self.assertRaises(tgminer.extract.ExtractionError):
+            tgminer.extract.extract_text(self.write_zip('a.odt', 'other.xml', ''), tgminer.extract.ODT_MIME_TYPE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import unittest
+
+import tgminer.flood
+
+
+class FloodFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.expired = []
+        self.flood_filter = tgminer.flood.FloodFilter(window_seconds=60, window_size=10, similarity=0.5,
+                                                      shingle_size=2, min_length=10,
+                                                      on_expired=lambda item, repeats: self.expired.append(
+                                                          (item, repeats)))
+
+    def check(self, text: str, item=None, chat_id: int = -1001, now: float = 0) -> bool:
+        return self.flood_filter.check(chat_id, text, item, now=now)
+
+    def test_near_duplicates_in_window_are_merged(self):
+        self.assertFalse(self.check('Buy cheap coins now at the best exchange in town', 'first'))
+        self.assertTrue(self.check('buy cheap coins NOW, at the best exchange in town!', now=1))
+        self.assertTrue(self.check('Buy cheap coins now at the best exchange in the town', now=2))
+        self.assertFalse(self.check('Completely unrelated message about the weather', 'other', now=3))
+
+        self.flood_filter.drain()
+        self.assertEqual(self.expired, [('first', 2)])
+
+    def test_repeats_outside_window_start_a_new_window(self):
+        text = 'Buy cheap coins now at the best exchange in town'
+
+        self.assertFalse(self.check(text, 'first'))
+        self.assertTrue(self.check(text, now=30))
+
+        # the first copy expires when the next message arrives
+        self.assertFalse(self.check(text, 'second', now=61))
+        self.assertEqual(self.expired, [('first', 1)])
+
+        self.assertTrue(self.check(text, now=62))
+        self.flood_filter.drain()
+        self.assertEqual(self.expired, [('first', 1), ('second', 1)])
+
+    def test_chats_are_separate(self):
+        text = 'Buy cheap coins now at the best exchange in town'
+
+        self.assertFalse(self.check(text, 'a', chat_id=-1001))
+        self.assertFalse(self.check(text, 'b', chat_id=-1002))
+
+    def test_short_texts_are_never_repeats(self):
+        self.assertFalse(self.check('hi there'))
+        self.assertFalse(self.check('hi there'))
+
+    def test_window_size_evicts_oldest_text(self):
+        self.flood_filter.window_size = 2
+
+        self.assertFalse(self.check('first distinct message text', 'first'))
+        self.assertTrue(self.check('first distinct message text'))
+        self.assertFalse(self.check('a note about the garden party', 'second'))
+        self.assertFalse(self.check('meeting moved to thursday afternoon', 'third'))
+
+        self.assertEqual(self.expired, [('first', 1)])
+        self.assertFalse(self.check('first distinct message text', 'again'))
+
+    def test_drain_forgets_everything(self):
+        text = 'Buy cheap coins now at the best exchange in town'
+
+        self.assertFalse(self.check(text, 'first'))
+        self.flood_filter.drain()
+        self.assertEqual(self.expired, [])
+
+        self.assertFalse(self.check(text, 'second'))
+
+
+if __name__ == '__main__':
+    unittest.main()
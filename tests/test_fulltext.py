@@ -0,0 +1,71 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import tgminer.backend
+import tgminer.fulltext
+import tgminer.rawlog
+
+
+class MigrateIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.indexdir = os.path.join(self.data_dir, tgminer.backend.INDEX_DIR_NAME)
+
+        log_path = os.path.join(self.data_dir, 'chat', 'log.txt')
+        os.makedirs(os.path.dirname(log_path))
+
+        writer = tgminer.rawlog.RawLogWriter(self.data_dir)
+        message_ref = writer.append(log_path, 'user: a unicorn', 'a unicorn', message_id=1, date=1600000000)
+        writer.close()
+
+        with tgminer.backend.WhooshIndex(self.data_dir, create=True) as index:
+            index.add_many([dict(message='a unicorn', _stored_message=None, message_ref=message_ref,
+                                 username='user', chat='chat', message_id=1, message_key='-1:1',
+                                 timestamp=datetime.datetime(2020, 1, 1), date=datetime.datetime(2020, 1, 1))])
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def search(self, text: str) -> list:
+        with tgminer.backend.WhooshIndex(self.data_dir) as index:
+            return list(index.search(tgminer.backend.parse_query(text)))
+
+    def test_offloaded_messages_are_indexed_again(self):
+        self.assertEqual(len(self.search('unicorn')), 1)
+
+        with tgminer.rawlog.RawLogReader(self.data_dir) as raw_logs:
+            count = tgminer.fulltext.migrate_index(self.indexdir, read_message=raw_logs.read_message)
+
+        self.assertEqual(count, 1)
+
+        hits = self.search('unicorn')
+        self.assertEqual(len(hits), 1)
+        self.assertNotIn('message', hits[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+import tgminer.journal
+
+
+def document(i: int) -> dict:
+    return dict(message=f'message {i}', message_key=f'-1001:{i}')
+
+
+class IndexJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.data_dir, tgminer.journal.JOURNAL_FILE_NAME)
+        self.journal = tgminer.journal.IndexJournal(self.path)
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.data_dir)
+
+    def keys(self, path: str = None) -> list:
+        with open(path or self.path, encoding='utf-8') as file:
+            return [line.split('"message_key": "')[1].split('"')[0] for line in file if line.strip()]
+
+    def test_emptied_when_every_document_is_done(self):
+        self.journal.append(document(1))
+        self.journal.append(document(2))
+        self.assertEqual(self.keys(), ['-1001:1', '-1001:2'])
+
+        self.journal.done(2)
+        self.assertEqual(self.keys(), [])
+
+    def test_failed_documents_do_not_stop_truncation(self):
+        self.journal.append(document(1))
+        self.journal.append(document(2))
+        self.journal.failed(document(1))
+        self.journal.done()
+        self.assertEqual(self.keys(), [])
+        self.assertEqual(self.keys(self.path + '.failed'), ['-1001:1'])
+
+        for i in range(3, 6):
+            self.journal.append(document(i))
+            self.journal.done()
+
+        self.assertEqual(self.keys(), [])
+        self.assertEqual(self.keys(self.path + '.failed'), ['-1001:1'])
+
+    def test_replay_includes_failed_documents(self):
+        self.journal.append(document(1))
+        self.journal.append(document(2))
+        self.journal.failed(document(1))
+        self.journal.done()
+        self.journal.append(document(3))
+
+        index = RecordingIndex()
+        self.assertEqual(self.journal.replay(index), 2)
+        self.assertEqual(sorted(fields['message_key'] for fields in index.documents), ['-1001:1', '-1001:3'])
+        self.assertEqual(self.keys(), [])
+        self.assertFalse(os.path.exists(self.path + '.failed'))
+
+
+class RecordingIndex:
+    def __init__(self):
+        self.documents = []
+
+    def add_many(self, documents: list) -> int:
+        self.documents += documents
+        return len(documents)
+
+
+def _open_journal(data_dir: str, result):
+    # holds a journal open, like a running tgminer, until told to close it
+    journal, _ = tgminer.journal.open_journal(data_dir, RecordingIndex())
+    journal.append(document(1))
+    result.put(journal.path)
+    result.get()
+    journal.close()
+
+
+class OpenJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_journal_in_use_is_not_replayed(self):
+        context = multiprocessing.get_context('fork')
+        result = context.Queue()
+        process = context.Process(target=_open_journal, args=(self.data_dir, result))
+        process.start()
+
+        try:
+            other_path = result.get(timeout=10)
+
+            index = RecordingIndex()
+            journal, replayed = tgminer.journal.open_journal(self.data_dir, index)
+
+            self.assertEqual(replayed, 0)
+            self.assertNotEqual(journal.path, other_path)
+            self.assertTrue(os.path.getsize(other_path))
+            journal.close()
+        finally:
+            result.put(None)
+            process.join(10)
+
+    def test_journals_left_behind_are_replayed_and_removed(self):
+        for number, i in ((0, 1), (2, 2)):
+            journal = tgminer.journal.IndexJournal(tgminer.journal.journal_path(self.data_dir, number))
+            journal.append(document(i))
+            journal.close()
+
+        index = RecordingIndex()
+        journal, replayed = tgminer.journal.open_journal(self.data_dir, index)
+
+        self.assertEqual(replayed, 2)
+        self.assertEqual(journal.path, tgminer.journal.journal_path(self.data_dir))
+        self.assertFalse(os.path.exists(tgminer.journal.journal_path(self.data_dir, 2)))
+        journal.close()
+
+if __name__ == '__main__':
+    unittest.main()
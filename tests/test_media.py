@@ -0,0 +1,134 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import tgminer.media
+
+DATE = datetime.datetime(2020, 3, 4, 5, 6)
+
+NAME = '3f2a9c1e-0b4d-4e5f-8a6b-7c8d9e0f1a2b.jpg'
+
+
+class MediaSubdirTest(unittest.TestCase):
+    def test_layouts(self):
+        self.assertEqual(tgminer.media.media_subdir('flat', NAME, DATE), '')
+        self.assertEqual(tgminer.media.media_subdir('date', NAME, DATE), os.path.join('2020', '03', '04'))
+        self.assertEqual(tgminer.media.media_subdir('hash', NAME, DATE), '3f')
+        self.assertEqual(tgminer.media.media_subdir('date_hash', NAME, DATE), os.path.join('2020-03', '3f'))
+
+    def test_undated(self):
+        self.assertEqual(tgminer.media.media_subdir('date', NAME), 'undated')
+        self.assertEqual(tgminer.media.media_subdir('date_hash', NAME), os.path.join('undated', '3f'))
+        self.assertEqual(tgminer.media.media_subdir('hash', NAME), '3f')
+
+
+class MediaInfoPathTest(unittest.TestCase):
+    def test_document(self):
+        path = os.path.join('data', 'channels', '-1001', '2020-03', '3f', NAME)
+        info = f'(Document: "image/jpeg" - "holiday.jpg": {path})'
+
+        self.assertEqual(tgminer.media.media_info_path(info),
+                         ('(Document: "image/jpeg" - "holiday.jpg": ', path, NAME))
+
+    def test_flat_name_only(self):
+        self.assertEqual(tgminer.media.media_info_path(f'(Photo: {NAME})'), ('(Photo: ', NAME, NAME))
+
+    def test_nothing_downloaded(self):
+        self.assertIsNone(tgminer.media.media_info_path(None))
+        self.assertIsNone(tgminer.media.media_info_path(''))
+        self.assertIsNone(tgminer.media.media_info_path('(Photo: PHOTO DOWNLOADS DISABLED)'))
+        self.assertIsNone(tgminer.media.media_info_path(
+            '(Document: "text/plain" - "notes.txt": DOCNAME_FILTER DISCARDED FILE)'))
+
+
+class MediaFileTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def create(self, layout: str, date: datetime.datetime = DATE) -> str:
+        path = tgminer.media.new_media_path(layout, self.folder, date) + '.jpg'
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(b'media')
+        return path
+
+    def test_new_media_path(self):
+        for layout in tgminer.media.MEDIA_LAYOUTS:
+            path = tgminer.media.new_media_path(layout, self.folder, DATE)
+            name = os.path.basename(path)
+
+            self.assertTrue(os.path.isabs(path))
+            self.assertEqual(path, os.path.join(self.folder, tgminer.media.media_subdir(layout, name, DATE), name))
+
+    def test_layout_round_trip(self):
+        path = self.create('flat')
+        name = os.path.basename(path)
+
+        # flat -> date -> hash -> date_hash -> flat, found by its name from any of them
+        for layout in tgminer.media.MEDIA_LAYOUTS[1:] + ('flat',):
+            new_path = os.path.join(self.folder, tgminer.media.media_subdir(layout, name, DATE), name)
+
+            found = tgminer.media.find_media_file(path, self.folder, name, DATE)
+            self.assertEqual(found, path)
+
+            tgminer.media.move_media_file(found, new_path, self.folder)
+            self.assertFalse(os.path.exists(path))
+            path = new_path
+
+        self.assertEqual(os.listdir(self.folder), [name])
+
+    def test_find_in_other_layout(self):
+        path = self.create('date_hash')
+        name = os.path.basename(path)
+
+        recorded = os.path.join(self.folder, name)
+        self.assertEqual(tgminer.media.find_media_file(recorded, self.folder, name, DATE), path)
+
+        other_month = DATE - datetime.timedelta(days=40)
+        self.assertIsNone(tgminer.media.find_media_file(recorded, self.folder, name, other_month))
+
+    def test_move_keeps_shared_directories(self):
+        first = self.create('date')
+        second = self.create('date')
+
+        tgminer.media.move_media_file(first, os.path.join(self.folder, os.path.basename(first)), self.folder)
+
+        self.assertTrue(os.path.isfile(second))
+
+    def test_remove(self):
+        path = self.create('date_hash')
+
+        self.assertEqual(tgminer.media.remove_media_file(path, self.folder), len(b'media'))
+
+        # the emptied layout directories go, the chat folder stays
+        self.assertEqual(os.listdir(self.folder), [])
+
+        self.assertEqual(tgminer.media.remove_media_file(path, self.folder), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import pstats
+import shutil
+import tempfile
+import threading
+import unittest
+
+import tgminer.profiling
+
+
+def profiled_work(started: threading.Event, release: threading.Event):
+    started.set()
+    release.wait(10)
+
+
+class CProfileTest(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.profiler = tgminer.profiling.Profiler(self.output_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_stop_waits_for_running_calls(self):
+        self.assertTrue(self.profiler.start('cprofile'))
+
+        started, release = threading.Event(), threading.Event()
+        worker = threading.Thread(target=self.profiler.call, args=(profiled_work, started, release))
+        worker.start()
+        self.assertTrue(started.wait(10))
+
+        paths = []
+        stopper = threading.Thread(target=lambda: paths.append(self.profiler.stop()))
+        stopper.start()
+
+        stopper.join(0.2)
+        self.assertTrue(stopper.is_alive())
+        self.assertFalse(self.profiler.running)
+
+        release.set()
+        stopper.join(10)
+        worker.join(10)
+
+        functions = {name for _, _, name in pstats.Stats(paths[0]).stats}
+        self.assertIn('profiled_work', functions)
+
+    def test_call_after_stop_is_not_profiled(self):
+        self.profiler.start('cprofile')
+        self.profiler.stop()
+
+        self.assertEqual(self.profiler.call(lambda a: a + 1, 1), 2)
+        self.assertEqual(self.profiler._profiles, dict())
+
+
+if __name__ == '__main__':
+    unittest.main()
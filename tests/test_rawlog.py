@@ -0,0 +1,71 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import shutil
+import tempfile
+import types
+import unittest
+
+import tgminer.rawlog
+
+
+def rotation(max_bytes: int = 0) -> types.SimpleNamespace:
+    return types.SimpleNamespace(max_bytes=max_bytes, interval='none', compression='none', retain=0)
+
+
+class RotationTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.data_dir, 'chat', 'log.txt')
+        os.makedirs(os.path.dirname(self.log_path))
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def append(self, writer: tgminer.rawlog.RawLogWriter, message: str, message_id: int) -> str:
+        return writer.append(self.log_path, f'user: {message}', message, message_id=message_id, date=1600000000)
+
+    def read(self, ref: str) -> str:
+        return tgminer.rawlog.RawLogReader(self.data_dir).read_message(ref)
+
+    def test_refs_from_before_rotation_was_enabled(self):
+        writer = tgminer.rawlog.RawLogWriter(self.data_dir)
+        legacy_ref = self.append(writer, 'before rotation', 1)
+        writer.close()
+
+        writer = tgminer.rawlog.RawLogWriter(self.data_dir, rotation(max_bytes=1000))
+        new_ref = self.append(writer, 'after rotation', 2)
+
+        # the manifest exists, but the legacy entries are still in the active log
+        self.assertIsNotNone(tgminer.rawlog.load_manifest(self.log_path))
+        self.assertEqual(self.read(legacy_ref), 'before rotation')
+        self.assertEqual(self.read(new_ref), 'after rotation')
+
+        self.append(writer, 'x' * 1000, 3)
+        writer.close()
+
+        self.assertEqual(self.read(legacy_ref), 'before rotation')
+        self.assertEqual(self.read(new_ref), 'after rotation')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import os
+import shutil
+import tempfile
+import unittest
+
+import tgminer.backend
+import tgminer.capture
+import tgminer.config
+import tgminer.replay
+from test_tgminer import ClientTestCase, make_message
+
+
+class ReplayTest(ClientTestCase):
+    CONFIG = dict(update_capture=dict(enabled=True))
+
+    def setUp(self):
+        super().setUp()
+        self.replay_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.replay_dir)
+
+    def test_replay_capture(self):
+        account = self.client._primary_account
+
+        for message_id, text in enumerate(['first captured message', 'second captured message']):
+            self.client.receive_update(account, None, make_message(message_id, text), {}, {})
+        self.stop()
+
+        capture = os.path.join(self.data_dir, 'update_capture.bin')
+        self.assertEqual([item.account for item in tgminer.capture.read_capture(capture)], [account, account])
+
+        config = tgminer.config.TGMinerConfig(os.path.join(self.data_dir, 'config.json'))
+        client = tgminer.replay.replay_client(config, self.replay_dir)
+
+        try:
+            self.assertEqual(tgminer.replay.replay_capture(client, capture, workers=2), 2)
+        finally:
+            client.stop()
+
+        # the capture is not appended to while it is replayed
+        self.assertEqual(len(list(tgminer.capture.read_capture(capture))), 2)
+
+        with tgminer.backend.WhooshIndex(self.replay_dir) as index:
+            hits = list(index.search(tgminer.backend.parse_query('captured')))
+        self.assertEqual(sorted(hit['message'] for hit in hits),
+                         ['first captured message', 'second captured message'])
+
+        # the data directory the capture was made in is left alone
+        self.assertEqual(len(self.search('captured')), 2)
+        self.assertFalse(os.path.exists(os.path.join(self.replay_dir, 'update_capture.bin')))
+
+
+if __name__ == '__main__':
+    unittest.main()
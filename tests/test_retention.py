@@ -0,0 +1,137 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import datetime
+import re
+import types
+import unittest
+
+import tgminer.retention
+
+NOW = datetime.datetime(2020, 6, 1, 12)
+
+
+def days_ago(days: float) -> datetime.datetime:
+    return NOW - datetime.timedelta(days=days)
+
+
+def retention(max_age_days: int = 0, max_bytes: int = 0, chats: list = ()) -> types.SimpleNamespace:
+    return types.SimpleNamespace(max_age_days=max_age_days, max_bytes=max_bytes,
+                                 chats=[dict(chat_id=re.compile(chat_id), max_age_days=age, max_bytes=size)
+                                        for chat_id, age, size in chats])
+
+
+class ChatRuleTest(unittest.TestCase):
+    def test_first_matching_rule(self):
+        config = retention(30, chats=[('-1001', 7, 100), ('-100.*', 1, 0)])
+
+        self.assertEqual(tgminer.retention.chat_rule(config, -1001), (7, 100))
+        self.assertEqual(tgminer.retention.chat_rule(config, -1002), (1, 0))
+
+    def test_global_age_without_rule(self):
+        self.assertEqual(tgminer.retention.chat_rule(retention(30, 500), 12), (30, 0))
+
+
+class SizeCutoffTest(unittest.TestCase):
+    def test_empty(self):
+        self.assertIsNone(tgminer.retention._size_cutoff([], 10))
+
+    def test_everything_fits(self):
+        self.assertIsNone(tgminer.retention._size_cutoff([(days_ago(2), 5), (days_ago(1), 5)], 10))
+
+    def test_oldest_expire_first(self):
+        documents = [(days_ago(1), 4), (days_ago(3), 4), (days_ago(2), 4)]
+
+        cutoff = tgminer.retention._size_cutoff(documents, 10)
+
+        self.assertEqual([timestamp >= cutoff for timestamp, _ in documents], [True, False, True])
+
+    def test_limit_below_newest_size(self):
+        documents = [(days_ago(2), 1), (days_ago(1), 20)]
+
+        cutoff = tgminer.retention._size_cutoff(documents, 10)
+
+        self.assertTrue(all(timestamp < cutoff for timestamp, _ in documents))
+
+    def test_same_timestamp_expires_together(self):
+        documents = [(days_ago(1), 6), (days_ago(1), 6), (days_ago(0), 2)]
+
+        cutoff = tgminer.retention._size_cutoff(documents, 10)
+
+        kept = sum(size for timestamp, size in documents if timestamp >= cutoff)
+        self.assertEqual(kept, 2)
+
+
+class ExpiryCutoffsTest(unittest.TestCase):
+    def test_empty_index(self):
+        self.assertEqual(tgminer.retention.expiry_cutoffs({}, retention(30, 100), NOW), {})
+
+    def test_no_limits(self):
+        chats = {-1001: [(days_ago(1000), 10 ** 9)]}
+        self.assertEqual(tgminer.retention.expiry_cutoffs(chats, retention(), NOW), {})
+
+    def test_age(self):
+        chats = {-1001: [(days_ago(10), 1), (days_ago(1), 1)], -1002: [(days_ago(1), 1)]}
+
+        cutoffs = tgminer.retention.expiry_cutoffs(chats, retention(5), NOW)
+
+        # chats with nothing to expire are left out
+        self.assertEqual(cutoffs, {-1001: days_ago(5)})
+
+    def test_chat_rule_overrides_global_age(self):
+        chats = {-1001: [(days_ago(10), 1)], -1002: [(days_ago(10), 1)]}
+
+        cutoffs = tgminer.retention.expiry_cutoffs(chats, retention(5, chats=[('-1001', 30, 0)]), NOW)
+
+        self.assertEqual(list(cutoffs), [-1002])
+
+    def test_chat_size_limit(self):
+        chats = {-1001: [(days_ago(3), 5), (days_ago(2), 5), (days_ago(1), 5)]}
+
+        cutoff = tgminer.retention.expiry_cutoffs(chats, retention(chats=[('-1001', 0, 10)]), NOW)[-1001]
+
+        self.assertEqual([timestamp >= cutoff for timestamp, _ in chats[-1001]], [False, True, True])
+
+    def test_chat_size_limit_below_newest_size(self):
+        chats = {-1001: [(days_ago(2), 5), (days_ago(1), 50)]}
+
+        cutoff = tgminer.retention.expiry_cutoffs(chats, retention(chats=[('-1001', 0, 10)]), NOW)[-1001]
+
+        self.assertFalse(any(timestamp >= cutoff for timestamp, _ in chats[-1001]))
+
+    def test_global_size_limit_spans_chats(self):
+        chats = {-1001: [(days_ago(4), 5), (days_ago(1), 5)], -1002: [(days_ago(3), 5), (days_ago(2), 5)]}
+
+        cutoffs = tgminer.retention.expiry_cutoffs(chats, retention(max_bytes=10), NOW)
+
+        kept = {chat_id: [timestamp >= cutoffs.get(chat_id, timestamp) for timestamp, _ in documents]
+                for chat_id, documents in chats.items()}
+        self.assertEqual(kept, {-1001: [False, True], -1002: [False, True]})
+
+    def test_global_size_limit_after_chat_limits(self):
+        # the chat rule already expires the large old document, which then does not count globally
+        chats = {-1001: [(days_ago(10), 100), (days_ago(1), 5)], -1002: [(days_ago(2), 5)]}
+
+        cutoffs = tgminer.retention.expiry_cutoffs(chats, retention(max_bytes=10, chats=[('-1001', 5, 0)]), NOW)
+
+        self.assertEqual(cutoffs, {-1001: days_ago(5)})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,245 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import types
+import unittest
+
+from pyrogram.client.types import messages_and_media, user_and_chats
+
+import tgminer.backend
+import tgminer.config
+import tgminer.pipeline
+import tgminer.rawlog
+import tgminer.search
+import tgminer.tgminer
+from test_backend import make_documents
+
+
+def make_user(user_id: int, username: str) -> user_and_chats.User:
+    return user_and_chats.User(id=user_id, is_self=False, is_contact=False, is_mutual_contact=False,
+                               is_deleted=False, is_bot=False, first_name=username.title(), username=username)
+
+
+def make_message(message_id: int, text: str, chat_type: str = 'supergroup', chat_id: int = -1001,
+                 user: user_and_chats.User = None) -> messages_and_media.Message:
+    return messages_and_media.Message(message_id=message_id, date=1600000000 + message_id,
+                                      chat=user_and_chats.Chat(id=chat_id, type=chat_type, title='Test Chat'),
+                                      from_user=user or make_user(100, 'bobby'), text=text)
+
+
+class ClientTestCase(unittest.TestCase):
+    """Runs a real client, without connecting to telegram, fed updates by :py:meth:`receive`."""
+
+    CONFIG = {}
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.client = self.make_client()
+
+    def tearDown(self):
+        if self.client is not None:
+            self.client.stop()
+        shutil.rmtree(self.data_dir)
+
+    def make_client(self, mine: bool = True, **options) -> tgminer.tgminer.TGMinerClient:
+        config = dict(api_key=dict(id=1, hash='x'), data_dir=self.data_dir,
+                      session_path=os.path.join(self.data_dir, 'session'))
+        config.update(self.CONFIG)
+        config.update(options)
+
+        config_path = os.path.join(self.data_dir, 'config.json')
+        with open(config_path, 'w') as file:
+            json.dump(config, file)
+
+        return tgminer.tgminer.TGMinerClient(tgminer.config.TGMinerConfig(config_path), mine=mine)
+
+    def receive(self, message: messages_and_media.Message, account: str = None):
+        self.client._update_handler(account or self.client._primary_account, None, message, {}, {})
+
+    def stop(self):
+        """Stop the client once every received message has passed through the pipeline."""
+        self.client.stop()
+        self.client = None
+
+    def search(self, text: str) -> list:
+        with tgminer.backend.WhooshIndex(self.data_dir) as index:
+            return list(index.search(tgminer.backend.parse_query(text)))
+
+
+class RepeatCountTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.index = tgminer.backend.WhooshIndex(self.data_dir, create=True)
+
+        # only the parts of the client the index stage uses
+        client = tgminer.tgminer.TGMinerClient.__new__(tgminer.tgminer.TGMinerClient)
+        client._index = self.index
+        client._journal = None
+        client._in_flight = set()
+        client._in_flight_lock = threading.Lock()
+        client._repeats_lock = threading.Lock()
+        client._offload_message = False
+        client._index_stage = types.SimpleNamespace(put=client._index_message)
+        self.client = client
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.data_dir)
+
+    def item(self) -> tuple:
+        document = make_documents()[0]
+        item = tgminer.tgminer._IngestItem(None, None, None, -1001, 'test-chat', None, None, None,
+                                           document['message_key'],
+                                           types.SimpleNamespace(chat_stdout=False, write_raw_logs=False),
+                                           'test', None)
+        return item, document
+
+    def repeats(self) -> list:
+        return [hit.get('repeats', None) for hit in self.index.search(tgminer.backend.parse_query('catalogue'))]
+
+    def test_count_before_document_is_built(self):
+        item, document = self.item()
+
+        # the flood filter drained while the first copy was still being dispatched
+        self.client._queue_repeat_count(item, 3)
+
+        item.document = document
+        self.client._index_message(item)
+
+        self.assertEqual(self.repeats(), [3])
+
+    def test_count_after_document_is_indexed(self):
+        item, document = self.item()
+        item.document = document
+        self.client._index_message(item)
+
+        self.client._queue_repeat_count(item, 2)
+
+        self.assertEqual(self.repeats(), [2])
+
+
+class InFlightTest(ClientTestCase):
+    def test_failed_lookup_does_not_skip_the_message(self):
+        lookup = self.client._is_message_indexed
+
+        def busy(key):
+            raise RuntimeError('index busy')
+
+        self.client._is_message_indexed = busy
+        with self.assertRaises(RuntimeError):
+            self.receive(make_message(1, 'first delivery'))
+
+        self.client._is_message_indexed = lookup
+        self.receive(make_message(1, 'first delivery'))
+        self.stop()
+
+        self.assertEqual([hit['message_key'] for hit in self.search('delivery')], ['-1001:1'])
+
+
+class MultiAccountTest(ClientTestCase):
+    def make_client(self, mine: bool = True, **options) -> tgminer.tgminer.TGMinerClient:
+        options.setdefault('accounts', [dict(name=name, session_path=os.path.join(self.data_dir, name))
+                                        for name in ('first', 'second')])
+        return super().make_client(mine, **options)
+
+    def test_basic_group_copies_are_logged_per_account(self):
+        # basic group message ids are numbered separately for each account
+        self.receive(make_message(1, 'seen by the first account', chat_type='group', chat_id=-555), 'first')
+        self.receive(make_message(1, 'seen by the second account', chat_type='group', chat_id=-555), 'second')
+        self.stop()
+
+        hits = {hit['account']: hit for hit in self.search('seen')}
+        self.assertEqual(sorted(hits), ['first', 'second'])
+
+        with tgminer.rawlog.RawLogReader(self.data_dir) as raw_logs:
+            for account, hit in hits.items():
+                entries = tgminer.search.read_hit_context(raw_logs, hit, 0)
+                self.assertEqual(len(entries), 1, account)
+                self.assertIn(f'seen by the {account} account', entries[0][0])
+
+    def test_supergroup_messages_are_indexed_once(self):
+        self.receive(make_message(1, 'shared supergroup message'), 'first')
+        self.receive(make_message(1, 'shared supergroup message'), 'second')
+        self.stop()
+
+        self.assertEqual([hit['message_key'] for hit in self.search('supergroup')], ['-1001:1'])
+
+
+class DownloadWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.handled = []
+        self.dropped = []
+
+        self.stage = tgminer.pipeline.Stage('Extract', self.handled.append, 1, 4)
+        self.watcher = tgminer.tgminer._DownloadWatcher(self.stage, 2, self.dropped.append)
+        self.stage.start()
+        self.watcher.start()
+
+    def tearDown(self):
+        self.watcher.close()
+        self.stage.close()
+        shutil.rmtree(self.data_dir)
+
+    def write(self, name: str, size: int) -> str:
+        path = os.path.join(self.data_dir, name)
+        with open(path, 'wb') as file:
+            file.write(b'x' * size)
+        return path
+
+    def wait_for(self, condition, timeout: float = 5):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertTrue(condition())
+
+    def test_stalled_download_does_not_hold_up_others(self):
+        stalled = self.write('stalled', 10)
+        self.watcher.watch('stalled', stalled, 100, 2)
+
+        finished = self.write('finished', 100)
+        self.watcher.watch('finished', finished, 100, 2)
+
+        self.wait_for(lambda: self.handled == ['finished'])
+
+        # stalled downloads hold a place in the watch list until their deadline
+        self.watcher.watch('also stalled', stalled, 100, 1)
+        self.watcher.watch('full', finished, 100, 2)
+        self.assertEqual(self.dropped, ['full'])
+
+        self.wait_for(lambda: not self.watcher._watched)
+        self.assertEqual(self.handled, ['finished'])
+
+    def test_unknown_size_finishes_when_it_stops_growing(self):
+        path = self.write('unknown', 10)
+        self.watcher.watch('unknown', path, None, 0)
+
+        self.wait_for(lambda: self.handled == ['unknown'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,973 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import contextlib
+import datetime
+import os
+import re
+import shutil
+import sqlite3
+import threading
+
+import fasteners
+import whoosh.fields
+import whoosh.index
+import whoosh.query
+from whoosh import sorting
+from whoosh.qparser import QueryParser
+from whoosh.reading import SegmentReader
+from whoosh.util.times import long_to_datetime
+
+import tgminer.fulltext
+import tgminer.rawlog
+
+INDEX_BACKENDS = ('whoosh', 'sqlite')
+"""index_backend config values."""
+
+INDEX_DIR_NAME = 'indexdir'
+"""Name of the whoosh index directory in the data directory."""
+
+INTERPROCESS_MUTEX = 'tgminer_mutex'
+"""Name of the interprocess lock file guarding the whoosh index."""
+
+SQLITE_INDEX_FILE_NAME = 'index.sqlite3'
+"""Name of the SQLite index database in the data directory."""
+
+
+def parse_query(text: str, ngram_fields=()) -> whoosh.query.Query:
+    """Parse a tgminer-search query, the same query syntax is used by every backend.
+
+    :param text: Query text.
+    :param ngram_fields: Fields whose prefix and substring queries are routed to their
+                         n-gram companion field, see :py:class:`NgramQueryParser`.
+    :return: whoosh query.
+    """
+    return NgramQueryParser('message', tgminer.fulltext.LogSchema(), ngram_fields).parse(text)
+
+
+_NGRAM_QUERY_TEXT = re.compile(r'^\w+(?:\.\w+)*$')
+
+
+def _ngram_term(termclass, text: str):
+    text = text.lower()
+
+    if termclass is whoosh.query.Prefix:
+        core, gram = text, tgminer.fulltext.NGRAM_START_MARK + text
+    elif termclass is not whoosh.query.Wildcard:
+        return None
+    elif len(text) > 2 and text.startswith('*') and text.endswith('*'):
+        core = gram = text[1:-1]
+    elif text.startswith('*'):
+        core, gram = text[1:], text[1:] + tgminer.fulltext.NGRAM_END_MARK
+    elif text.endswith('*'):
+        core, gram = text[:-1], tgminer.fulltext.NGRAM_START_MARK + text[:-1]
+    else:
+        return None
+
+    if (not _NGRAM_QUERY_TEXT.match(core) or
+            not tgminer.fulltext.NGRAM_MIN_SIZE <= len(core) <= tgminer.fulltext.NGRAM_MAX_SIZE):
+        return None
+
+    return gram
+
+
+class NgramQueryParser(QueryParser):
+    """Parses prefix, suffix and substring queries on some fields into a term query on their n-gram companion field.
+
+    Only patterns with a single run of word characters are routed, such as ``foo*``, ``*foo``
+    and ``*foo*``, between :py:data:`tgminer.fulltext.NGRAM_MIN_SIZE` and
+    :py:data:`tgminer.fulltext.NGRAM_MAX_SIZE` characters long.  The rest scan the terms of
+    the field as usual.
+
+    Patterns are routed before the source field's analyzer sees them, n-grams are made from the
+    lower cased words of the field without stemming, so a stemmed pattern would not match them.
+    """
+
+    def __init__(self, fieldname: str, schema: whoosh.fields.Schema, ngram_fields=(), **kwargs):
+        """
+        :param fieldname: Default field.
+        :param schema: Schema.
+        :param ngram_fields: Source field names whose companion field is indexed for every document.
+        """
+        super().__init__(fieldname, schema, **kwargs)
+        self.ngram_fields = ngram_fields
+
+    def term_query(self, fieldname, text, termclass, boost=1.0, tokenize=True, removestops=True):
+        if fieldname in self.ngram_fields:
+            gram = _ngram_term(termclass, text)
+            if gram is not None:
+                return whoosh.query.Term(tgminer.fulltext.ngram_field_name(fieldname), gram, boost=boost)
+
+        return super().term_query(fieldname, text, termclass, boost=boost, tokenize=tokenize,
+                                  removestops=removestops)
+
+
+def date_filter(since: datetime.datetime = None, until: datetime.datetime = None):
+    """Build a whoosh filter query on the **timestamp** field.
+
+    Filters are applied to the matching documents before scoring.
+
+    :param since: Only messages logged at or after this time, or None.
+    :param until: Only messages logged before this time, or None.
+    :return: Filter query, or None if neither date is given.
+    """
+    if since is None and until is None:
+        return None
+    return whoosh.query.DateRange('timestamp', since, until, endexcl=True)
+
+
+def field_reader(reader, field: str):
+    """Get a function which returns the value of a field for a whoosh document number.
+
+    Values are read from the field's column when the index has one, so no stored
+    documents are loaded.  Indexes created before the field had column storage fall
+    back to reading stored fields, see: tgminer-index migrate.
+
+    :param reader: Index reader.
+    :param field: Field name.
+    :return: Function of a document number, returning None for empty values.
+    """
+    field_type = reader.schema[field] if field in reader.schema else None
+
+    if field_type is not None and field_type.column_type is not None:
+        # untranslated, segments without the column return None instead of failing to translate it
+        column = reader.column_reader(field, translate=False)
+        from_column = field_type.from_column_value
+
+        def get(docnum):
+            value = column[docnum]
+            return from_column(value) or None if value is not None else None
+
+        return get
+
+    return lambda docnum: reader.stored_fields(docnum).get(field, None) or None
+
+
+class IndexBackend:
+    """Storage and search of indexed messages, see :py:func:`open_index`.
+
+    Documents are dicts of :py:class:`tgminer.fulltext.LogSchema` fields.  A document with
+    **_stored_message** set to None has its **message** indexed but not stored, it is read
+    from the raw log with its **message_ref** instead.
+    """
+
+    def contains(self, key: str) -> bool:
+        """Test if a message is indexed, without waiting for a write to the index to finish.
+
+        :param key: :py:func:`tgminer.fulltext.message_key` of the message.
+        :return: True or False.
+        """
+        raise NotImplementedError()
+
+    def add(self, fields: dict) -> bool:
+        """Add a document unless a document with the same **message_key** is indexed.
+
+        :param fields: Document fields.
+        :return: True if added, False if it was a duplicate.
+        """
+        return self.add_many([fields]) == 1
+
+    def add_many(self, documents: list) -> int:
+        """Add documents in one commit, skipping any whose **message_key** is already indexed.
+
+        :param documents: List of document fields.
+        :return: Number of documents added.
+        """
+        raise NotImplementedError()
+
+    def set_repeats(self, fields: dict, repeats: int):
+        """Record how many times an indexed message was repeated, see :py:class:`tgminer.flood.FloodFilter`.
+
+        Nothing is added if the message is not indexed.
+
+        :param fields: Fields the document was added with.
+        :param repeats: Number of repeats.
+        """
+        raise NotImplementedError()
+
+    def set_document_text(self, fields: dict, text: str):
+        """Record the text extracted from the downloaded document of an indexed message.
+
+        :param fields: Fields the document was added with.
+        :param text: Extracted text, see :py:func:`tgminer.extract.extract_text`.
+        """
+        raise NotImplementedError()
+
+    def iter_documents(self):
+        """Iterate over every document in the index.
+
+        :return: Iterator over (document id, dict of stored fields).
+        """
+        raise NotImplementedError()
+
+    def replace_documents(self, replacements: list):
+        """Replace documents in one commit, tgminer must not be writing to the index.
+
+        Both the old and new fields must include the **message** text, even when it is not stored.
+
+        :param replacements: List of (document id from :py:meth:`iter_documents`, old fields, new fields).
+        """
+        raise NotImplementedError()
+
+    def delete_documents(self, documents: list) -> int:
+        """Delete documents in one commit, then merge the parts of the index they were deleted from.
+
+        tgminer must not be writing to the index.  The fields must include the **message** text,
+        even when it is not stored.
+
+        :param documents: List of (document id from :py:meth:`iter_documents`, fields).
+        :return: Number of documents deleted.
+        """
+        raise NotImplementedError()
+
+    def has_field(self, name: str) -> bool:
+        """Test if the index can group by a field, older whoosh indexes need migrating first.
+
+        :param name: :py:class:`tgminer.fulltext.LogSchema` field name.
+        """
+        return True
+
+    def search(self, query: whoosh.query.Query, limit: int = None,
+               since: datetime.datetime = None, until: datetime.datetime = None):
+        """Iterate over the stored fields of the documents matching a query, oldest first.
+
+        :param query: Query from :py:func:`parse_query`.
+        :param limit: Maximum number of results, None for all.
+        :param since: Only messages logged at or after this time, or None.
+        :param until: Only messages logged before this time, or None.
+        :return: Iterator over dicts of stored fields.
+        """
+        raise NotImplementedError()
+
+    def count(self, query: whoosh.query.Query, group_by: str = None, top: int = None,
+              since: datetime.datetime = None, until: datetime.datetime = None):
+        """Count query results, optionally grouped by a field, without loading stored fields.
+
+        :param query: Query from :py:func:`parse_query`.
+        :param group_by: A --group-by choice, see :py:data:`tgminer.fulltext.GROUP_BY_FIELDS`, or None.
+        :param top: Only return this many of the largest groups, None for all.
+        :param since: Only messages logged at or after this time, or None.
+        :param until: Only messages logged before this time, or None.
+        :return: (total count, list of (group value, count) sorted by count, or None if not grouping)
+        """
+        raise NotImplementedError()
+
+    def has_column(self, name: str) -> bool:
+        """Test if a field's values can be read without loading stored documents.
+
+        Older whoosh indexes have no column storage for some fields, see: tgminer-index migrate.
+
+        :param name: :py:class:`tgminer.fulltext.LogSchema` field name.
+        """
+        return True
+
+    def iter_values(self, query: whoosh.query.Query, names: list):
+        """Iterate over the values of some fields for every document matching a query.
+
+        Empty values are None.
+
+        :param query: Query from :py:func:`parse_query`, or None for every document.
+        :param names: :py:class:`tgminer.fulltext.LogSchema` field names.
+        :return: Iterator over tuples of field values.
+        """
+        raise NotImplementedError()
+
+    @contextlib.contextmanager
+    def session(self):
+        """Run many searches and counts against one searcher.
+
+        The searcher is a snapshot of the index when the session starts, any interprocess index
+        lock is only held while opening it, so writers are not held up for the whole session.
+
+        :return: Context manager.
+        """
+        yield self
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class WhooshIndex(IndexBackend):
+    """The whoosh index in **data_dir/indexdir**, guarded by the interprocess index lock."""
+
+    def __init__(self, data_dir: str, create: bool = False):
+        """
+        :param data_dir: Data directory.
+        :param create: Create the index if it does not exist, and upgrade the schema of an existing one.
+        """
+        self._indexdir = os.path.join(data_dir, INDEX_DIR_NAME)
+        self._lock_path = os.path.join(data_dir, INTERPROCESS_MUTEX)
+        self._lock = threading.Lock()
+
+        if create:
+            with fasteners.InterProcessLock(self._lock_path):
+                self._index = tgminer.fulltext.open_or_create_index(self._indexdir)
+        else:
+            self._index = whoosh.index.open_dir(self._indexdir)
+
+        # contains() has its own searcher and lock, so lookups do not wait for commits
+        self._searcher = None
+        self._searcher_lock = threading.Lock()
+        self._session_searcher = None
+
+    @property
+    def index(self) -> whoosh.index.Index:
+        """The whoosh index."""
+        return self._index
+
+    def contains(self, key: str) -> bool:
+        with self._searcher_lock:
+            self._searcher = self._searcher.refresh() if self._searcher else self._index.searcher()
+            return self._searcher.document_number(message_key=key) is not None
+
+    def add_many(self, documents: list) -> int:
+        count = 0
+
+        with self._lock, fasteners.InterProcessLock(self._lock_path):
+            writer = self._index.writer()
+            try:
+                with writer.searcher() as searcher:
+                    for fields in documents:
+                        key = fields.get('message_key', None)
+                        if key is not None and searcher.document_number(message_key=key) is not None:
+                            continue
+                        writer.add_document(**tgminer.fulltext.fill_sortable_fields(
+                            tgminer.fulltext.expand_ngram_fields(fields)))
+                        count += 1
+
+                if count:
+                    writer.commit()
+                else:
+                    writer.cancel()
+            except Exception:
+                writer.cancel()
+                raise
+
+        return count
+
+    def set_repeats(self, fields, repeats):
+        with self._lock, fasteners.InterProcessLock(self._lock_path):
+            writer = self._index.writer()
+            try:
+                with writer.searcher() as searcher:
+                    if searcher.document_number(message_key=fields['message_key']) is None:
+                        writer.cancel()
+                        return
+
+                # whoosh can only replace the whole document, the message text is indexed again
+                writer.update_document(**tgminer.fulltext.fill_sortable_fields(
+                    tgminer.fulltext.expand_ngram_fields(dict(fields, repeats=repeats))))
+                writer.commit()
+            except Exception:
+                writer.cancel()
+                raise
+
+    def set_document_text(self, fields, text):
+        with self._lock, fasteners.InterProcessLock(self._lock_path):
+            writer = self._index.writer()
+            try:
+                writer.update_document(**tgminer.fulltext.fill_sortable_fields(
+                    tgminer.fulltext.expand_ngram_fields(dict(fields, document_text=text))))
+                writer.commit()
+            except Exception:
+                writer.cancel()
+                raise
+
+    def iter_documents(self):
+        with fasteners.InterProcessLock(self._lock_path):
+            with self._index.reader() as reader:
+                yield from reader.iter_docs()
+
+    def replace_documents(self, replacements):
+        with self._lock, fasteners.InterProcessLock(self._lock_path):
+            writer = self._index.writer()
+            try:
+                for docnum, _, fields in replacements:
+                    writer.delete_document(docnum)
+                    writer.add_document(**tgminer.fulltext.fill_sortable_fields(
+                        tgminer.fulltext.expand_ngram_fields(fields)))
+                writer.commit()
+            except Exception:
+                writer.cancel()
+                raise
+
+    def delete_documents(self, documents):
+        with self._lock, fasteners.InterProcessLock(self._lock_path):
+            writer = self._index.writer()
+            try:
+                for docnum, _ in documents:
+                    writer.delete_document(docnum)
+                writer.commit(mergetype=_merge_deleted)
+            except Exception:
+                writer.cancel()
+                raise
+
+        return len(documents)
+
+    def has_field(self, name: str) -> bool:
+        return name in self._index.schema
+
+    def has_column(self, name: str) -> bool:
+        return name in self._index.schema and self._index.schema[name].column_type is not None
+
+    def iter_values(self, query, names):
+        with self._searching() as searcher:
+            reader = searcher.reader()
+            getters = [field_reader(reader, name) for name in names]
+
+            docnums = searcher.docs_for_query(query) if query is not None else reader.all_doc_ids()
+
+            for docnum in docnums:
+                yield tuple(getter(docnum) for getter in getters)
+
+    @contextlib.contextmanager
+    def session(self):
+        with fasteners.InterProcessLock(self._lock_path):
+            searcher = self._index.searcher()
+
+        with searcher:
+            self._session_searcher = searcher
+            try:
+                yield self
+            finally:
+                self._session_searcher = None
+
+    @contextlib.contextmanager
+    def _searching(self):
+        if self._session_searcher is not None:
+            yield self._session_searcher
+            return
+
+        with fasteners.InterProcessLock(self._lock_path):
+            with self._index.searcher() as searcher:
+                yield searcher
+
+    def search(self, query, limit=None, since=None, until=None):
+        with self._searching() as searcher:
+            for hit in searcher.search(query, limit=limit, sortedby='timestamp',
+                                       filter=date_filter(since, until)):
+                yield hit.fields()
+
+    def count(self, query, group_by=None, top=None, since=None, until=None):
+        facet = sorting.FieldFacet(tgminer.fulltext.GROUP_BY_FIELDS[group_by]) if group_by else None
+
+        with self._searching() as searcher:
+            # limit=1 still counts and groups every match, and skips collecting the full result list
+            results = searcher.search(query, limit=1, scored=False, groupedby=facet, maptype=sorting.Count,
+                                      filter=date_filter(since, until))
+
+            if not group_by:
+                return len(results), None
+
+            groups = sorted(results.groups().items(), key=lambda item: (-item[1], item[0]))
+
+            return len(results), groups[:top] if top else groups
+
+    def close(self):
+        if self._searcher is not None:
+            self._searcher.close()
+        self._index.close()
+
+
+def _merge_deleted(writer, segments):
+    # whoosh merge policy, rewrites every segment with deleted documents so they stop taking up space
+    unchanged = []
+
+    for segment in segments:
+        if segment.has_deletions():
+            with SegmentReader(writer.storage, writer.schema, segment) as reader:
+                writer.add_reader(reader)
+        else:
+            unchanged.append(segment)
+
+    return unchanged
+
+
+def _sqlite_column_type(field: whoosh.fields.FieldType) -> str:
+    if isinstance(field, whoosh.fields.DATETIME):
+        return 'REAL'
+    if isinstance(field, whoosh.fields.NUMERIC):
+        return 'INTEGER'
+    return 'TEXT'
+
+
+class SQLiteIndex(IndexBackend):
+    """An SQLite database in **data_dir/index.sqlite3**, with an FTS5 table for the text fields.
+
+    The database is in WAL mode, so searches in other processes do not wait for the
+    writer, and no interprocess lock is needed.
+
+    Every :py:class:`tgminer.fulltext.LogSchema` field has a column in the **documents** table.
+    TEXT fields are tokenized and stemmed with their whoosh analyzer, and the tokens are
+    indexed in the contentless **document_text** FTS5 table under the document's rowid,
+    so queries parsed by :py:func:`parse_query` match the same documents as with whoosh.
+    Text extracted from downloaded documents has its own table, **document_contents**.
+    """
+
+    def __init__(self, data_dir: str, create: bool = False):
+        """
+        :param data_dir: Data directory.
+        :param create: Create the database if it does not exist.
+        :raise FileNotFoundError: If the database does not exist and **create** is False.
+        """
+        self.path = os.path.join(data_dir, SQLITE_INDEX_FILE_NAME)
+
+        if not create and not os.path.isfile(self.path):
+            raise FileNotFoundError(f'No index exists in "{self.path}".')
+
+        self._schema = tgminer.fulltext.LogSchema()
+        self._ngram_fields = [tgminer.fulltext.ngram_field_name(name) for name in tgminer.fulltext.NGRAM_SOURCE_FIELDS]
+        self._columns = [name for name in self._schema.names() if name not in self._ngram_fields]
+        self._text_fields = [name for name in self._columns
+                             if isinstance(self._schema[name], whoosh.fields.TEXT) and name != 'document_text']
+
+        # maps each text field to the FTS5 table indexing it
+        self._text_tables = dict.fromkeys(self._text_fields, 'document_text')
+        self._text_tables['document_text'] = 'document_contents'
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+
+        with self._db:
+            self._create_tables()
+
+        # in WAL mode a second connection reads the last commit while the first one writes
+        self._reader_lock = threading.Lock()
+        self._reader = sqlite3.connect(self.path, check_same_thread=False)
+
+    def _create_tables(self):
+        self._db.execute('CREATE TABLE IF NOT EXISTS documents (rowid INTEGER PRIMARY KEY, {})'.format(
+            ', '.join(f'{name} {_sqlite_column_type(self._schema[name])}' +
+                      (' UNIQUE' if self._schema[name].unique else '')
+                      for name in self._columns)))
+
+        existing = {row[1] for row in self._db.execute('PRAGMA table_info(documents)')}
+        for name in self._columns:
+            if name not in existing:
+                self._db.execute(f'ALTER TABLE documents ADD COLUMN {name} {_sqlite_column_type(self._schema[name])}')
+
+        for name in ('timestamp',) + tgminer.fulltext.SORTABLE_TEXT_FIELDS:
+            self._db.execute(f'CREATE INDEX IF NOT EXISTS documents_{name} ON documents ({name})')
+
+        # tokens are produced by the whoosh analyzers, the tokenizer only splits them at spaces
+        self._db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS document_text USING fts5({}, content='', "
+                         "tokenize=\"unicode61 remove_diacritics 0 tokenchars '.'\")"
+                         .format(', '.join(self._text_fields)))
+
+        self._db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS document_terms USING fts5vocab(document_text, 'col')")
+
+        # the columns of an FTS5 table are fixed, so later text fields need a table of their own
+        self._db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS document_contents USING fts5(document_text, content='', "
+                         "tokenize=\"unicode61 remove_diacritics 0 tokenchars '.'\")")
+
+        self._db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS document_content_terms "
+                         "USING fts5vocab(document_contents, 'col')")
+
+        # n-gram companion fields, only documents with ngram_fields have a row
+        self._db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS document_ngrams USING fts5({}, content='', detail=column, "
+                         "tokenize=\"unicode61 remove_diacritics 0 tokenchars '.^$_'\")"
+                         .format(', '.join(self._ngram_fields)))
+
+    def _tokens(self, name: str, value) -> str:
+        if not value:
+            return ''
+        return ' '.join(self._schema[name].process_text(value, mode='index'))
+
+    @staticmethod
+    def _to_column(value):
+        if isinstance(value, datetime.datetime):
+            return value.timestamp()
+        return value
+
+    def _insert(self, fields: dict) -> bool:
+        values = self._column_values(fields)
+
+        cursor = self._db.execute('INSERT OR IGNORE INTO documents ({}) VALUES ({})'.format(
+            ', '.join(self._columns), ', '.join('?' * len(self._columns))), [values[name] for name in self._columns])
+
+        if cursor.rowcount != 1:
+            return False
+
+        self._insert_text(cursor.lastrowid, fields)
+
+        return True
+
+    def _column_values(self, fields: dict) -> dict:
+        values = {name: self._to_column(fields.get(name, None)) for name in self._columns}
+
+        if '_stored_message' in fields:
+            values['message'] = fields['_stored_message']
+
+        return values
+
+    def _insert_text(self, rowid: int, fields: dict, command: str = None):
+        # a contentless table can only delete a row given the tokens it was inserted with
+        self._db.execute('INSERT INTO document_text ({}rowid, {}) VALUES ({}?, {})'.format(
+            'document_text, ' if command else '', ', '.join(self._text_fields),
+            '?, ' if command else '', ', '.join('?' * len(self._text_fields))),
+            ([command] if command else []) + [rowid] +
+            [self._tokens(name, fields.get(name, None)) for name in self._text_fields])
+
+        if fields.get('document_text', None):
+            self._db.execute('INSERT INTO document_contents ({}rowid, document_text) VALUES ({}?, ?)'.format(
+                'document_contents, ' if command else '', '?, ' if command else ''),
+                ([command] if command else []) + [rowid, self._tokens('document_text', fields['document_text'])])
+
+        names = (fields.get('ngram_fields', None) or '').split()
+        if names:
+            self._db.execute('INSERT INTO document_ngrams ({}rowid, {}) VALUES ({}?, {})'.format(
+                'document_ngrams, ' if command else '', ', '.join(self._ngram_fields),
+                '?, ' if command else '', ', '.join('?' * len(self._ngram_fields))),
+                ([command] if command else []) + [rowid] +
+                [self._tokens(tgminer.fulltext.ngram_field_name(name), fields.get(name, None))
+                 if name in names else '' for name in tgminer.fulltext.NGRAM_SOURCE_FIELDS])
+
+    def contains(self, key: str) -> bool:
+        with self._reader_lock:
+            return self._reader.execute('SELECT 1 FROM documents WHERE message_key = ?', (key,)).fetchone() is not None
+
+    def add_many(self, documents: list) -> int:
+        with self._lock, self._db:
+            return sum(1 for fields in documents if self._insert(fields))
+
+    def set_repeats(self, fields, repeats):
+        with self._lock, self._db:
+            self._db.execute('UPDATE documents SET repeats = ? WHERE message_key = ?', (repeats, fields['message_key']))
+
+    def set_document_text(self, fields, text):
+        with self._lock, self._db:
+            row = self._db.execute('SELECT rowid, document_text FROM documents WHERE message_key = ?',
+                                   (fields['message_key'],)).fetchone()
+            if row is None:
+                return
+
+            rowid, old_text = row
+
+            if old_text:
+                self._db.execute("INSERT INTO document_contents (document_contents, rowid, document_text) "
+                                 "VALUES ('delete', ?, ?)", (rowid, self._tokens('document_text', old_text)))
+
+            self._db.execute('UPDATE documents SET document_text = ? WHERE rowid = ?', (text or None, rowid))
+
+            if text:
+                self._db.execute('INSERT INTO document_contents (rowid, document_text) VALUES (?, ?)',
+                                 (rowid, self._tokens('document_text', text)))
+
+    def iter_documents(self):
+        for row in self._db.cursor().execute('SELECT rowid, {} FROM documents'.format(', '.join(self._columns))):
+            yield row[0], self._from_row(row[1:])
+
+    def replace_documents(self, replacements):
+        with self._lock, self._db:
+            for rowid, old_fields, fields in replacements:
+                self._insert_text(rowid, old_fields, 'delete')
+
+                values = self._column_values(fields)
+                self._db.execute('UPDATE documents SET {} WHERE rowid = ?'.format(
+                    ', '.join(f'{name} = ?' for name in self._columns)),
+                    [values[name] for name in self._columns] + [rowid])
+
+                self._insert_text(rowid, fields)
+
+    def delete_documents(self, documents):
+        with self._lock, self._db:
+            for rowid, fields in documents:
+                self._insert_text(rowid, fields, 'delete')
+                self._db.execute('DELETE FROM documents WHERE rowid = ?', (rowid,))
+
+            # merge the full text index b-trees, which drops the deleted tokens
+            self._db.execute("INSERT INTO document_text (document_text) VALUES ('optimize')")
+            self._db.execute("INSERT INTO document_ngrams (document_ngrams) VALUES ('optimize')")
+            self._db.execute("INSERT INTO document_contents (document_contents) VALUES ('optimize')")
+
+        return len(documents)
+
+    def _where(self, query, since, until):
+        compiler = _SQLiteQueryCompiler(self._db, self._schema, self._text_tables, self._ngram_fields)
+        sql = compiler.compile(query)
+        params = compiler.params
+
+        if since is not None:
+            sql += ' AND timestamp >= ?'
+            params.append(since.timestamp())
+
+        if until is not None:
+            sql += ' AND timestamp < ?'
+            params.append(until.timestamp())
+
+        return sql, params
+
+    def _from_row(self, row) -> dict:
+        fields = {}
+        for name, value in zip(self._columns, row):
+            if value is None or not self._schema[name].stored:
+                continue
+            if isinstance(self._schema[name], whoosh.fields.DATETIME):
+                value = datetime.datetime.fromtimestamp(value)
+            fields[name] = value
+        return fields
+
+    def search(self, query, limit=None, since=None, until=None):
+        where, params = self._where(query, since, until)
+
+        sql = 'SELECT {} FROM documents WHERE {} ORDER BY timestamp, rowid'.format(', '.join(self._columns), where)
+        if limit:
+            sql += f' LIMIT {int(limit)}'
+
+        for row in self._db.cursor().execute(sql, params):
+            yield self._from_row(row)
+
+    def count(self, query, group_by=None, top=None, since=None, until=None):
+        where, params = self._where(query, since, until)
+
+        if not group_by:
+            return self._db.execute(f'SELECT COUNT(*) FROM documents WHERE {where}', params).fetchone()[0], None
+
+        column = tgminer.fulltext.GROUP_BY_FIELDS[group_by]
+
+        groups = [(value or '', count) for value, count in self._db.execute(
+            f'SELECT {column}, COUNT(*) FROM documents WHERE {where} GROUP BY {column}', params)]
+
+        groups.sort(key=lambda item: (-item[1], item[0]))
+
+        return sum(count for _, count in groups), groups[:top] if top else groups
+
+    def iter_values(self, query, names):
+        where, params = self._where(query, None, None) if query is not None else ('1', [])
+
+        datetimes = [isinstance(self._schema[name], whoosh.fields.DATETIME) for name in names]
+
+        for row in self._db.cursor().execute(f'SELECT {", ".join(names)} FROM documents WHERE {where}', params):
+            yield tuple(datetime.datetime.fromtimestamp(value) if is_datetime and value is not None else value or None
+                        for value, is_datetime in zip(row, datetimes))
+
+    def close(self):
+        self._reader.close()
+        self._db.close()
+
+
+def _glob_escape(text: str) -> str:
+    return ''.join(f'[{c}]' if c in '*?[' else c for c in text)
+
+
+def _fts_string(text: str) -> str:
+    return '"' + text.replace('"', '""') + '"'
+
+
+_VOCABULARY_TABLES = {'document_text': 'document_terms', 'document_contents': 'document_content_terms'}
+
+
+class _SQLiteQueryCompiler:
+    """Compiles a parsed whoosh query into an SQL condition on the **documents** table."""
+
+    def __init__(self, db: sqlite3.Connection, schema: whoosh.fields.Schema, text_tables: dict, ngram_fields: list):
+        self._db = db
+        self._schema = schema
+        self._text_tables = text_tables
+        self._ngram_fields = ngram_fields
+        self.params = []
+
+    def _match(self, expression: str, table: str = 'document_text') -> str:
+        self.params.append(expression)
+        return f'rowid IN (SELECT rowid FROM {table} WHERE {table} MATCH ?)'
+
+    def _value(self, field, value):
+        if isinstance(value, bytes):
+            value = self._schema[field].from_bytes(value)
+        if isinstance(self._schema[field], whoosh.fields.DATETIME):
+            if isinstance(value, int):
+                value = long_to_datetime(value)
+            return value.timestamp()
+        return value
+
+    def _wildcard(self, field: str, pattern: str) -> str:
+        # FTS5 only has prefix queries, wildcards are expanded to the matching terms of the field
+        table = self._text_tables[field]
+
+        terms = [row[0] for row in self._db.execute(
+            f'SELECT term FROM {_VOCABULARY_TABLES[table]} WHERE col = ? AND term GLOB ?', (field, pattern))]
+
+        if not terms:
+            return '0'
+
+        return self._match(f'{field} : (' + ' OR '.join(_fts_string(term) for term in terms) + ')', table)
+
+    def compile(self, query) -> str:
+        if isinstance(query, whoosh.query.Every):
+            field = query.fieldname
+            if not field or field == '*':
+                return '1'
+            if field == 'message':
+                return "(message IS NOT NULL AND message != '' OR message_ref IS NOT NULL)"
+            return f"({field} IS NOT NULL AND {field} != '')"
+
+        # the parser makes its own null queries, not only the whoosh.query.NullQuery instance
+        if isinstance(query, type(whoosh.query.NullQuery)):
+            return '0'
+
+        if isinstance(query, whoosh.query.And):
+            return '(' + ' AND '.join(self.compile(q) for q in query.subqueries) + ')'
+
+        if isinstance(query, whoosh.query.Or):
+            return '(' + ' OR '.join(self.compile(q) for q in query.subqueries) + ')'
+
+        if isinstance(query, whoosh.query.Not):
+            return f'NOT {self.compile(query.query)}'
+
+        if isinstance(query, whoosh.query.AndNot):
+            return f'({self.compile(query.a)} AND NOT {self.compile(query.b)})'
+
+        if isinstance(query, (whoosh.query.AndMaybe, whoosh.query.Require)):
+            return self.compile(query.a)
+
+        if isinstance(query, whoosh.query.Phrase):
+            return self._match(f'{query.fieldname} : {_fts_string(" ".join(query.words))}',
+                               self._text_tables.get(query.fieldname, 'document_text'))
+
+        if (isinstance(query, (whoosh.query.NumericRange, whoosh.query.TermRange)) and
+                query.fieldname not in self._text_tables):
+            conditions = []
+            if query.start is not None:
+                conditions.append(f'{query.fieldname} {">" if query.startexcl else ">="} ?')
+                self.params.append(self._value(query.fieldname, query.start))
+            if query.end is not None:
+                conditions.append(f'{query.fieldname} {"<" if query.endexcl else "<="} ?')
+                self.params.append(self._value(query.fieldname, query.end))
+            return '(' + (' AND '.join(conditions) or '1') + ')'
+
+        if isinstance(query, whoosh.query.Prefix):
+            if query.fieldname in self._text_tables:
+                return self._match(f'{query.fieldname} : {_fts_string(query.text)} *',
+                                   self._text_tables[query.fieldname])
+            self.params.append(_glob_escape(query.text) + '*')
+            return f'{query.fieldname} GLOB ?'
+
+        if isinstance(query, whoosh.query.Wildcard):
+            if query.fieldname in self._text_tables:
+                return self._wildcard(query.fieldname, query.text)
+            self.params.append(query.text)
+            return f'{query.fieldname} GLOB ?'
+
+        if isinstance(query, whoosh.query.Term):
+            if query.fieldname in self._ngram_fields:
+                return self._match(f'{query.fieldname} : {_fts_string(query.text)}', 'document_ngrams')
+            if query.fieldname in self._text_tables:
+                return self._match(f'{query.fieldname} : {_fts_string(query.text)}', self._text_tables[query.fieldname])
+            self.params.append(self._value(query.fieldname, query.text))
+            return f'{query.fieldname} = ?'
+
+        raise ValueError(f'{type(query).__name__} queries are not supported by the sqlite index backend.')
+
+
+def index_exists(config) -> bool:
+    """Test if the index of the configured backend exists.
+
+    :param config: The config.
+    """
+    if config.index_backend == 'sqlite':
+        return os.path.isfile(os.path.join(config.data_dir, SQLITE_INDEX_FILE_NAME))
+    return whoosh.index.exists_in(os.path.join(config.data_dir, INDEX_DIR_NAME))
+
+
+def routed_ngram_fields(config, index: IndexBackend) -> list:
+    """Get the fields whose prefix and substring queries can be routed to an n-gram companion field.
+
+    :param config: The config, for **ngram_fields**.
+    :param index: The index, older whoosh indexes may not have the companion fields yet.
+    :return: List of source field names, for :py:func:`parse_query`.
+    """
+    return [name for name in config.ngram_fields if index.has_field(tgminer.fulltext.ngram_field_name(name))]
+
+
+def open_index(config, create: bool = False) -> IndexBackend:
+    """Open the index of the backend selected by the **index_backend** config option.
+
+    :param config: The config.
+    :param create: Create the index if it does not exist.
+    :return: The index.
+    """
+    if config.index_backend == 'sqlite':
+        return SQLiteIndex(config.data_dir, create)
+    return WhooshIndex(config.data_dir, create)
+
+
+def convert_whoosh_index(index: whoosh.index.Index, data_dir: str, batch_size: int = 1000) -> int:
+    """Copy every document of a whoosh index into a new SQLite index in **data_dir**.
+
+    Documents are converted with :py:func:`tgminer.fulltext.migrate_document`.  Messages which
+    are only stored in the raw logs are read back from them to be indexed.  The database is
+    written under a temporary name and replaces any existing SQLite index once complete.
+
+    :param index: The whoosh index, the caller must hold the interprocess index lock.
+    :param data_dir: Data directory.
+    :param batch_size: Number of documents added per commit.
+    :return: The number of documents converted.
+    """
+    path = os.path.join(data_dir, SQLITE_INDEX_FILE_NAME)
+    temp_dir = os.path.join(data_dir, SQLITE_INDEX_FILE_NAME + '.convert')
+
+    # leftovers from an interrupted conversion
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+
+    count = 0
+
+    try:
+        with SQLiteIndex(temp_dir, create=True) as sqlite_index, \
+                tgminer.rawlog.RawLogReader(data_dir) as raw_logs, \
+                index.reader() as reader:
+
+            batch = []
+
+            for _, fields in reader.iter_docs():
+                fields = tgminer.fulltext.migrate_document(fields)
+
+                if 'message' not in fields and fields.get('message_ref', None):
+                    fields['message'] = raw_logs.read_message(fields['message_ref'])
+                    fields['_stored_message'] = None
+
+                batch.append(fields)
+
+                if len(batch) == batch_size:
+                    count += sqlite_index.add_many(batch)
+                    batch = []
+
+            count += sqlite_index.add_many(batch)
+
+        # the write-ahead log of a replaced database must not be applied to the new one
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+        os.replace(os.path.join(temp_dir, SQLITE_INDEX_FILE_NAME), path)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    return count
@@ -0,0 +1,212 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import io
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+
+import pyrogram
+from pyrogram.client.types import messages_and_media
+from pyrogram.client.types import user_and_chats
+
+CAPTURE_MAGIC = b'TGMCAP1\n'
+"""Header at the start of every update capture file."""
+
+_RECORD_HEADER = struct.Struct('<dI')
+
+_DICTIONARY_HEADER = struct.Struct('<I')
+
+_CLIENT_REFERENCE = 'client'
+
+
+class CapturedUpdate:
+    """An update read back from a capture file, with the arguments tgminer received it with."""
+
+    def __init__(self, received: float, account: str, update, users: dict, chats: dict):
+        """
+        :param received: Unix time the update was received at.
+        :param account: Name of the account which received the update.
+        """
+        self.received = received
+        self.account = account
+        self.update = update
+        self.users = users
+        self.chats = chats
+
+
+class _UpdatePickler(pickle.Pickler):
+    # parsed updates reference the client which received them, it is replaced when reading
+    def persistent_id(self, obj):
+        if isinstance(obj, pyrogram.Client):
+            return _CLIENT_REFERENCE
+        return None
+
+
+class _UpdateUnpickler(pickle.Unpickler):
+    def __init__(self, file, client):
+        super().__init__(file)
+        self._client = client
+
+    def persistent_load(self, pid):
+        if pid == _CLIENT_REFERENCE:
+            return self._client
+        raise pickle.UnpicklingError(f'Unknown persistent reference "{pid}".')
+
+
+def _pickle_update(account: str, update, users: dict, chats: dict) -> bytes:
+    buffer = io.BytesIO()
+    _UpdatePickler(buffer, pickle.HIGHEST_PROTOCOL).dump((account, update, users, chats))
+    return buffer.getvalue()
+
+
+def _compression_dictionary() -> bytes:
+    # an empty message pickle holds the class paths and attribute names repeated in every record,
+    # which would otherwise be most of a compressed record
+    user = user_and_chats.User(id=0, is_self=False, is_contact=False, is_mutual_contact=False,
+                               is_deleted=False, is_bot=False, first_name='')
+    message = messages_and_media.Message(message_id=0, chat=user_and_chats.Chat(id=0, type=''), from_user=user)
+    return _pickle_update('', message, {}, {})
+
+
+def _read_header(file, path: str) -> bytes:
+    if file.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+        raise ValueError(f'"{path}" is not an update capture file.')
+
+    header = file.read(_DICTIONARY_HEADER.size)
+    if len(header) < _DICTIONARY_HEADER.size:
+        raise ValueError(f'"{path}" is not an update capture file.')
+
+    return file.read(_DICTIONARY_HEADER.unpack(header)[0])
+
+
+def _records_end(file) -> int:
+    end = file.tell()
+    while True:
+        header = file.read(_RECORD_HEADER.size)
+        if len(header) < _RECORD_HEADER.size:
+            return end
+
+        length = _RECORD_HEADER.unpack(header)[1]
+        if len(file.read(length)) < length:
+            return end
+
+        end = file.tell()
+
+
+class UpdateCaptureWriter:
+    """Append-only capture of the updates passed to :py:meth:`tgminer.tgminer.TGMinerClient._update_handler`.
+
+    Each record is the receive time and the length of its data, followed by the zlib compressed
+    pickle of the account name, the update and the **users** / **chats** maps, using a preset
+    dictionary stored in the file header.  Records are written from the update threads as they
+    arrive, a partially written last record from a crash is ignored by :py:func:`read_capture`
+    and cut off before appending to the file again.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: Capture file path, created if it does not exist.
+        """
+        if os.path.isfile(path) and os.path.getsize(path):
+            with open(path, 'rb') as file:
+                self._dictionary = _read_header(file, path)
+                end = _records_end(file)
+            self._file = open(path, 'ab')
+            self._file.truncate(end)
+        else:
+            self._dictionary = _compression_dictionary()
+            self._file = open(path, 'wb')
+            self._file.write(CAPTURE_MAGIC + _DICTIONARY_HEADER.pack(len(self._dictionary)) + self._dictionary)
+
+        self._lock = threading.Lock()
+
+        self.skipped = 0
+
+    def write(self, account: str, update, users: dict, chats: dict):
+        """Append an update to the capture.
+
+        Updates which can not be pickled are counted in **skipped** instead.
+
+        :param account: Name of the account which received the update.
+        """
+        received = time.time()
+
+        try:
+            data = _pickle_update(account, update, users, chats)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            with self._lock:
+                self.skipped += 1
+            return
+
+        compressor = zlib.compressobj(1, zdict=self._dictionary)
+        data = compressor.compress(data) + compressor.flush()
+
+        with self._lock:
+            self._file.write(_RECORD_HEADER.pack(received, len(data)) + data)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def capture_path(config) -> str:
+    """Get the path of the update capture file, relative paths are relative to the data directory.
+
+    :param config: The config.
+    :return: Capture file path.
+    """
+    return os.path.join(config.data_dir, config.update_capture.path)
+
+
+def read_capture(path: str, client=None):
+    """Read the updates in a capture file, in the order they were received.
+
+    Capture files are pickles, only read captures you made yourself.
+
+    :param path: Capture file path.
+    :param client: Object put in place of the client referenced by parsed updates.
+    :raise ValueError: If the file is not an update capture.
+    :return: Generator over :py:class:`CapturedUpdate` objects.
+    """
+    with open(path, 'rb') as file:
+        dictionary = _read_header(file, path)
+
+        while True:
+            header = file.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                return
+
+            received, length = _RECORD_HEADER.unpack(header)
+
+            data = file.read(length)
+            if len(data) < length:
+                return
+
+            decompressor = zlib.decompressobj(zdict=dictionary)
+            data = decompressor.decompress(data) + decompressor.flush()
+
+            account, update, users, chats = _UpdateUnpickler(io.BytesIO(data), client).load()
+
+            yield CapturedUpdate(received, account, update, users, chats)
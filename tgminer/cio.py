@@ -20,6 +20,7 @@
 
 import os
 import sys
+import threading
 
 
 def enc_print(*args, sep: str = ' ', end: str = '\n', file=None, flush: bool = False, encoding: str = 'utf-8'):
@@ -64,3 +65,72 @@ def enc_print(*args, sep: str = ' ', end: str = '\n', file=None, flush: bool = F
 
     if hasattr(file, 'flush') and flush:
         file.flush()
+
+
+class ConsoleSink:
+    """Prints lines from a background thread, so a slow terminal, SSH session or pipe never blocks the caller.
+
+    Up to **max_lines** lines wait in a buffer, which the thread prints together with one
+    flush.  Lines written while the buffer is full are dropped, and a line saying how many
+    were dropped is printed in their place.
+    """
+
+    def __init__(self, max_lines: int, file=None):
+        """
+        :param max_lines: Maximum number of lines waiting to be printed.
+        :param file: File object to print to, defaults to **sys.stdout** at the time of printing.
+        """
+        self._max_lines = max_lines
+        self._file = file
+
+        self._lines = []
+        self._dropped = 0
+        self._closed = False
+        self._ready = threading.Condition()
+
+        self._thread = threading.Thread(target=self._work, name='ConsoleSink', daemon=True)
+        self._thread.start()
+
+    def write(self, line: str) -> bool:
+        """Queue a line for printing without waiting.
+
+        :param line: Line of text, without a line terminator.
+        :return: False if the buffer was full and the line was dropped.
+        """
+        with self._ready:
+            if len(self._lines) >= self._max_lines:
+                self._dropped += 1
+                return False
+
+            self._lines.append(line)
+            self._ready.notify()
+            return True
+
+    def _work(self):
+        while True:
+            with self._ready:
+                while not self._lines and not self._dropped and not self._closed:
+                    self._ready.wait()
+
+                if not self._lines and not self._dropped:
+                    return
+
+                # lines are only dropped while the buffer is full, so they all came after the buffered lines
+                lines, self._lines = self._lines, []
+                dropped, self._dropped = self._dropped, 0
+
+            if dropped:
+                lines.append(f'... {dropped} line(s) dropped, the console could not keep up ...')
+
+            try:
+                enc_print('\n'.join(lines), file=self._file, flush=True)
+            except (OSError, ValueError):
+                # a closed terminal or pipe must not stop the caller, lines printed to it are lost
+                pass
+
+    def close(self):
+        """Print every buffered line, then stop the thread."""
+        with self._ready:
+            self._closed = True
+            self._ready.notify()
+        self._thread.join()
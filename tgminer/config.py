@@ -25,9 +25,33 @@ import re
 import dschema
 import jsoncomment
 
+import tgminer.backend
+import tgminer.fulltext
+import tgminer.media
+import tgminer.profiling
+import tgminer.rawlog
+
 CONFIG_ENV_VAR = 'TGMINER_CONFIG'
 """Environmental var for specifying config location."""
 
+MESSAGE_STORAGE_INDEX = 'index'
+"""index_message_storage value, message text is stored in the full text index."""
+
+MESSAGE_STORAGE_RAW_LOG = 'raw_log'
+"""index_message_storage value, the index stores a reference to the message text in the raw logs."""
+
+
+RESTART_REQUIRED_OPTIONS = ('api_key', 'session_path', 'accounts', 'data_dir', 'download_workers',
+                            'updates_workers', 'pipeline', 'index_backend', 'index_journal',
+                            'index_message_storage', 'raw_log_rotation', 'config_watch_interval', 'profiling',
+                            'flood_filter', 'update_capture', 'document_text', 'chat_stdout_buffer')
+"""Options which only take effect when tgminer is restarted, :py:meth:`TGMinerConfig.reload` keeps their old values."""
+
+
+def _option_value(value):
+    # dschema namespaces do not implement equality
+    return vars(value) if isinstance(value, dschema.Namespace) else value
+
 
 def get_config_path(command_line_path):
     env_config = os.environ.get(CONFIG_ENV_VAR,
@@ -42,7 +66,13 @@ class TGMinerConfigException(Exception):
 
 
 class TGMinerConfig:
-    def __init__(self, path: str):
+    def __init__(self, path: str, running: 'TGMinerConfig' = None):
+        """
+        :param path: Config file path.
+        :param running: Config in use by the running tgminer, whose :py:data:`RESTART_REQUIRED_OPTIONS`
+                        values are kept, see :py:meth:`reload`.
+        :raise TGMinerConfigException: If the config file is not valid.
+        """
         self.config_path = path
 
         def regex_type(value):
@@ -59,6 +89,108 @@ class TGMinerConfig:
 
             return value
 
+        def buffer_lines_type(value):
+            try:
+                value = int(value)
+            except Exception:
+                raise ValueError('Must be an integer number of lines.')
+
+            if value < 1:
+                raise ValueError('The buffer must hold at least 1 line.')
+
+            return value
+
+        def message_storage_type(value):
+            if value not in (MESSAGE_STORAGE_INDEX, MESSAGE_STORAGE_RAW_LOG):
+                raise ValueError(f'Must be "{MESSAGE_STORAGE_INDEX}" or "{MESSAGE_STORAGE_RAW_LOG}".')
+            return value
+
+        def non_negative_type(value):
+            try:
+                value = int(value)
+            except Exception:
+                raise ValueError('Must be an integer value.')
+
+            if value < 0:
+                raise ValueError('Must not be negative.')
+
+            return value
+
+        def choice_type(choices):
+            def choice(value):
+                if value not in choices:
+                    raise ValueError('Must be one of: ' + ', '.join(f'"{c}"' for c in choices))
+                return value
+
+            return choice
+
+        def similarity_type(value):
+            try:
+                value = float(value)
+            except Exception:
+                raise ValueError('Must be a number.')
+
+            if not 0 < value <= 1:
+                raise ValueError('Must be greater than 0 and at most 1.')
+
+            return value
+
+        def accounts_type(value):
+            if not isinstance(value, list):
+                raise ValueError('Must be a list of accounts.')
+
+            accounts = []
+            for account in value:
+                if not isinstance(account, dict):
+                    raise ValueError('Each account must be an object.')
+
+                name = account.get('name', None)
+                if not isinstance(name, str) or not re.match(r'^[\w-]+$', name):
+                    raise ValueError('Each account needs a "name" made of letters, digits, "_" or "-".')
+
+                if name in (a['name'] for a in accounts):
+                    raise ValueError(f'Account name "{name}" is used more than once.')
+
+                api_key = account.get('api_key', None)
+                if api_key is not None and (not isinstance(api_key, dict) or
+                                            not isinstance(api_key.get('id', None), int) or
+                                            not isinstance(api_key.get('hash', None), str)):
+                    raise ValueError(f'Account "{name}" api_key needs an integer "id" and a string "hash".')
+
+                accounts.append({'name': name,
+                                 'session_path': account.get('session_path', name),
+                                 'api_key': api_key})
+
+            return accounts
+
+        def ngram_fields_type(value):
+            if not isinstance(value, list) or any(name not in tgminer.fulltext.NGRAM_SOURCE_FIELDS for name in value):
+                raise ValueError('Must be a list of field names from: ' +
+                                 ', '.join(f'"{name}"' for name in tgminer.fulltext.NGRAM_SOURCE_FIELDS))
+
+            # in schema order, so documents record them the same way whatever the config order
+            return [name for name in tgminer.fulltext.NGRAM_SOURCE_FIELDS if name in value]
+
+        def retention_rules_type(value):
+            if not isinstance(value, list):
+                raise ValueError('Must be a list of retention rules.')
+
+            rules = []
+            for rule in value:
+                if not isinstance(rule, dict) or not isinstance(rule.get('chat_id', None), str):
+                    raise ValueError('Each retention rule must be an object with a "chat_id" regex.')
+
+                try:
+                    chat_id = regex_type(rule['chat_id'])
+                except re.error as e:
+                    raise ValueError(f'Retention rule chat_id "{rule["chat_id"]}" is not a valid regex: {e}')
+
+                rules.append({'chat_id': chat_id,
+                              'max_age_days': non_negative_type(rule.get('max_age_days', 0)),
+                              'max_bytes': non_negative_type(rule.get('max_bytes', 0))})
+
+            return rules
+
         self._validator = dschema.Validator({
             'api_key': {
                 'id': dschema.prop(required=True, type=int),
@@ -66,8 +198,10 @@ class TGMinerConfig:
                 dschema.Required: True
             },
             'session_path': dschema.prop(default='tgminer'),
+            'accounts': dschema.prop(default=[], type=accounts_type),
             'data_dir': dschema.prop(default='data'),
             'chat_stdout': dschema.prop(default=False, type=bool),
+            'chat_stdout_buffer': dschema.prop(default=1000, type=buffer_lines_type),
             'timestamp_format': dschema.prop(default='({:%Y/%m/%d - %I:%M:%S %p})'),
 
             'group_filters': {
@@ -108,8 +242,41 @@ class TGMinerConfig:
 
             'download_audio': dschema.prop(default=True, type=bool),
 
+            'media_layout': dschema.prop(default='flat', type=choice_type(tgminer.media.MEDIA_LAYOUTS)),
+
+            'download_size_limits': {
+                'documents': dschema.prop(default=0, type=non_negative_type),
+                'animations': dschema.prop(default=0, type=non_negative_type),
+                'videos': dschema.prop(default=0, type=non_negative_type)
+            },
+
             'write_raw_logs': dschema.prop(default=True, type=bool),
 
+            'index_backend': dschema.prop(default='whoosh', type=choice_type(tgminer.backend.INDEX_BACKENDS)),
+
+            'index_journal': dschema.prop(default=True, type=bool),
+
+            'index_message_storage': dschema.prop(default=MESSAGE_STORAGE_INDEX, type=message_storage_type),
+
+            'ngram_fields': dschema.prop(default=[], type=ngram_fields_type),
+
+            'raw_log_format': dschema.prop(default='text',
+                                           type=choice_type(tuple(tgminer.rawlog.LOG_FORMAT_EXTENSIONS.keys()))),
+
+            'raw_log_rotation': {
+                'max_bytes': dschema.prop(default=0, type=non_negative_type),
+                'interval': dschema.prop(default='none', type=choice_type(tgminer.rawlog.ROTATION_INTERVALS)),
+                'compression': dschema.prop(default='gzip',
+                                            type=choice_type(tuple(tgminer.rawlog.COMPRESSION_EXTENSIONS.keys()))),
+                'retain': dschema.prop(default=0, type=non_negative_type)
+            },
+
+            'retention': {
+                'max_age_days': dschema.prop(default=0, type=non_negative_type),
+                'max_bytes': dschema.prop(default=0, type=non_negative_type),
+                'chats': dschema.prop(default=[], type=retention_rules_type)
+            },
+
             'docname_filter': dschema.prop(default='.*', type=regex_type),
 
             'log_direct_chats': dschema.prop(default=True, type=bool),
@@ -117,14 +284,64 @@ class TGMinerConfig:
 
             'download_workers': dschema.prop(default=4, type=workers_type),
             'updates_workers': dschema.prop(default=1, type=workers_type),
-            'log_update_threads': dschema.prop(default=False, type=bool)
+            'log_update_threads': dschema.prop(default=False, type=bool),
+
+            'config_watch_interval': dschema.prop(default=0, type=non_negative_type),
+
+            'directory_ttl': dschema.prop(default=86400, type=non_negative_type),
+
+            'flood_filter': {
+                'enabled': dschema.prop(default=False, type=bool),
+                'chat_id': dschema.prop(default='.*', type=regex_type),
+                'window_seconds': dschema.prop(default=300, type=workers_type),
+                'window_size': dschema.prop(default=200, type=workers_type),
+                'similarity': dschema.prop(default=0.8, type=similarity_type),
+                'shingle_size': dschema.prop(default=3, type=workers_type),
+                'min_length': dschema.prop(default=16, type=non_negative_type)
+            },
+
+            'profiling': {
+                'mode': dschema.prop(default='sample', type=choice_type(tgminer.profiling.PROFILE_MODES)),
+                'sample_interval_ms': dschema.prop(default=10, type=workers_type),
+                'slow_message_ms': dschema.prop(default=0, type=non_negative_type),
+                'control_socket': dschema.prop(default=None)
+            },
+
+            'document_text': {
+                'enabled': dschema.prop(default=False, type=bool),
+                'workers': dschema.prop(default=1, type=workers_type),
+                'queue_size': dschema.prop(default=64, type=workers_type),
+                'max_bytes': dschema.prop(default=1048576, type=non_negative_type),
+                'max_chars': dschema.prop(default=100000, type=non_negative_type),
+                'timeout_seconds': dschema.prop(default=10, type=non_negative_type),
+                'download_timeout_seconds': dschema.prop(default=300, type=non_negative_type)
+            },
+
+            'update_capture': {
+                'enabled': dschema.prop(default=False, type=bool),
+                'path': dschema.prop(default='update_capture.bin', type=str)
+            },
+
+            'pipeline': {
+                'queue_size': dschema.prop(default=256, type=workers_type),
+                'dispatch_workers': dschema.prop(default=1, type=workers_type),
+                'index_workers': dschema.prop(default=1, type=workers_type),
+                'raw_log_workers': dschema.prop(default=1, type=workers_type),
+                'console_workers': dschema.prop(default=1, type=workers_type)
+            }
         })
 
         self._config = None
 
-        self.load()
+        self._ignored = self.load(running)
+
+    def load(self, running: 'TGMinerConfig' = None) -> list:
+        """Load the config file.
 
-    def load(self):
+        :param running: Config whose :py:data:`RESTART_REQUIRED_OPTIONS` values are kept.
+        :raise TGMinerConfigException: If the config file is not valid.
+        :return: Names of restart only options which differ from **running** in the file.
+        """
         parser = jsoncomment.JsonComment(json)
         with open(self.config_path) as file:
             parsed_object = parser.load(file)
@@ -134,8 +351,49 @@ class TGMinerConfig:
         except dschema.ValidationError as e:
             raise TGMinerConfigException("Config Error: " + str(e))
 
+        api_key = vars(self._config.api_key)
+        if not self._config.accounts:
+            self._config.accounts = [{'name': os.path.basename(self._config.session_path) or 'tgminer',
+                                      'session_path': self._config.session_path,
+                                      'api_key': None}]
+
+        for account in self._config.accounts:
+            if account['api_key'] is None:
+                account['api_key'] = api_key
+
+        ignored = []
+
+        if running is not None:
+            # restored before the options are checked against each other, the file's values never take effect
+            for name in RESTART_REQUIRED_OPTIONS:
+                if _option_value(getattr(self._config, name)) != _option_value(getattr(running, name)):
+                    ignored.append(name)
+                setattr(self._config, name, getattr(running, name))
+
+        if (self._config.index_message_storage == MESSAGE_STORAGE_RAW_LOG and
+                not self._config.write_raw_logs):
+            raise TGMinerConfigException(
+                f'Config Error: index_message_storage "{MESSAGE_STORAGE_RAW_LOG}" requires write_raw_logs.')
+
         self.__dict__.update(self._config.__dict__)
 
+        return ignored
+
+    def reload(self):
+        """Load the config file again, into a new config object.
+
+        Options named in :py:data:`RESTART_REQUIRED_OPTIONS` keep their current values.
+
+        :raise TGMinerConfigException: If the config file is not valid.
+        :return: (new config, names of restart only options which were changed in the file)
+        """
+        try:
+            config = TGMinerConfig(self.config_path, running=self)
+        except (OSError, ValueError) as e:
+            raise TGMinerConfigException("Config Error: " + str(e))
+
+        return config, config._ignored
+
     def __repr__(self):
         return str(self._config)
 
@@ -0,0 +1,160 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DIRECTORY_FILE_NAME = 'directory.json'
+"""Name of the chat and peer directory cache in the data directory."""
+
+PEER_CHUNK_SIZE = 200
+"""Number of peers looked up per users.GetUsers request."""
+
+
+class DirectoryUser:
+    """A peer user from the directory, with the name attributes of a telegram user."""
+
+    def __init__(self, user_id: int, username: str, first_name: str, last_name: str):
+        self.id = user_id
+        self.username = username
+        self.first_name = first_name
+        self.last_name = last_name
+
+
+class ChatDirectory:
+    """On-disk cache of the chats and peer users of the account.
+
+    The cache is refreshed from telegram by **tgminer --show-chats/--show-peers** once it is older
+    than its TTL, and used by the miner to resolve users which are missing from an update.
+    Users seen in updates are remembered apart from the peers, so they are not listed by
+    **--show-peers**, and written with :py:meth:`save`.
+    """
+
+    def __init__(self, path: str, ttl: int):
+        """
+        :param path: Cache file path.
+        :param ttl: Seconds before cached chats and peers are fetched again, 0 to always fetch them.
+        """
+        self._path = path
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._changed = False
+
+        self._chats_updated = 0
+        self._peers_updated = 0
+        self._chats = OrderedDict()
+        self._peers = OrderedDict()
+        self._seen = OrderedDict()
+
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                cache = json.load(file)
+        except (OSError, ValueError):
+            return
+
+        self._chats_updated = cache.get('chats_updated', 0)
+        self._peers_updated = cache.get('peers_updated', 0)
+        self._chats = OrderedDict((chat['id'], chat) for chat in cache.get('chats', []))
+        self._peers = OrderedDict((peer['id'], peer) for peer in cache.get('peers', []))
+        self._seen = OrderedDict((peer['id'], peer) for peer in cache.get('seen', []))
+
+    def _fresh(self, updated: float) -> bool:
+        return self._ttl > 0 and time.time() - updated < self._ttl
+
+    def chats_fresh(self) -> bool:
+        return self._fresh(self._chats_updated)
+
+    def peers_fresh(self) -> bool:
+        return self._fresh(self._peers_updated)
+
+    def chats(self) -> list:
+        """Cached chats, dicts with the keys **type**, **id**, **title** and **slug**."""
+        with self._lock:
+            return list(self._chats.values())
+
+    def peers(self) -> list:
+        """Cached peers, dicts with the keys **id**, **username**, **first_name** and **last_name**."""
+        with self._lock:
+            return list(self._peers.values())
+
+    def set_chats(self, chats: list):
+        with self._lock:
+            self._chats = OrderedDict((chat['id'], chat) for chat in chats)
+            self._chats_updated = time.time()
+            self._changed = True
+
+    def set_peers(self, peers: list):
+        with self._lock:
+            self._peers = OrderedDict((peer['id'], peer) for peer in peers)
+            self._peers_updated = time.time()
+            self._changed = True
+
+    def remember_user(self, user):
+        """Add or update a user seen in an update, for :py:meth:`user` lookups.
+
+        :param user: Any object with **id**, **username**, **first_name** and **last_name** attributes.
+        """
+        peer = OrderedDict([('id', user.id),
+                            ('username', user.username),
+                            ('first_name', user.first_name),
+                            ('last_name', user.last_name)])
+
+        with self._lock:
+            # peers are kept up to date, anyone else is only remembered for lookups
+            users = self._peers if user.id in self._peers else self._seen
+
+            if users.get(user.id, None) != peer:
+                users[user.id] = peer
+                self._changed = True
+
+    def user(self, user_id: int):
+        """Look up a user.
+
+        :param user_id: Telegram user ID.
+        :return: :py:class:`DirectoryUser`, or None if the user is unknown.
+        """
+        with self._lock:
+            peer = self._peers.get(user_id, None) or self._seen.get(user_id, None)
+
+        if peer is None:
+            return None
+
+        return DirectoryUser(peer['id'], peer['username'], peer['first_name'], peer['last_name'])
+
+    def save(self):
+        """Write the cache if anything changed since it was loaded or last saved."""
+        with self._lock:
+            if not self._changed:
+                return
+
+            cache = OrderedDict([('chats_updated', self._chats_updated),
+                                 ('peers_updated', self._peers_updated),
+                                 ('chats', list(self._chats.values())),
+                                 ('peers', list(self._peers.values())),
+                                 ('seen', list(self._seen.values()))])
+
+            with open(self._path + '.tmp', 'w', encoding='utf-8') as file:
+                json.dump(cache, file, indent=4)
+            os.replace(self._path + '.tmp', self._path)
+
+            self._changed = False
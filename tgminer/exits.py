@@ -47,3 +47,8 @@ EX_CANTCREAT = 7
 """
 A (user specified) output file cannot be created.
 """
+
+EX_UNAVAILABLE = 8
+"""
+A service is unavailable.  This can occur if a support program or file does not exist.
+"""
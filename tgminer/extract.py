@@ -0,0 +1,202 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import codecs
+import html.parser
+import time
+import zipfile
+from xml.etree import ElementTree
+
+PLAIN_TEXT_MIME_TYPES = ('application/json', 'application/xml', 'application/javascript', 'application/x-sh',
+                         'application/x-yaml', 'application/sql', 'application/x-subrip')
+"""Non text/* MIME types of documents which are read as plain text."""
+
+HTML_MIME_TYPES = ('text/html', 'application/xhtml+xml')
+"""MIME types of documents whose text is read from between their tags."""
+
+DOCX_MIME_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+ODT_MIME_TYPE = 'application/vnd.oasis.opendocument.text'
+
+_READ_SIZE = 65536
+
+_DOCX_NAMESPACE = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+_ODT_NAMESPACE = '{urn:oasis:names:tc:opendocument:xmlns:text:1.0}'
+
+
+class ExtractionError(Exception):
+    """Raised when a document can not be read."""
+
+    def __init__(self, message):
+        super().__init__(message)
+
+
+class _LimitReached(Exception):
+    pass
+
+
+class _TextCollector:
+    """Collects extracted text until the character limit or the deadline is reached."""
+
+    def __init__(self, max_chars: int, timeout: float):
+        self._parts = []
+        self._remaining = max_chars if max_chars else None
+        self._deadline = time.monotonic() + timeout if timeout else None
+
+    def add(self, text: str):
+        if self._deadline is not None and time.monotonic() > self._deadline:
+            raise _LimitReached()
+
+        if self._remaining is not None:
+            text = text[:self._remaining]
+            self._remaining -= len(text)
+
+        self._parts.append(text)
+
+        if self._remaining == 0:
+            raise _LimitReached()
+
+    def text(self) -> str:
+        return ''.join(self._parts)
+
+
+def _decoded_chunks(file):
+    data = file.read(_READ_SIZE)
+
+    encoding = 'utf-16' if data.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)) else 'utf-8-sig'
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+
+    while data:
+        yield decoder.decode(data)
+        data = file.read(_READ_SIZE)
+
+    yield decoder.decode(b'', final=True)
+
+
+def _extract_plain(path: str, collector: _TextCollector):
+    with open(path, 'rb') as file:
+        for chunk in _decoded_chunks(file):
+            collector.add(chunk)
+
+
+class _HTMLText(html.parser.HTMLParser):
+    _SKIPPED_TAGS = ('script', 'style')
+
+    _BLOCK_TAGS = ('p', 'div', 'li', 'tr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'pre', 'blockquote', 'title')
+
+    def __init__(self, collector: _TextCollector):
+        super().__init__()
+        self._collector = collector
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self._SKIPPED_TAGS:
+            self._skipping += 1
+        elif tag == 'br':
+            self._collector.add('\n')
+
+    def handle_endtag(self, tag):
+        if tag in self._SKIPPED_TAGS and self._skipping:
+            self._skipping -= 1
+        elif tag in self._BLOCK_TAGS:
+            self._collector.add('\n')
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self._collector.add(data)
+
+
+def _extract_html(path: str, collector: _TextCollector):
+    parser = _HTMLText(collector)
+    with open(path, 'rb') as file:
+        for chunk in _decoded_chunks(file):
+            parser.feed(chunk)
+    parser.close()
+
+
+def _extract_docx(path: str, collector: _TextCollector):
+    with zipfile.ZipFile(path) as archive, archive.open('word/document.xml') as file:
+        for _, element in ElementTree.iterparse(file):
+            if element.tag == _DOCX_NAMESPACE + 't' and element.text:
+                collector.add(element.text)
+            elif element.tag == _DOCX_NAMESPACE + 'p':
+                collector.add('\n')
+                element.clear()
+
+
+def _extract_odt(path: str, collector: _TextCollector):
+    with zipfile.ZipFile(path) as archive, archive.open('content.xml') as file:
+        for _, element in ElementTree.iterparse(file):
+            if element.tag in (_ODT_NAMESPACE + 'p', _ODT_NAMESPACE + 'h'):
+                collector.add(''.join(element.itertext()) + '\n')
+                element.clear()
+
+
+def _extractor(mime_type: str):
+    mime_type = (mime_type or '').split(';')[0].strip().lower()
+
+    if mime_type in HTML_MIME_TYPES:
+        return _extract_html
+    if mime_type == DOCX_MIME_TYPE:
+        return _extract_docx
+    if mime_type == ODT_MIME_TYPE:
+        return _extract_odt
+    if mime_type.startswith('text/') or mime_type in PLAIN_TEXT_MIME_TYPES:
+        return _extract_plain
+    return None
+
+
+def can_extract(mime_type: str) -> bool:
+    """Test if text can be extracted from documents of a MIME type.
+
+    :param mime_type: Document MIME type, may be None.
+    """
+    return _extractor(mime_type) is not None
+
+
+def extract_text(path: str, mime_type: str, max_chars: int = 0, timeout: float = 0) -> str:
+    """Extract the text of a plain text, HTML, DOCX or ODT document.
+
+    Extraction stops early once **max_chars** characters are extracted or **timeout** seconds
+    have passed, the text extracted up to then is returned.
+
+    :param path: Document file path.
+    :param mime_type: Document MIME type, see :py:func:`can_extract`.
+    :param max_chars: Maximum number of characters to extract, 0 for no limit.
+    :param timeout: Maximum number of seconds to spend extracting, 0 for no limit.
+    :raise ExtractionError: If the document could not be read.
+    :return: Extracted text.
+    """
+    extractor = _extractor(mime_type)
+    if extractor is None:
+        raise ExtractionError(f'Cannot extract text from "{mime_type}" documents.')
+
+    collector = _TextCollector(max_chars, timeout)
+
+    try:
+        extractor(path, collector)
+    except _LimitReached:
+        pass
+    except (OSError, KeyError, zipfile.BadZipFile, ElementTree.ParseError) as e:
+        raise ExtractionError(f'Could not extract text from "{path}": {e}')
+
+    return collector.text()
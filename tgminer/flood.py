@@ -0,0 +1,203 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import collections
+import hashlib
+import random
+import re
+import threading
+import time
+
+SIGNATURE_SIZE = 64
+"""Number of hash functions in a MinHash signature, the similarity estimate is accurate to about 1/8."""
+
+_PRIME = (1 << 61) - 1
+
+_WORD = re.compile(r'\w+')
+
+# fixed, so signatures are the same in every process
+_random = random.Random(0x746d)
+_COEFFICIENTS = [(_random.randrange(1, _PRIME), _random.randrange(0, _PRIME)) for _ in range(SIGNATURE_SIZE)]
+
+
+def _hash(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def minhash_signature(words: list, shingle_size: int) -> tuple:
+    """Compute the MinHash signature of the word shingles of a text.
+
+    :param words: Normalized words of the text.
+    :param shingle_size: Number of words per shingle, texts with fewer words are a single shingle.
+    :return: Tuple of :py:data:`SIGNATURE_SIZE` integers.
+    """
+    if len(words) <= shingle_size:
+        hashes = [_hash(' '.join(words))]
+    else:
+        hashes = {_hash(' '.join(words[i:i + shingle_size])) for i in range(len(words) - shingle_size + 1)}
+
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _COEFFICIENTS)
+
+
+def signature_similarity(a: tuple, b: tuple) -> float:
+    """Estimate the Jaccard similarity of two texts from their :py:func:`minhash_signature`.
+
+    :return: Similarity between 0 and 1.
+    """
+    return sum(1 for x, y in zip(a, b) if x == y) / SIGNATURE_SIZE
+
+
+class _Entry:
+    __slots__ = ('chat_id', 'time', 'digest', 'signature', 'item', 'repeats', 'live')
+
+    def __init__(self, chat_id, now, digest, signature, item):
+        self.chat_id = chat_id
+        self.time = now
+        self.digest = digest
+        self.signature = signature
+        self.item = item
+        self.repeats = 0
+        self.live = True
+
+
+class FloodFilter:
+    """Detects repeated messages in a chat, using a rolling window of recent message fingerprints.
+
+    Messages are compared to the first copy of every distinct text posted in the same chat within
+    the window.  Identical texts, ignoring case, punctuation and spacing, are matched by digest,
+    and near-duplicates by the :py:func:`minhash_signature` of their word shingles.
+
+    A repeated message increments the repeat count of the first copy.  When the first copy leaves
+    the window, its repeat count is handed to the **on_expired** callback, and the next copy of the
+    text starts a new window.
+    """
+
+    def __init__(self, window_seconds: float, window_size: int, similarity: float, shingle_size: int,
+                 min_length: int, on_expired=None):
+        """
+        :param window_seconds: How long the first copy of a text is compared against.
+        :param window_size: Maximum number of distinct texts remembered per chat.
+        :param similarity: Estimated Jaccard similarity at which a text is a repeat, 1 for identical texts only.
+        :param shingle_size: Number of words per shingle.
+        :param min_length: Texts shorter than this, after normalization, are never repeats.
+        :param on_expired: Called with (item, repeats) for first copies which were repeated, after they
+                           leave the window.
+        """
+        self.window_seconds = window_seconds
+        self.window_size = window_size
+        self.similarity = similarity
+        self.shingle_size = shingle_size
+        self.min_length = min_length
+
+        self._on_expired = on_expired
+
+        self._lock = threading.Lock()
+
+        # every entry in the order it was added, for expiring old entries across all chats
+        self._entries = collections.deque()
+
+        self._chats = dict()
+        self._digests = dict()
+
+    def _evict(self, entry: _Entry, expired: list):
+        entry.live = False
+
+        digests = self._digests[entry.chat_id]
+        if digests.get(entry.digest, None) is entry:
+            del digests[entry.digest]
+
+        if entry.repeats:
+            expired.append((entry.item, entry.repeats))
+
+    def _expire(self, now: float, expired: list):
+        while self._entries and (not self._entries[0].live or now - self._entries[0].time > self.window_seconds):
+            entry = self._entries.popleft()
+            if entry.live:
+                self._chats[entry.chat_id].popleft()
+                self._evict(entry, expired)
+
+    def _report(self, expired: list):
+        if self._on_expired is not None:
+            for item, repeats in expired:
+                self._on_expired(item, repeats)
+
+    def check(self, chat_id: int, text: str, item, now: float = None) -> bool:
+        """Test if a message repeats one recently posted to the same chat, and remember it if not.
+
+        :param chat_id: Chat ID.
+        :param text: Message text or caption.
+        :param item: Object handed back to **on_expired** if this message is repeated.
+        :param now: Time of the message, defaults to :py:func:`time.monotonic`.
+        :return: True if the message is a repeat.
+        """
+        words = _WORD.findall(text.lower())
+        normalized = ' '.join(words)
+
+        if len(normalized) < self.min_length:
+            return False
+
+        now = time.monotonic() if now is None else now
+        digest = _hash(normalized)
+        signature = minhash_signature(words, self.shingle_size) if self.similarity < 1 else None
+
+        expired = []
+
+        with self._lock:
+            self._expire(now, expired)
+
+            chat = self._chats.setdefault(chat_id, collections.deque())
+            digests = self._digests.setdefault(chat_id, dict())
+
+            original = digests.get(digest, None)
+
+            if original is None and signature is not None:
+                original = next((entry for entry in chat
+                                 if signature_similarity(signature, entry.signature) >= self.similarity), None)
+
+            if original is not None:
+                original.repeats += 1
+            else:
+                entry = _Entry(chat_id, now, digest, signature, item)
+                chat.append(entry)
+                digests[digest] = entry
+                self._entries.append(entry)
+
+                if len(chat) > self.window_size:
+                    self._evict(chat.popleft(), expired)
+
+        self._report(expired)
+
+        return original is not None
+
+    def drain(self):
+        """Forget every message, handing the repeat counts of repeated messages to **on_expired**."""
+        expired = []
+
+        with self._lock:
+            for entry in self._entries:
+                if entry.live:
+                    self._evict(entry, expired)
+
+            self._entries.clear()
+            self._chats.clear()
+            self._digests.clear()
+
+        self._report(expired)
@@ -18,16 +18,322 @@
 # ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import copy
+import os
+import re
+import shutil
+from collections import OrderedDict
+
+import whoosh.analysis
+import whoosh.columns
 import whoosh.fields
+import whoosh.index
+
+MEDIA_TYPES = {
+    'Document': 'document',
+    'Photo': 'photo',
+    'Sticker': 'sticker',
+    'Animation': 'animation',
+    'Video': 'video',
+    'VideoNote': 'video_note',
+    'Voice': 'voice',
+    'Audio': 'audio'
+}
+"""Maps the label at the start of an indexed **media** field value to its :py:attr:`LogSchema.media_type`."""
+
+_MEDIA_LABEL = re.compile(r'^\((\w+):')
+
+
+def media_type_from_info(media_info: str):
+    """Derive the :py:attr:`LogSchema.media_type` value from an indexed **media** field value.
+
+    Used to fill in **media_type** for documents indexed before it existed.
+
+    :param media_info: Media field value, may be None.
+    :return: Media type string, or None.
+    """
+    if not media_info:
+        return None
+    match = _MEDIA_LABEL.match(media_info)
+    return MEDIA_TYPES.get(match.group(1), None) if match else None
+
+
+def message_key(chat_id: int, message_id: int, account: str = None) -> str:
+    """Build the unique :py:attr:`LogSchema.message_key` value for a message.
+
+    :param chat_id: Telegram chat id the message was sent to.
+    :param message_id: Telegram message id, unique within the chat.
+    :param account: Account name, for chats where message ids are only unique within an
+                    account (direct chats and basic groups), None for the first account.
+    :return: Key string.
+    """
+    if account is not None:
+        return f'{account}/{chat_id}:{message_id}'
+    return f'{chat_id}:{message_id}'
+
+
+NGRAM_SOURCE_FIELDS = ('username', 'alias', 'message')
+"""Fields which can be given an n-gram companion field with the ngram_fields config option."""
+
+NGRAM_MIN_SIZE = 3
+"""Shortest n-gram indexed in companion fields, shorter prefix and substring queries are not routed to them."""
+
+NGRAM_MAX_SIZE = 12
+"""Longest n-gram indexed in companion fields, longer prefix and substring queries are not routed to them."""
+
+NGRAM_START_MARK = '^'
+"""Marks n-grams which start a word, so prefix queries can match them exactly."""
+
+NGRAM_END_MARK = '$'
+"""Marks n-grams which end a word, so suffix queries can match them exactly."""
+
+
+def ngram_field_name(name: str) -> str:
+    """Get the name of the n-gram companion field of a :py:data:`NGRAM_SOURCE_FIELDS` field.
+
+    :param name: Source field name.
+    :return: Companion field name.
+    """
+    return name + '_ngram'
+
+
+class SubstringNgramFilter(whoosh.analysis.Filter):
+    """Replaces each token with every substring of it between **minsize** and **maxsize** characters.
+
+    Substrings at the start of the token are also indexed with :py:data:`NGRAM_START_MARK` in front,
+    and substrings at the end with :py:data:`NGRAM_END_MARK` after them, which makes substring, prefix
+    and suffix queries single term lookups.
+    """
+
+    def __init__(self, minsize: int, maxsize: int):
+        self.minsize = minsize
+        self.maxsize = maxsize
+
+    def __call__(self, tokens):
+        for token in tokens:
+            text = token.text
+            grams = set()
+
+            for size in range(self.minsize, min(self.maxsize, len(text)) + 1):
+                grams.update(text[start:start + size] for start in range(len(text) - size + 1))
+                grams.add(NGRAM_START_MARK + text[:size])
+                grams.add(text[-size:] + NGRAM_END_MARK)
+
+            for gram in sorted(grams):
+                token.text = gram
+                yield token
+
+
+def _ngram_field(tokenizer: whoosh.analysis.Tokenizer) -> whoosh.fields.TEXT:
+    return whoosh.fields.TEXT(analyzer=tokenizer | whoosh.analysis.LowercaseFilter() |
+                              SubstringNgramFilter(NGRAM_MIN_SIZE, NGRAM_MAX_SIZE), phrase=False)
+
+
+def expand_ngram_fields(fields: dict) -> dict:
+    """Fill in the n-gram companion fields of a document, from the source fields named by its **ngram_fields**.
+
+    :param fields: Document fields.
+    :return: **fields**, or a copy with the companion fields added.
+    """
+    names = (fields.get('ngram_fields', None) or '').split()
+    if not names:
+        return fields
+
+    fields = dict(fields)
+    for name in names:
+        if fields.get(name, None):
+            fields[ngram_field_name(name)] = fields[name]
+    return fields
 
 
 class LogSchema(whoosh.fields.SchemaClass):
     timestamp = whoosh.fields.DATETIME(stored=True, sortable=True)
-    username = whoosh.fields.ID(stored=True)
+    username = whoosh.fields.ID(stored=True, sortable=whoosh.columns.RefBytesColumn())
     alias = whoosh.fields.ID(stored=True)
     to_username = whoosh.fields.ID(stored=True)
     to_alias = whoosh.fields.ID(stored=True)
     message = whoosh.fields.TEXT(analyzer=whoosh.analysis.StemmingAnalyzer(), stored=True)
-    chat = whoosh.fields.ID(stored=True)
+    chat = whoosh.fields.ID(stored=True, sortable=whoosh.columns.RefBytesColumn())
     to_id = whoosh.fields.ID(stored=True)
     media = whoosh.fields.TEXT(analyzer=whoosh.analysis.StemmingAnalyzer(), stored=True)
+    chat_id = whoosh.fields.NUMERIC(numtype=int, bits=64, signed=True, stored=True, sortable=True)
+    from_id = whoosh.fields.NUMERIC(numtype=int, bits=64, signed=True, stored=True, sortable=True)
+    message_id = whoosh.fields.NUMERIC(numtype=int, bits=64, signed=True, stored=True, sortable=True)
+    message_key = whoosh.fields.ID(stored=True, unique=True)
+    date = whoosh.fields.DATETIME(stored=True, sortable=True)
+    media_type = whoosh.fields.ID(stored=True, sortable=whoosh.columns.RefBytesColumn())
+    message_ref = whoosh.fields.STORED()
+    account = whoosh.fields.ID(stored=True, sortable=whoosh.columns.RefBytesColumn())
+    repeats = whoosh.fields.NUMERIC(numtype=int, bits=32, stored=True)
+    ngram_fields = whoosh.fields.STORED()
+    username_ngram = _ngram_field(whoosh.analysis.IDTokenizer())
+    alias_ngram = _ngram_field(whoosh.analysis.RegexTokenizer())
+    message_ngram = _ngram_field(whoosh.analysis.RegexTokenizer())
+    document_text = whoosh.fields.TEXT(analyzer=whoosh.analysis.StemmingAnalyzer(), stored=True)
+
+
+GROUP_BY_FIELDS = OrderedDict([('chat', 'chat'), ('username', 'username'), ('media', 'media_type'),
+                               ('account', 'account')])
+"""Maps the group-by choices of tgminer-search and tgminer-stats to the :py:class:`LogSchema` column they count."""
+
+SORTABLE_TEXT_FIELDS = ('username', 'chat', 'media_type', 'account')
+"""
+:py:class:`LogSchema` text fields with column storage.
+
+whoosh cannot read a column back when a document in the segment has no value
+for it, so these fields must always be given a value, see :py:func:`fill_sortable_fields`.
+"""
+
+
+def fill_sortable_fields(fields: dict) -> dict:
+    """Replace missing :py:data:`SORTABLE_TEXT_FIELDS` values in a document with an empty string.
+
+    :param fields: Document fields, modified in place.
+    :return: **fields**
+    """
+    for name in SORTABLE_TEXT_FIELDS:
+        if fields.get(name, None) is None:
+            fields[name] = ''
+    return fields
+
+
+def upgrade_schema(index: whoosh.index.Index) -> list:
+    """Add any :py:class:`LogSchema` fields which are missing from an existing index.
+
+    Documents indexed before a field was added simply have no value for it.
+
+    Fields are added without column storage, whoosh corrupts a column when merging
+    segments written before the column existed.  Fields which exist but have changed
+    type are not touched either, rebuilding the index with :py:func:`migrate_index`
+    is needed for those.
+
+    :param index: The index, the caller must hold the interprocess index lock.
+    :return: Names of the fields that were added.
+    """
+    schema = LogSchema()
+    missing = [name for name in schema.names() if name not in index.schema]
+
+    if missing:
+        writer = index.writer()
+        for name in missing:
+            field = copy.deepcopy(schema[name])
+            field.set_sortable(False)
+            writer.add_field(name, field)
+        writer.commit()
+
+    return missing
+
+
+def open_or_create_index(indexdir: str) -> whoosh.index.Index:
+    """Open the index in **indexdir**, or create it with :py:class:`LogSchema` if it does not exist.
+
+    Existing indexes are upgraded with :py:func:`upgrade_schema`, the caller must hold the
+    interprocess index lock.
+
+    :param indexdir: Index directory.
+    :return: The index.
+    """
+    os.makedirs(indexdir, exist_ok=True)
+
+    if not whoosh.index.exists_in(indexdir):
+        return whoosh.index.create_in(indexdir, LogSchema)
+
+    index = whoosh.index.open_dir(indexdir)
+    upgrade_schema(index)
+    return index
+
+
+def _field_signature(field: whoosh.fields.FieldType) -> tuple:
+    # column objects do not implement equality, so fields are compared by these attributes
+    return (type(field), field.stored, field.unique,
+            type(field.column_type) if field.column_type is not None else None,
+            getattr(field, 'numtype', None), getattr(field, 'bits', None))
+
+
+def schema_outdated(index: whoosh.index.Index) -> list:
+    """List :py:class:`LogSchema` fields which differ from the fields of an existing index.
+
+    :param index: The index.
+    :return: Names of the fields that are missing or have a different type.
+    """
+    schema = LogSchema()
+    return [name for name in schema.names()
+            if name not in index.schema or _field_signature(index.schema[name]) != _field_signature(schema[name])]
+
+
+def migrate_document(fields: dict) -> dict:
+    """Convert the stored fields of a document from an older index to the current :py:class:`LogSchema`.
+
+    :param fields: Stored fields of the old document.
+    :return: Fields for :py:meth:`whoosh.writing.IndexWriter.add_document`.
+    """
+    schema = LogSchema()
+    fields = {name: value for name, value in fields.items() if name in schema}
+
+    if 'media_type' not in fields:
+        fields['media_type'] = media_type_from_info(fields.get('media', None))
+
+    if 'chat_id' not in fields:
+        # to_id was the only chat id recorded, as a string, the sender id was never recorded
+        try:
+            fields['chat_id'] = int(fields['to_id'])
+        except (KeyError, TypeError, ValueError):
+            pass
+
+    return fill_sortable_fields(fields)
+
+
+def migrate_index(indexdir: str, keep_old: bool = False, read_message=None) -> int:
+    """Rebuild the index in **indexdir** with the current :py:class:`LogSchema`.
+
+    The stored fields of every document are converted with :py:func:`migrate_document` into
+    a new index, which then replaces the old one.  The caller must hold the interprocess index lock.
+
+    :param indexdir: Index directory.
+    :param keep_old: Keep the old index directory, renamed to **indexdir** + ".old".
+    :param read_message: Function reading a **message_ref**, the text of messages which are only
+                         stored in the raw logs is read back with it to be indexed again.
+    :return: The number of documents migrated.
+    """
+    old_index = whoosh.index.open_dir(indexdir)
+
+    new_dir = indexdir + '.migrate'
+    old_dir = indexdir + '.old'
+
+    # leftovers from an interrupted migration
+    shutil.rmtree(new_dir, ignore_errors=True)
+
+    os.makedirs(new_dir)
+    new_index = whoosh.index.create_in(new_dir, LogSchema)
+
+    count = 0
+    writer = new_index.writer(limitmb=256)
+
+    try:
+        with old_index.reader() as reader:
+            for _, fields in reader.iter_docs():
+                fields = migrate_document(fields)
+
+                if read_message is not None and 'message' not in fields and fields.get('message_ref', None):
+                    fields.update(message=read_message(fields['message_ref']), _stored_message=None)
+
+                writer.add_document(**expand_ngram_fields(fields))
+                count += 1
+        writer.commit()
+    except Exception:
+        writer.cancel()
+        raise
+
+    old_index.close()
+    new_index.close()
+
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+
+    os.rename(indexdir, old_dir)
+    os.rename(new_dir, indexdir)
+
+    if not keep_old:
+        shutil.rmtree(old_dir)
+
+    return count
@@ -0,0 +1,477 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import argparse
+import datetime
+import hashlib
+import os.path
+import sys
+from collections import defaultdict
+
+import fasteners
+import whoosh.index
+
+import tgminer.backend
+import tgminer.config
+import tgminer.fulltext
+import tgminer.media
+import tgminer.rawlog
+import tgminer.retention
+from tgminer import exits
+from tgminer.cio import enc_print
+
+
+def legacy_window(parser: argparse.ArgumentParser):
+    def test(value):
+        # noinspection PyBroadException
+        try:
+            value = float(value)
+        except Exception:
+            parser.error('Legacy duplicate window must be a number of seconds.')
+
+        if value < 0:
+            parser.error('Legacy duplicate window cannot be less than 0.')
+        return value
+
+    return test
+
+
+def _legacy_content_key(fields: dict) -> bytes:
+    content = repr(tuple(fields.get(name, None) for name in
+                         ('chat', 'to_id', 'username', 'alias', 'to_username', 'to_alias', 'message', 'media')))
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).digest()
+
+
+def find_duplicates(reader, legacy_window_seconds: float) -> list:
+    """Find duplicate documents in an index.
+
+    Documents with a **message_key** are duplicates of the first document with the same key.
+
+    Documents indexed before **message_key** existed have nothing to identify them, they are considered
+    duplicates of a document with identical content that was indexed at most **legacy_window_seconds**
+    before them.  Pass 0 to leave those documents alone.
+
+    :param reader: Index reader.
+    :param legacy_window_seconds: Time window for legacy duplicates.
+    :return: List of duplicate document numbers.
+    """
+    duplicates = []
+    seen_keys = set()
+    legacy = []
+
+    for docnum, fields in reader.iter_docs():
+        key = fields.get('message_key', None)
+        if key is not None:
+            if key in seen_keys:
+                duplicates.append(docnum)
+            else:
+                seen_keys.add(key)
+        elif legacy_window_seconds > 0:
+            legacy.append((_legacy_content_key(fields), fields['timestamp'], docnum))
+
+    legacy.sort()
+
+    last_content = None
+    last_timestamp = None
+
+    for content, timestamp, docnum in legacy:
+        if content == last_content and (timestamp - last_timestamp).total_seconds() <= legacy_window_seconds:
+            duplicates.append(docnum)
+        else:
+            last_timestamp = timestamp
+        last_content = content
+
+    return duplicates
+
+
+def dedup_command(config: tgminer.config.TGMinerConfig, index: whoosh.index.Index, args):
+    writer = index.writer()
+
+    try:
+        with writer.searcher() as searcher:
+            duplicates = find_duplicates(searcher.reader(), args.legacy_window)
+
+        if args.dry_run:
+            writer.cancel()
+        else:
+            for docnum in duplicates:
+                writer.delete_document(docnum)
+            writer.commit()
+    except Exception:
+        writer.cancel()
+        raise
+
+    enc_print(f'{"Found" if args.dry_run else "Removed"} {len(duplicates)} duplicate documents.')
+
+
+def migrate_command(config: tgminer.config.TGMinerConfig, index: whoosh.index.Index, args):
+    outdated = tgminer.fulltext.schema_outdated(index)
+
+    if not outdated and not args.force:
+        enc_print('Index schema is up to date, nothing to migrate.')
+        return
+
+    index.close()
+
+    with tgminer.rawlog.RawLogReader(config.data_dir) as raw_logs:
+        count = tgminer.fulltext.migrate_index(os.path.join(config.data_dir, 'indexdir'), keep_old=args.keep_old,
+                                               read_message=raw_logs.read_message)
+
+    enc_print(f'Migrated {count} documents.')
+
+
+def convert_command(config: tgminer.config.TGMinerConfig, index: whoosh.index.Index, args):
+    path = os.path.join(config.data_dir, tgminer.backend.SQLITE_INDEX_FILE_NAME)
+
+    if os.path.exists(path) and not args.force:
+        enc_print(f'An SQLite index already exists in "{path}", use --force to replace it.', file=sys.stderr)
+        exit(exits.EX_CANTCREAT)
+
+    count = tgminer.backend.convert_whoosh_index(index, config.data_dir)
+
+    enc_print(f'Converted {count} documents into "{path}".')
+
+    if config.index_backend != 'sqlite':
+        enc_print('Set "index_backend" to "sqlite" in the config to use it.')
+
+
+def _chat_log_relpath(config: tgminer.config.TGMinerConfig, fields: dict, log_format: str):
+    # messages logged in an account sub directory have the account in their key
+    account = fields.get('account', None)
+    key = fields.get('message_key', None) or ''
+
+    return tgminer.rawlog.chat_log_relpath(
+        fields['chat'], fields.get('to_id', None), log_format,
+        account if account and key.startswith(account + '/') else None)
+
+
+def _chat_folder(config: tgminer.config.TGMinerConfig, fields: dict) -> str:
+    return os.path.abspath(os.path.join(config.data_dir, os.path.dirname(_chat_log_relpath(config, fields, 'text'))))
+
+
+def _read_offloaded_message(raw_logs: tgminer.rawlog.RawLogReader, fields: dict) -> dict:
+    # the message text of offloaded documents is needed to update or delete their tokens
+    if 'message' not in fields and fields.get('message_ref', None):
+        fields.update(message=raw_logs.read_message(fields['message_ref']), _stored_message=None)
+    return fields
+
+
+def media_layout_command(config: tgminer.config.TGMinerConfig, index: tgminer.backend.IndexBackend, args):
+    layout = args.layout if args.layout else config.media_layout
+
+    replacements = []
+    moved = 0
+    missing = 0
+
+    with tgminer.rawlog.RawLogReader(config.data_dir) as raw_logs:
+        for docid, fields in index.iter_documents():
+            found = tgminer.media.media_info_path(fields.get('media', None))
+            if found is None or not fields.get('chat', None):
+                continue
+
+            head, path, name = found
+            date = fields.get('date', None)
+
+            folder = _chat_folder(config, fields)
+
+            new_path = os.path.join(folder, tgminer.media.media_subdir(layout, name, date), name)
+
+            current = tgminer.media.find_media_file(path, folder, name, date)
+
+            if current is None:
+                missing += 1
+                continue
+
+            if current != new_path:
+                if not args.dry_run:
+                    tgminer.media.move_media_file(current, new_path, folder)
+                moved += 1
+
+            if path != new_path:
+                fields = _read_offloaded_message(raw_logs, fields)
+                replacements.append((docid, fields, dict(fields, media=head + new_path + ')')))
+
+    if replacements and not args.dry_run:
+        index.replace_documents(replacements)
+
+    enc_print(f'{"Would move" if args.dry_run else "Moved"} {moved} media files into the "{layout}" layout '
+              f'and {"update" if args.dry_run else "updated"} {len(replacements)} documents, '
+              f'{missing} media files were not found.')
+
+
+def ngrams_command(config: tgminer.config.TGMinerConfig, index: tgminer.backend.IndexBackend, args):
+    if not all(index.has_field(tgminer.fulltext.ngram_field_name(name)) for name in config.ngram_fields):
+        enc_print('Index has no n-gram fields, run "tgminer-index migrate" to update it.', file=sys.stderr)
+        exit(exits.EX_CONFIG)
+
+    ngram_fields = ' '.join(config.ngram_fields) or None
+
+    replacements = []
+
+    with tgminer.rawlog.RawLogReader(config.data_dir) as raw_logs:
+        for docid, fields in index.iter_documents():
+            if fields.get('ngram_fields', None) == ngram_fields:
+                continue
+
+            fields = _read_offloaded_message(raw_logs, fields)
+            replacements.append((docid, fields, dict(fields, ngram_fields=ngram_fields)))
+
+    if replacements and not args.dry_run:
+        index.replace_documents(replacements)
+
+    enc_print(f'{"Would index" if args.dry_run else "Indexed"} the n-gram fields of {len(replacements)} documents.')
+
+
+def _document_chat_id(fields: dict):
+    chat_id = fields.get('chat_id', None)
+    if chat_id is None:
+        try:
+            chat_id = int(fields['to_id'])
+        except (KeyError, TypeError, ValueError):
+            pass
+    return chat_id
+
+
+def _document_time(fields: dict) -> datetime.datetime:
+    # the message date is what raw log entries are expired by, documents from before it was recorded use their timestamp
+    return fields.get('date', None) or fields['timestamp']
+
+
+def _document_media(config: tgminer.config.TGMinerConfig, fields: dict):
+    found = tgminer.media.media_info_path(fields.get('media', None))
+    if found is None or not fields.get('chat', None):
+        return None, None
+
+    _, path, name = found
+    folder = _chat_folder(config, fields)
+
+    return tgminer.media.find_media_file(path, folder, name, fields.get('date', None)), folder
+
+
+def _document_size(config: tgminer.config.TGMinerConfig, fields: dict) -> int:
+    if 'message' in fields:
+        size = len(fields['message'].encode('utf-8'))
+    elif fields.get('message_ref', None):
+        size = tgminer.rawlog.parse_message_ref(fields['message_ref'])[2]
+    else:
+        size = 0
+
+    path, _ = _document_media(config, fields)
+
+    return size + (os.path.getsize(path) if path else 0)
+
+
+def expire_command(config: tgminer.config.TGMinerConfig, index: tgminer.backend.IndexBackend, args):
+    retention = config.retention
+
+    sized = retention.max_bytes > 0 or any(rule['max_bytes'] for rule in retention.chats)
+
+    chats = defaultdict(list)
+    for _, fields in index.iter_documents():
+        chats[_document_chat_id(fields)].append(
+            (_document_time(fields), _document_size(config, fields) if sized else 0))
+
+    cutoffs = tgminer.retention.expiry_cutoffs(chats, retention, datetime.datetime.now())
+
+    expired = []
+    media_files = []
+
+    # raw logs can hold more than one chat, they expire up to the earliest cutoff of their chats,
+    # None if any of them keeps everything
+    log_cutoffs = dict()
+
+    with tgminer.rawlog.RawLogReader(config.data_dir) as raw_logs:
+        for docid, fields in index.iter_documents():
+            cutoff = cutoffs.get(_document_chat_id(fields), None)
+
+            if fields.get('chat', None):
+                relpath = _chat_log_relpath(config, fields, 'text')
+                if relpath not in log_cutoffs:
+                    log_cutoffs[relpath] = cutoff
+                elif log_cutoffs[relpath] is not None:
+                    log_cutoffs[relpath] = min(log_cutoffs[relpath], cutoff) if cutoff is not None else None
+
+            if cutoff is None or _document_time(fields) >= cutoff:
+                continue
+
+            path, folder = _document_media(config, fields)
+            if path is not None:
+                media_files.append((path, folder))
+
+            expired.append((docid, _read_offloaded_message(raw_logs, fields)))
+
+    if args.dry_run:
+        media_bytes = sum(os.path.getsize(path) for path, _ in media_files)
+    else:
+        if expired:
+            index.delete_documents(expired)
+        media_bytes = sum(tgminer.media.remove_media_file(path, folder) for path, folder in media_files)
+
+    log_bytes = 0
+    for relpath, cutoff in log_cutoffs.items():
+        if cutoff is None:
+            continue
+        for log_format in tgminer.rawlog.LOG_FORMAT_EXTENSIONS:
+            log_path = os.path.join(config.data_dir, os.path.splitext(relpath)[0] +
+                                    tgminer.rawlog.LOG_FORMAT_EXTENSIONS[log_format])
+            log_bytes += tgminer.rawlog.expire_raw_log(log_path, int(cutoff.timestamp()), dry_run=args.dry_run)
+
+    enc_print(f'{"Would expire" if args.dry_run else "Expired"} {len(expired)} documents, '
+              f'{len(media_files)} media files ({media_bytes} bytes) and {log_bytes} bytes of raw logs.')
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Maintenance commands for the TGMiner full-text index.',
+        prog='tgminer-index'
+    )
+
+    arg_parser.add_argument('--version', action='version', version='%(prog)s ' + tgminer.__version__)
+
+    arg_parser.add_argument('--config',
+                            help='Path to TGMiner config file, defaults to "CWD/config.json". '
+                                 'This will override the environmental variable '
+                                 'TGMINER_CONFIG if it was defined.')
+
+    commands = arg_parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    dedup_parser = commands.add_parser(
+        'dedup',
+        help='Remove duplicate documents, such as those created by reconnect replays.',
+        description='Remove documents which share a chat id and message id with an earlier document.')
+
+    dedup_parser.add_argument('--legacy-window', default=0, type=legacy_window(dedup_parser),
+                              help='Documents indexed before message ids were recorded cannot be matched '
+                                   'by id. When this is greater than 0, such documents are removed if a '
+                                   'document with identical chat, user, message and media content was indexed '
+                                   'within this many seconds before them. Default is 0 (disabled).')
+
+    dedup_parser.add_argument('--dry-run', action='store_true', default=False,
+                              help='Only print how many documents would be removed.')
+
+    dedup_parser.set_defaults(command_func=dedup_command)
+
+    migrate_parser = commands.add_parser(
+        'migrate',
+        help='Rebuild the index with the current schema.',
+        description='Rebuild the index with the current schema, converting the stored fields of every '
+                    'document. This is needed after upgrading TGMiner when existing fields change, such '
+                    'as gaining the column storage used by tgminer-stats. Stop tgminer first.')
+
+    migrate_parser.add_argument('--keep-old', action='store_true', default=False,
+                                help='Keep the old index in "indexdir.old" instead of deleting it.')
+
+    migrate_parser.add_argument('--force', action='store_true', default=False,
+                                help='Rebuild the index even if its schema is already up to date.')
+
+    migrate_parser.set_defaults(command_func=migrate_command)
+
+    convert_parser = commands.add_parser(
+        'convert',
+        help='Copy the whoosh index into an SQLite index.',
+        description='Copy every document of the whoosh index in "indexdir" into a new SQLite index, '
+                    'for use with the "sqlite" index_backend. Messages only stored in the raw logs '
+                    'are read back from them. Stop tgminer first.')
+
+    convert_parser.add_argument('--force', action='store_true', default=False,
+                                help='Replace an existing SQLite index.')
+
+    convert_parser.set_defaults(command_func=convert_command)
+
+    media_layout_parser = commands.add_parser(
+        'media-layout',
+        help='Move downloaded media files into the configured media_layout.',
+        description='Move the downloaded media files of every indexed message into the directory layout set by '
+                    'the "media_layout" config option, and rewrite the paths in the media field of the index. '
+                    'Works with every index_backend. Stop tgminer first.')
+
+    media_layout_parser.add_argument('--layout', default=None, choices=tgminer.media.MEDIA_LAYOUTS,
+                                     help='Use this layout instead of the one in the config.')
+
+    media_layout_parser.add_argument('--dry-run', action='store_true', default=False,
+                                     help='Only print how many files would be moved.')
+
+    media_layout_parser.set_defaults(command_func=media_layout_command, index_backend=True)
+
+    ngrams_parser = commands.add_parser(
+        'ngrams',
+        help='Index the n-gram fields selected by ngram_fields for existing documents.',
+        description='Index the n-gram companion fields selected by the "ngram_fields" config option for '
+                    'every document indexed with a different selection, and remove them from documents '
+                    'when fields are deselected.  Run it after changing "ngram_fields", prefix and '
+                    'substring queries miss older documents until then.  Works with every index_backend.  '
+                    'Stop tgminer first.')
+
+    ngrams_parser.add_argument('--dry-run', action='store_true', default=False,
+                               help='Only print how many documents would be updated.')
+
+    ngrams_parser.set_defaults(command_func=ngrams_command, index_backend=True)
+
+    expire_parser = commands.add_parser(
+        'expire',
+        help='Delete documents, media and raw logs expired by the retention config.',
+        description='Delete the documents expired by the "retention" config options, along with their '
+                    'downloaded media and the raw log segments which only hold expired messages, then '
+                    'merge the index.  Works with every index_backend.  Stop tgminer first.')
+
+    expire_parser.add_argument('--dry-run', action='store_true', default=False,
+                               help='Only print what would be removed.')
+
+    expire_parser.set_defaults(command_func=expire_command, index_backend=True)
+
+    args = arg_parser.parse_args()
+
+    config = None  # hush intellij highlighted undeclared variable use warning
+
+    config_path = tgminer.config.get_config_path(args.config)
+
+    if os.path.isfile(config_path):
+        try:
+            config = tgminer.config.TGMinerConfig(config_path)
+        except tgminer.config.TGMinerConfigException as e:
+            enc_print(str(e), file=sys.stderr)
+            exit(exits.EX_CONFIG)
+    else:
+        enc_print(f'Cannot find tgminer config file: "{config_path}"')
+        exit(exits.EX_NOINPUT)
+
+    if getattr(args, 'index_backend', False):
+        if not tgminer.backend.index_exists(config):
+            enc_print(f'No "{config.index_backend}" index exists in "{config.data_dir}".', file=sys.stderr)
+            exit(exits.EX_NOINPUT)
+
+        with tgminer.backend.open_index(config) as index:
+            args.command_func(config, index, args)
+        return
+
+    indexdir = os.path.join(config.data_dir, tgminer.backend.INDEX_DIR_NAME)
+
+    if not whoosh.index.exists_in(indexdir):
+        enc_print(f'No index exists in "{indexdir}".', file=sys.stderr)
+        exit(exits.EX_NOINPUT)
+
+    with fasteners.InterProcessLock(os.path.join(config.data_dir, tgminer.backend.INTERPROCESS_MUTEX)):
+        index = tgminer.fulltext.open_or_create_index(indexdir)
+        args.command_func(config, index, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import datetime
+import json
+import os
+import re
+import threading
+
+import fasteners
+import whoosh.fields
+
+import tgminer.backend
+import tgminer.fulltext
+
+JOURNAL_FILE_NAME = 'index_journal.jsonl'
+"""Name of the write-ahead journal file in the data directory."""
+
+_JOURNAL_FILE_PATTERN = re.compile(r'^index_journal(?:\.(\d+))?\.jsonl$')
+
+
+class JournalInUseError(Exception):
+    """Raised when opening a journal which another tgminer process is writing to."""
+
+
+def journal_path(data_dir: str, number: int = 0) -> str:
+    """Get the path of a journal in the data directory.
+
+    Every tgminer process sharing a data directory writes to a journal of its own.
+
+    :param data_dir: Data directory.
+    :param number: Journal number, 0 is :py:data:`JOURNAL_FILE_NAME`.
+    :return: Journal file path.
+    """
+    if not number:
+        return os.path.join(data_dir, JOURNAL_FILE_NAME)
+    name, ext = os.path.splitext(JOURNAL_FILE_NAME)
+    return os.path.join(data_dir, f'{name}.{number}{ext}')
+
+
+def open_journal(data_dir: str, index: tgminer.backend.IndexBackend) -> tuple:
+    """Open the first journal no other tgminer process is using, and replay every journal left behind.
+
+    Journals which are not in use belong to processes that have stopped, their documents are
+    replayed into the index, and those other than the one opened are removed.
+
+    :param data_dir: Data directory.
+    :param index: The index.
+    :return: (:py:class:`IndexJournal`, number of documents replayed)
+    """
+    found = [_JOURNAL_FILE_PATTERN.match(name) for name in os.listdir(data_dir)]
+    last = max((int(match.group(1) or 0) for match in found if match), default=0)
+
+    journal = None
+    replayed = 0
+    number = 0
+
+    while journal is None or number <= last:
+        path = journal_path(data_dir, number)
+        number += 1
+
+        if journal is not None and not os.path.exists(path):
+            continue
+
+        try:
+            opened = IndexJournal(path)
+        except JournalInUseError:
+            continue
+
+        replayed += opened.replay(index)
+
+        if journal is None:
+            journal = opened
+        else:
+            opened.close(remove=True)
+
+    return journal, replayed
+
+
+def _encode_document(fields: dict) -> str:
+    return json.dumps({name: value.timestamp() if isinstance(value, datetime.datetime) else value
+                       for name, value in fields.items()}, ensure_ascii=False)
+
+
+def _decode_document(schema: whoosh.fields.Schema, line: str) -> dict:
+    fields = json.loads(line)
+    for name, value in fields.items():
+        if value is not None and name in schema and isinstance(schema[name], whoosh.fields.DATETIME):
+            fields[name] = datetime.datetime.fromtimestamp(value)
+    return fields
+
+
+class IndexJournal:
+    """Append-only write-ahead journal of documents waiting to be committed to the index.
+
+    Documents are appended with :py:meth:`append` before they are handed to the index writer,
+    and marked with :py:meth:`done` once committed, or with :py:meth:`failed` if the index write
+    failed.  Failed documents are moved to a file next to the journal, **path** + ".failed".
+    The journal file is emptied whenever every appended document is marked, anything left in it
+    or the failed file at startup was never committed and is replayed with :py:meth:`replay`.
+
+    The journal is locked for as long as it is open, so another process opening it
+    gets :py:exc:`JournalInUseError` instead of replaying documents this one is still writing.
+
+    Appends from many threads share fsync calls: a thread which finds its document already
+    synced by another thread's fsync returns without syncing again.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: Journal file path.
+        :raises JournalInUseError: If another process has the journal open.
+        """
+        self._path = path
+        self._failed_path = path + '.failed'
+
+        self._process_lock = fasteners.InterProcessLock(path + '.lock')
+        if not self._process_lock.acquire(blocking=False):
+            raise JournalInUseError(f'Index journal "{path}" is in use by another tgminer process.')
+
+        self._file = open(path, 'ab')
+
+        self._lock = threading.Lock()
+        self._synced = threading.Condition(self._lock)
+
+        self._written = 0
+        self._flushed = 0
+        self._syncing = False
+        self._pending = 0
+
+    @property
+    def path(self) -> str:
+        """Journal file path."""
+        return self._path
+
+    def append(self, fields: dict):
+        """Append a document and wait until it is on disk.
+
+        :param fields: Document fields for :py:meth:`tgminer.backend.IndexBackend.add`.
+        """
+        data = (_encode_document(fields) + '\n').encode('utf-8')
+
+        with self._lock:
+            self._file.write(data)
+            self._written += 1
+            self._pending += 1
+            position = self._written
+
+            while self._flushed < position:
+                if self._syncing:
+                    self._synced.wait()
+                    continue
+
+                # sync everything written so far on behalf of every waiting thread
+                self._syncing = True
+                target = self._written
+                self._file.flush()
+                self._lock.release()
+                try:
+                    os.fsync(self._file.fileno())
+                finally:
+                    self._lock.acquire()
+                    self._syncing = False
+                    self._flushed = target
+                    self._synced.notify_all()
+
+    def done(self, count: int = 1):
+        """Mark appended documents as committed to the index, or as not needing to be.
+
+        :param count: Number of documents.
+        """
+        with self._lock:
+            self._finish(count)
+
+    def failed(self, fields: dict):
+        """Mark an appended document as not committed because the index write failed.
+
+        The document is moved to the failed file, and replayed from it on the next start.
+
+        :param fields: Document fields, as given to :py:meth:`append`.
+        """
+        data = (_encode_document(fields) + '\n').encode('utf-8')
+
+        with self._lock:
+            with open(self._failed_path, 'ab') as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+
+            self._finish(1)
+
+    def _finish(self, count: int):
+        self._pending -= count
+
+        if self._pending == 0 and not self._syncing:
+            self._file.seek(0)
+            self._file.truncate()
+            self._written = self._flushed = 0
+
+    def replay(self, index: tgminer.backend.IndexBackend) -> int:
+        """Add documents left in the journal to the index, unless they are already indexed.
+
+        Must be called before anything is appended.  A partially written last line, from a crash
+        during an append, is ignored.
+
+        :param index: The index.
+        :return: Number of documents added.
+        """
+        lines = []
+
+        for path in (self._path, self._failed_path):
+            if os.path.exists(path):
+                with open(path, 'rb') as file:
+                    lines += file.read().split(b'\n')
+
+        schema = tgminer.fulltext.LogSchema()
+
+        documents = []
+        for line in lines:
+            # noinspection PyBroadException
+            try:
+                documents.append(_decode_document(schema, line.decode('utf-8')))
+            except Exception:
+                pass
+
+        count = index.add_many(documents) if documents else 0
+
+        with self._lock:
+            self._file.seek(0)
+            self._file.truncate()
+
+            if os.path.exists(self._failed_path):
+                os.remove(self._failed_path)
+
+        return count
+
+    def close(self, remove: bool = False):
+        """Close the journal and release its lock.
+
+        :param remove: Remove the journal files, only once every document in them is committed.
+        """
+        self._file.close()
+
+        if remove:
+            os.remove(self._path)
+            if os.path.exists(self._failed_path):
+                os.remove(self._failed_path)
+
+        self._process_lock.release()
@@ -1,10 +1,12 @@
 import argparse
+import sys
 
 import kovit
 
 import tgminer
 from tgminer import exits
 from tgminer.cio import enc_print
+from tgminer.wordindex import WordStateIndex, word_index_path, normalize_word
 
 
 def max_output_words(parser: argparse.ArgumentParser):
@@ -37,6 +39,21 @@ def max_attempts(parser: argparse.ArgumentParser):
     return test
 
 
+def min_output_words(parser: argparse.ArgumentParser):
+    def test(value):
+        # noinspection PyBroadException
+        try:
+            value = int(value)
+        except Exception:
+            parser.error('Minimum output words must be an integer.')
+
+        if value < 1:
+            parser.error('Minimum output words cannot be less than 1.')
+        return value
+
+    return test
+
+
 def main():
     arg_parser = argparse.ArgumentParser(
         description='Read a markov chain file produced by tgminer-search --markov '
@@ -56,11 +73,26 @@ def main():
     arg_parser.add_argument('--max-words', help='Max output length in words, default is 256.',
                             type=max_output_words(arg_parser), default=256)
 
+    arg_parser.add_argument('--min-words', help='Min output length in words, messages shorter than '
+                                                 'this count as a failed attempt. Default is 1.',
+                            type=min_output_words(arg_parser), default=1)
+
     arg_parser.add_argument('--repeat', help='Keep generating words up until max word length.',
                             action='store_true', default=False)
 
+    arg_parser.add_argument('--start-with', metavar='WORD',
+                            help='Start the generated message with this word. Case and surrounding '
+                                 'punctuation are ignored when matching.')
+
+    arg_parser.add_argument('--must-contain', metavar='WORD',
+                            help='The generated message must contain this word. Case and surrounding '
+                                 'punctuation are ignored when matching.')
+
     args = arg_parser.parse_args()
 
+    if args.min_words > args.max_words:
+        arg_parser.error('--min-words cannot be greater than --max-words.')
+
     m_chain = kovit.Chain()
 
     try:
@@ -72,9 +104,53 @@ def main():
         exit(exits.EX_NOINPUT)
         return  # intellij wants this
 
+    start_states = None
+    must_contain = normalize_word(args.must_contain) if args.must_contain else None
+
+    if args.start_with or args.must_contain:
+        word_index = WordStateIndex()
+        index_path = word_index_path(args.chain)
+
+        try:
+            with open(index_path, 'r', encoding='utf-8') as index_file:
+                word_index.load_json(index_file)
+        except Exception as e:
+            enc_print('Error reading markov chain word index file "{}", message: {}. '
+                      'Regenerate the chain with tgminer-search --markov to create it.'.format(index_path, e),
+                      file=sys.stderr)
+            exit(exits.EX_NOINPUT)
+            return
+
+        if args.start_with:
+            start_states = word_index.starting_with(args.start_with)
+            if must_contain:
+                # prefer start states which already satisfy --must-contain,
+                # otherwise rely on the walk to produce the word
+                containing = set(word_index.containing(must_contain))
+                both = [state for state in start_states if state in containing]
+                if both:
+                    start_states = both
+        else:
+            start_states = word_index.containing(must_contain)
+
+        if not start_states:
+            enc_print('No state in the markov chain contains the word "{}".'.format(
+                args.start_with if args.start_with else args.must_contain), file=sys.stderr)
+            exit(exits.EX_SOFTWARE)
+            return
+
+    def satisfied(words):
+        if len(words) < args.min_words:
+            return False
+        if must_contain and must_contain not in (normalize_word(w) for w in words):
+            return False
+        return True
+
     attempts = 0
 
     def start_chooser():
+        if start_states is not None:
+            return WordStateIndex.choose(start_states)
         return m_chain.random_start(dead_end_ok=False)
 
     def next_chooser(bag):
@@ -82,11 +158,12 @@ def main():
 
     while True:
 
-        message = ' '.join(m_chain.walk(args.max_words, repeat=args.repeat,
-                                        start_chooser=start_chooser,
-                                        next_chooser=next_chooser))
+        words = list(m_chain.walk(args.max_words, repeat=args.repeat,
+                                  start_chooser=start_chooser,
+                                  next_chooser=next_chooser))
 
-        if message:
+        if words and satisfied(words):
+            message = ' '.join(words)
             break
 
         if args.max_attempts == 0:
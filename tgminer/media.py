@@ -0,0 +1,144 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import datetime
+import os
+import re
+import uuid
+
+MEDIA_LAYOUTS = ('flat', 'date', 'hash', 'date_hash')
+"""
+media_layout config values, the sub directory of a chat folder media files are downloaded into.
+
+* flat: The chat folder itself.
+* date: YYYY/MM/DD of the message date.
+* hash: The first two hex digits of the file name.
+* date_hash: YYYY-MM of the message date, then the first two hex digits of the file name.
+"""
+
+_MEDIA_INFO_PATH = re.compile(
+    r'^(?P<head>.*: )(?P<path>(?:.*[\\/])?'
+    r'(?P<name>[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}[^\\/]*))\)$', re.DOTALL)
+
+
+def media_subdir(layout: str, file_name: str, date: datetime.datetime = None) -> str:
+    """Get the directory a media file is stored in, relative to its chat folder.
+
+    :param layout: A value from :py:data:`MEDIA_LAYOUTS`.
+    :param file_name: Media file name, which starts with the uuid it was named after.
+    :param date: Message date in local time, None if unknown.
+    :return: Relative path, empty for the flat layout.
+    """
+    if layout == 'hash':
+        return file_name[:2]
+
+    if layout == 'date':
+        return date.strftime(os.path.join('%Y', '%m', '%d')) if date else 'undated'
+
+    if layout == 'date_hash':
+        return os.path.join(date.strftime('%Y-%m') if date else 'undated', file_name[:2])
+
+    return ''
+
+
+def new_media_path(layout: str, folder: str, date: datetime.datetime = None) -> str:
+    """Get the absolute path for a new media file, without an extension.
+
+    :param layout: A value from :py:data:`MEDIA_LAYOUTS`.
+    :param folder: Chat folder.
+    :param date: Message date in local time, None if unknown.
+    :return: Path.
+    """
+    name = str(uuid.uuid4())
+    return os.path.abspath(os.path.join(folder, media_subdir(layout, name, date), name))
+
+
+def media_info_path(media_info: str):
+    """Find the path of the downloaded file in an indexed **media** field value.
+
+    :param media_info: Media field value, may be None.
+    :return: (text before the path, path, file name), or None if nothing was downloaded.
+    """
+    match = _MEDIA_INFO_PATH.match(media_info) if media_info else None
+    return (match.group('head'), match.group('path'), match.group('name')) if match else None
+
+
+def find_media_file(path: str, folder: str, name: str, date: datetime.datetime = None):
+    """Find a media file, at its recorded path, or in any layout of its chat folder.
+
+    :param path: Recorded path.
+    :param folder: Chat folder.
+    :param name: File name.
+    :param date: Message date in local time, None if unknown.
+    :return: Path of the file, or None if it does not exist.
+    """
+    if os.path.isfile(path):
+        return path
+
+    for layout in MEDIA_LAYOUTS:
+        candidate = os.path.join(folder, media_subdir(layout, name, date), name)
+        if os.path.isfile(candidate):
+            return os.path.abspath(candidate)
+
+    return None
+
+
+def move_media_file(path: str, new_path: str, folder: str):
+    """Move a media file, and remove the directories it leaves empty, up to its chat folder.
+
+    :param path: Current path.
+    :param new_path: New path.
+    :param folder: Chat folder.
+    """
+    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+    os.replace(path, new_path)
+
+    _remove_empty_dirs(path, folder)
+
+
+def remove_media_file(path: str, folder: str) -> int:
+    """Remove a media file, and the directories it leaves empty, up to its chat folder.
+
+    :param path: Path of the file.
+    :param folder: Chat folder.
+    :return: Size of the removed file in bytes, 0 if it did not exist.
+    """
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+    except FileNotFoundError:
+        return 0
+
+    _remove_empty_dirs(path, folder)
+
+    return size
+
+
+def _remove_empty_dirs(path: str, folder: str):
+    folder = os.path.abspath(folder)
+    directory = os.path.dirname(os.path.abspath(path))
+
+    while directory != folder and directory.startswith(folder + os.sep):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            break
+        directory = os.path.dirname(directory)
@@ -0,0 +1,136 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import queue
+import sys
+import threading
+import time
+import traceback
+
+from tgminer.cio import enc_print
+
+
+class Stage:
+    """A pool of worker threads consuming a bounded queue.
+
+    :py:meth:`put` blocks while the queue is full, so a stage which falls behind
+    slows down the stage feeding it instead of buffering without limit.
+
+    Items with a **trace** attribute holding a :py:class:`tgminer.profiling.MessageTrace`
+    have the time they wait in and are handled by the stage recorded.
+    """
+
+    def __init__(self, name: str, handler, workers: int = 1, queue_size: int = 0,
+                 profiler=None, on_trace_finished=None):
+        """
+        :param name: Stage name, used for thread names and error messages.
+        :param handler: Called with each item put on the stage.
+        :param workers: Number of worker threads.
+        :param queue_size: Maximum number of items waiting in the stage, 0 for no limit.
+        :param profiler: :py:class:`tgminer.profiling.Profiler` the handler is called through, or None.
+        :param on_trace_finished: Called with the trace of an item once it has left every stage.
+        """
+        self.name = name
+        self._handler = handler
+        self._profiler = profiler
+        self._on_trace_finished = on_trace_finished
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._workers = [threading.Thread(target=self._work, name=f'{name}Stage{i}', daemon=True)
+                         for i in range(workers)]
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+
+    def put(self, item):
+        """Queue an item for the stage, blocking while the stage is full.
+
+        :param item: Item passed to the stage handler, must not be None.
+        """
+        trace = getattr(item, 'trace', None)
+        if trace is not None:
+            trace.queue(self.name)
+
+        self._queue.put(item)
+
+    def try_put(self, item) -> bool:
+        """Queue an item for the stage, unless the stage is full.
+
+        :param item: Item passed to the stage handler, must not be None, and is not traced.
+        :return: True if the item was queued.
+        """
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            return False
+        return True
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            started = time.perf_counter()
+
+            # noinspection PyBroadException
+            try:
+                if self._profiler is not None:
+                    self._profiler.call(self._handler, item)
+                else:
+                    self._handler(item)
+            except Exception:
+                enc_print(f'Error in {self.name} stage:', file=sys.stderr)
+                traceback.print_exc(file=sys.stderr)
+
+            trace = getattr(item, 'trace', None)
+            if trace is not None and trace.handled(self.name, started, time.perf_counter()):
+                if self._on_trace_finished is not None:
+                    self._on_trace_finished(trace)
+
+    def close(self):
+        """Wait for every queued item to be handled, then stop the workers."""
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+
+class Pipeline:
+    """Stages which are started together, and closed in the order they were added.
+
+    Stages should be added in the order items flow through them, so that closing a
+    stage happens after every stage which feeds it has finished.
+    """
+
+    def __init__(self):
+        self._stages = []
+
+    def add(self, stage: Stage) -> Stage:
+        self._stages.append(stage)
+        return stage
+
+    def start(self):
+        for stage in self._stages:
+            stage.start()
+
+    def close(self):
+        for stage in self._stages:
+            stage.close()
@@ -0,0 +1,357 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import collections
+import cProfile
+import datetime
+import json
+import os
+import pstats
+import socket
+import sys
+import threading
+import time
+
+from tgminer.cio import enc_print
+
+PROFILE_MODES = ('sample', 'cprofile')
+"""Possible profiling.mode config values."""
+
+SLOW_MESSAGE_LOG_NAME = 'slow_messages.jsonl'
+"""Name of the slow message log in the data directory."""
+
+
+class MessageTrace:
+    """Timing of a message as it passes through the pipeline stages.
+
+    A :py:class:`tgminer.pipeline.Stage` records each message it handles which has
+    a **trace** attribute.  The trace is finished when no stage has it queued or running.
+    """
+
+    def __init__(self, key: str, received: float = None):
+        """
+        :param key: Message key, see :py:func:`tgminer.fulltext.message_key`.
+        :param received: :py:func:`time.perf_counter` value when the message was received, defaults to now.
+        """
+        self.key = key
+        self.received = time.perf_counter() if received is None else received
+        self.stages = []
+        self._queued = dict()
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, wait: float, run: float):
+        """Record time spent outside of a pipeline stage, such as on the update thread.
+
+        :param stage: Stage name.
+        :param wait: Seconds waited before running.
+        :param run: Seconds spent running.
+        """
+        with self._lock:
+            self.stages.append((stage, wait, run))
+
+    def queue(self, stage: str):
+        with self._lock:
+            self._pending += 1
+            self._queued[stage] = time.perf_counter()
+
+    def handled(self, stage: str, started: float, finished: float) -> bool:
+        """Record that a stage finished handling the message.
+
+        :return: True if the message has left the pipeline.
+        """
+        with self._lock:
+            self.stages.append((stage, started - self._queued.pop(stage, started), finished - started))
+            self._pending -= 1
+            return self._pending == 0
+
+    def total(self) -> float:
+        return time.perf_counter() - self.received
+
+
+class SlowMessageLog:
+    """Appends the stage timing of messages which took too long to the slow message log."""
+
+    def __init__(self, path: str, threshold_ms: int = 0):
+        """
+        :param path: Log file path.
+        :param threshold_ms: Log messages which took at least this long, 0 disables the log.
+        """
+        self.path = path
+        self.threshold_ms = threshold_ms
+        self._lock = threading.Lock()
+
+    def finished(self, trace: MessageTrace):
+        threshold_ms = self.threshold_ms
+        total_ms = trace.total() * 1000
+
+        if not threshold_ms or total_ms < threshold_ms:
+            return
+
+        entry = json.dumps({'time': datetime.datetime.now().isoformat(),
+                            'message_key': trace.key,
+                            'total_ms': round(total_ms, 3),
+                            'stages': [{'stage': stage,
+                                        'wait_ms': round(wait * 1000, 3),
+                                        'run_ms': round(run * 1000, 3)} for stage, wait, run in trace.stages]})
+
+        with self._lock, open(self.path, 'a', encoding='utf-8') as file:
+            file.write(entry + '\n')
+
+
+class Profiler:
+    """Profiles the running process on demand, writing the result to a directory.
+
+    **sample** mode samples the stack of every thread at an interval and writes the counts
+    in the collapsed stack format read by flame graph tools (``.folded``).
+
+    **cprofile** mode runs code passed to :py:meth:`call` under a :py:class:`cProfile.Profile` per
+    thread, and writes the combined statistics in :py:mod:`pstats` format (``.pstats``).
+    cProfile can only observe code started after profiling is, so only the update handler
+    and pipeline stages are covered.
+    """
+
+    def __init__(self, output_dir: str, sample_interval_ms: int = 10):
+        self._output_dir = output_dir
+        self._sample_interval = sample_interval_ms / 1000
+        self._lock = threading.Lock()
+
+        self._mode = None
+        self._started = None
+        self._profiles = dict()
+        # threads inside call, stop waits for them to disable their profile
+        self._active = collections.Counter()
+        self._idle = threading.Condition(self._lock)
+        self._samples = None
+        self._sampler = None
+        self._stop_sampling = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._mode is not None
+
+    def start(self, mode: str) -> bool:
+        """Start profiling.
+
+        :param mode: A value from :py:data:`PROFILE_MODES`.
+        :return: False if profiling was already running.
+        """
+        with self._lock:
+            if self._mode is not None:
+                return False
+
+            self._started = datetime.datetime.now()
+
+            if mode == 'sample':
+                self._samples = collections.Counter()
+                self._stop_sampling.clear()
+                self._sampler = threading.Thread(target=self._sample, name='ProfileSampler', daemon=True)
+                self._sampler.start()
+            else:
+                self._profiles = dict()
+
+            self._mode = mode
+            return True
+
+    def stop(self):
+        """Stop profiling and write the profile.
+
+        In **cprofile** mode this waits for calls still running under a profile to return,
+        so the written statistics are complete.
+
+        :return: Path of the written profile, or None if profiling was not running.
+        """
+        with self._lock:
+            mode, self._mode = self._mode, None
+
+            if mode is None:
+                return None
+
+            path = os.path.join(self._output_dir, 'profile-{:%Y%m%d-%H%M%S}'.format(self._started))
+
+            if mode == 'sample':
+                self._stop_sampling.set()
+                self._sampler.join()
+
+                path += '.folded'
+                with open(path, 'w', encoding='utf-8') as file:
+                    for stack, count in self._samples.most_common():
+                        file.write(f'{stack} {count}\n')
+            else:
+                # a profile can only be disabled by its own thread, wait for
+                # every call still running under one to return
+                own_thread = threading.get_ident()
+                self._idle.wait_for(lambda: not (self._active.keys() - {own_thread}))
+
+                path += '.pstats'
+                profiles = list(self._profiles.values())
+                if profiles:
+                    pstats.Stats(*profiles).dump_stats(path)
+                else:
+                    open(path, 'wb').close()
+
+            return path
+
+    def toggle(self, mode: str):
+        """Start profiling if it is stopped, otherwise stop it.
+
+        :return: Path of the written profile, or None if profiling was started.
+        """
+        path = self.stop()
+        if path is None:
+            self.start(mode)
+        return path
+
+    def call(self, function, *args):
+        """Call a function, under cProfile if profiling in **cprofile** mode."""
+        if self._mode != 'cprofile':
+            return function(*args)
+
+        thread = threading.get_ident()
+        with self._lock:
+            if self._mode != 'cprofile':
+                profile = None
+            else:
+                profile = self._profiles.get(thread, None)
+                if profile is None:
+                    profile = self._profiles[thread] = cProfile.Profile()
+                self._active[thread] += 1
+
+        if profile is None:
+            return function(*args)
+
+        try:
+            try:
+                profile.enable()
+            except ValueError:
+                # another profiler is active in this interpreter
+                return function(*args)
+
+            try:
+                return function(*args)
+            finally:
+                profile.disable()
+        finally:
+            with self._idle:
+                self._active[thread] -= 1
+                if not self._active[thread]:
+                    del self._active[thread]
+                self._idle.notify_all()
+
+    def _sample(self):
+        own_thread = threading.get_ident()
+
+        while not self._stop_sampling.wait(self._sample_interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+            for thread, frame in sys._current_frames().items():
+                if thread == own_thread:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+
+                stack.append(names.get(thread, str(thread)))
+                self._samples[';'.join(reversed(stack))] += 1
+
+
+class ControlServer:
+    """Accepts one line commands on a local (unix domain) socket and replies with one line.
+
+    Commands are dispatched to the handler given for their first word, which receives the
+    remaining words and returns the reply.
+    """
+
+    def __init__(self, path: str, handlers: dict):
+        """
+        :param path: Socket path.
+        :param handlers: Maps command names to handler functions.
+        """
+        self._path = path
+        self._handlers = handlers
+        self._socket = None
+
+    def start(self):
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+        # noinspection PyUnresolvedReferences
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(self._path)
+        self._socket.listen(4)
+
+        threading.Thread(target=self._serve, name='ControlServer', daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                connection, _ = self._socket.accept()
+            except OSError:
+                # closed
+                return
+
+            with connection:
+                # noinspection PyBroadException
+                try:
+                    words = connection.makefile('r', encoding='utf-8').readline().split()
+                    connection.sendall((self._dispatch(words) + '\n').encode('utf-8'))
+                except Exception as e:
+                    enc_print(f'Control socket error: {e}', file=sys.stderr)
+
+    def _dispatch(self, words: list) -> str:
+        if not words:
+            return 'error: empty command'
+
+        handler = self._handlers.get(words[0], None)
+        if handler is None:
+            return f'error: unknown command "{words[0]}", expected one of: ' + ', '.join(self._handlers.keys())
+
+        return handler(words[1:])
+
+    def close(self):
+        if self._socket is not None:
+            try:
+                # wakes the thread blocked in accept
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._socket.close()
+            self._socket = None
+            try:
+                os.remove(self._path)
+            except OSError:
+                pass
+
+
+def send_control_command(path: str, command: str) -> str:
+    """Send a command to a running tgminer's control socket.
+
+    :param path: Socket path.
+    :param command: Command line.
+    :return: The reply.
+    """
+    # noinspection PyUnresolvedReferences
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        connection.sendall((command + '\n').encode('utf-8'))
+        return connection.makefile('r', encoding='utf-8').readline().rstrip('\n')
@@ -0,0 +1,649 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import datetime
+import gzip
+import itertools
+import json
+import lzma
+import os
+import queue
+import re
+import shutil
+import struct
+import threading
+from collections import OrderedDict
+
+ROTATION_INTERVALS = ('none', 'day', 'week', 'month')
+"""Possible raw_log_rotation.interval config values."""
+
+COMPRESSION_EXTENSIONS = {'none': '', 'gzip': '.gz', 'xz': '.xz'}
+"""Maps raw_log_rotation.compression config values to the extension of compressed segments."""
+
+_COMPRESSION_OPENERS = {'.gz': gzip.open, '.xz': lzma.open}
+
+_INTERVAL_FORMATS = {'day': '%Y-%m-%d', 'week': '%G-W%V', 'month': '%Y-%m'}
+
+_MANIFEST_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+_SEGMENT_PATH = re.compile(r'^(.*)\.(\d{6})$')
+
+MANIFEST_EXTENSION = '.manifest.json'
+"""Extension appended to a raw log path to get the path of its segment manifest."""
+
+LOG_FORMAT_EXTENSIONS = OrderedDict([('text', '.txt'), ('jsonl', '.jsonl')])
+"""Maps raw_log_format config values to the extension of raw log files."""
+
+JSONL_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+"""Format of the **timestamp** value of JSONL raw log entries."""
+
+OFFSET_INDEX_EXTENSION = '.idx'
+"""Extension appended to a raw log path to get the path of its offset index."""
+
+_OFFSET_RECORD = struct.Struct('<qqIQI')
+"""Offset index record: message id, message date, segment sequence number (0 if not rotated), offset, length."""
+
+CHANNELS_DIR_NAME = 'channels'
+"""Data directory subdirectory holding a directory per group chat / channel."""
+
+DIRECT_CHATS_DIR_NAME = 'direct_chats'
+"""Data directory subdirectory holding the direct chat log, also the chat slug of direct chats."""
+
+
+def format_message_ref(relpath: str, offset: int, length: int) -> str:
+    """Format the **message_ref** value stored in the index in place of a message.
+
+    :param relpath: Raw log path relative to the data directory.
+    :param offset: Byte offset of the message text in the raw log.
+    :param length: Byte length of the encoded message text.
+    :return: Reference string.
+    """
+    return f'{relpath}:{offset}:{length}'
+
+
+def parse_message_ref(ref: str) -> tuple:
+    """Parse a reference created with :py:func:`format_message_ref`.
+
+    :param ref: Reference string.
+    :return: (relpath, offset, length)
+    """
+    relpath, offset, length = ref.rsplit(':', 2)
+    return relpath, int(offset), int(length)
+
+
+def chat_log_relpath(chat_slug: str, chat_id, log_format: str, account: str = None) -> str:
+    """Get the raw log path of a chat, relative to the data directory.
+
+    :param chat_slug: Chat slug as indexed, :py:data:`DIRECT_CHATS_DIR_NAME` for direct chats.
+    :param chat_id: Chat ID, ignored for direct chats.
+    :param log_format: Raw log format, a key of :py:data:`LOG_FORMAT_EXTENSIONS`.
+    :param account: Account name for the direct chats and basic groups of any account but the
+                    first, which are logged in a sub directory named after the account.  These are
+                    the messages with the account in their :py:func:`tgminer.fulltext.message_key`.
+    :return: Relative path.
+    """
+    extension = LOG_FORMAT_EXTENSIONS[log_format]
+    if chat_slug == DIRECT_CHATS_DIR_NAME:
+        if account:
+            return os.path.join(DIRECT_CHATS_DIR_NAME, account, 'log' + extension)
+        return os.path.join(DIRECT_CHATS_DIR_NAME, 'log' + extension)
+    if account:
+        return os.path.join(CHANNELS_DIR_NAME, str(chat_id), account, chat_slug + '.log' + extension)
+    return os.path.join(CHANNELS_DIR_NAME, str(chat_id), chat_slug + '.log' + extension)
+
+
+def is_jsonl_log(path: str) -> bool:
+    """Test if a raw log, segment or compressed segment path is a JSONL raw log.
+
+    :param path: The path.
+    :return: True or False.
+    """
+    for extension in _COMPRESSION_OPENERS.keys():
+        if path.endswith(extension):
+            path = path[:-len(extension)]
+            break
+
+    match = _SEGMENT_PATH.match(path)
+    if match:
+        path = match.group(1)
+
+    return path.endswith(LOG_FORMAT_EXTENSIONS['jsonl'])
+
+
+def format_jsonl_entry(fields: dict) -> str:
+    """Format a JSONL raw log entry.
+
+    :param fields: Entry fields, the same names as the stored fields of :py:class:`tgminer.fulltext.LogSchema`,
+                   **timestamp** must be a datetime.
+    :return: Single line of JSON.
+    """
+    fields = dict(fields, timestamp=fields['timestamp'].strftime(JSONL_TIME_FORMAT))
+    return json.dumps(fields, ensure_ascii=False)
+
+
+def parse_jsonl_entry(entry: str) -> dict:
+    """Parse an entry made with :py:func:`format_jsonl_entry`.
+
+    :param entry: Line of JSON.
+    :return: Entry fields, with **timestamp** converted back to a datetime.
+    """
+    fields = json.loads(entry)
+    fields['timestamp'] = datetime.datetime.strptime(fields['timestamp'], JSONL_TIME_FORMAT)
+    return fields
+
+
+def offset_index_path(log_path: str) -> str:
+    """Get the path of the offset index of a raw log.
+
+    The offset index is a sidecar file with a fixed size record per entry,
+    in the order entries were written, which maps message ids and dates
+    to the segment and byte range of their entry.
+
+    :param log_path: Raw log path.
+    :return: Offset index path.
+    """
+    return log_path + OFFSET_INDEX_EXTENSION
+
+
+def manifest_path(log_path: str) -> str:
+    """Get the path of the segment manifest of a raw log.
+
+    :param log_path: Raw log path.
+    :return: Manifest path.
+    """
+    return log_path + MANIFEST_EXTENSION
+
+
+def segment_path(log_path: str, seq: int) -> str:
+    """Get the path of a closed raw log segment, before compression.
+
+    :param log_path: Raw log path.
+    :param seq: Segment sequence number.
+    :return: Segment path.
+    """
+    return f'{log_path}.{seq:06d}'
+
+
+def load_manifest(log_path: str):
+    """Load the segment manifest of a raw log.
+
+    The manifest is a JSON object with the keys:
+
+    * **active**: sequence number the active log file will have once it is rotated.
+    * **active_started**: time the active log file was started.
+    * **legacy_segment**: sequence number of the segment which holds the log written before
+      rotation was enabled, or null.
+    * **segments**: list of closed segments, oldest first, each with the keys **seq**, **file**
+      (name relative to the log directory), **started**, **closed** and **bytes** (uncompressed size).
+
+    :param log_path: Raw log path.
+    :return: Manifest dict, or None if the log has never been rotated.
+    """
+    try:
+        with open(manifest_path(log_path), 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def _save_manifest(log_path: str, manifest: dict):
+    path = manifest_path(log_path)
+    with open(path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=4)
+    os.replace(path + '.tmp', path)
+
+
+def open_segment(path: str):
+    """Open a raw log or raw log segment for binary reading, decompressing it if needed.
+
+    :param path: Path of the log or segment, without any compression extension.
+    :return: Binary file object, or None if it does not exist.
+    """
+    try:
+        return open(path, 'rb')
+    except FileNotFoundError:
+        pass
+
+    for extension, opener in _COMPRESSION_OPENERS.items():
+        try:
+            return opener(path + extension, 'rb')
+        except FileNotFoundError:
+            pass
+
+    return None
+
+
+def _open_ref_path(path: str):
+    match = _SEGMENT_PATH.match(path)
+
+    if match is None:
+        manifest = load_manifest(path)
+        if manifest is None:
+            return open_segment(path)
+        if manifest['legacy_segment'] is None:
+            return None
+        if manifest['legacy_segment'] == manifest['active']:
+            # referenced before rotation was enabled, and the log has not been rotated since
+            return open_segment(path)
+        # referenced before rotation was enabled
+        return open_segment(segment_path(path, manifest['legacy_segment']))
+
+    file = open_segment(path)
+    if file is not None:
+        return file
+
+    # segment which has not been rotated yet
+    log_path, seq = match.group(1), int(match.group(2))
+    manifest = load_manifest(log_path)
+    if manifest is not None and manifest['active'] == seq:
+        return open_segment(log_path)
+
+    return None
+
+
+def expire_raw_log(log_path: str, cutoff: int, dry_run: bool = False) -> int:
+    """Remove the parts of a raw log which only hold entries dated before **cutoff**.
+
+    Entries are expired a whole segment at a time, using the dates in the offset index.
+    Closed segments are deleted, and the active log is truncated once every entry in it
+    has expired, so logs which are never rotated are only expired when nothing in them is
+    worth keeping.  Closed segments written before the offset index existed are expired by
+    the time they were closed.  tgminer must not be writing to the log.
+
+    :param log_path: Raw log path.
+    :param cutoff: Unix timestamp, entries with an earlier message date are expired.
+    :param dry_run: Only measure what would be removed.
+    :return: Number of uncompressed bytes removed.
+    """
+    try:
+        with open(offset_index_path(log_path), 'rb') as file:
+            records = file.read()
+    except FileNotFoundError:
+        records = b''
+
+    records = records[:len(records) - len(records) % _OFFSET_RECORD.size]
+
+    manifest = load_manifest(log_path)
+    active = manifest['active'] if manifest else 0
+
+    def physical_seq(seq):
+        # entries written before rotation was enabled are in the legacy segment
+        return manifest['legacy_segment'] if manifest and seq == 0 else seq
+
+    newest = dict()
+    for _, date, seq, _, _ in _OFFSET_RECORD.iter_unpack(records):
+        seq = physical_seq(seq)
+        newest[seq] = max(newest.get(seq, date), date)
+
+    expired = {seq for seq, date in newest.items() if date < cutoff}
+    removed = 0
+
+    kept_segments = []
+    for segment in (manifest['segments'] if manifest else []):
+        if segment['seq'] not in newest:
+            closed = datetime.datetime.strptime(segment['closed'], _MANIFEST_TIME_FORMAT)
+            if closed.timestamp() < cutoff:
+                expired.add(segment['seq'])
+
+        if segment['seq'] in expired:
+            removed += segment['bytes']
+            if not dry_run:
+                RawLogWriter.remove_segment(log_path, segment)
+        else:
+            kept_segments.append(segment)
+
+    truncate = active in expired and os.path.isfile(log_path)
+    if truncate:
+        removed += os.path.getsize(log_path)
+
+    if dry_run or not removed:
+        return removed
+
+    if truncate:
+        open(log_path, 'wb').close()
+
+    if manifest:
+        manifest['segments'] = kept_segments
+        _save_manifest(log_path, manifest)
+
+    index_path = offset_index_path(log_path)
+    with open(index_path + '.tmp', 'wb') as file:
+        for record in _OFFSET_RECORD.iter_unpack(records):
+            if physical_seq(record[2]) not in expired:
+                file.write(_OFFSET_RECORD.pack(*record))
+    os.replace(index_path + '.tmp', index_path)
+
+    return removed
+
+
+class RawLogWriter:
+    """Appends entries to raw log files, rotating and compressing them if configured.
+
+    Entries are always written as a single line ending with the message text,
+    which lets the index point at the message instead of storing a copy of it.
+
+    Closed segments are compressed on a background thread, call :py:meth:`close`
+    to wait for pending compression.
+    """
+
+    def __init__(self, data_dir: str, rotation=None):
+        """
+        :param data_dir: Data directory, message references are relative to it.
+        :param rotation: The raw_log_rotation config namespace, or None to never rotate.
+        """
+        self._data_dir = data_dir
+        self._lock = threading.Lock()
+        self._rotation = rotation
+        self._manifests = dict()
+        self._jobs = queue.Queue()
+        self._worker = None
+
+        self._rotates = rotation is not None and (rotation.max_bytes > 0 or rotation.interval != 'none')
+
+    def append(self, path: str, entry: str, message: str = None, message_id: int = None, date: int = None):
+        """Append an entry to a raw log.
+
+        :param path: Raw log file path.
+        :param entry: Log entry.  In text logs it must end with **message** if that is given,
+                      in JSONL logs it is made with :py:func:`format_jsonl_entry`.
+        :param message: Message text of the entry, or None.
+        :param message_id: Message ID, if given the entry is recorded in the offset index of the log.
+        :param date: Message date as a unix timestamp, recorded in the offset index.
+        :return: Reference to the message text in the log, see :py:func:`format_message_ref`,
+                 or None if **message** was not given.  JSONL references cover the whole entry.
+        """
+        data = (entry + os.linesep).encode('utf-8')
+        entry_length = len(data) - len(os.linesep)
+
+        with self._lock:
+            seq = self._prepare_segment(path, len(data))
+
+            with open(path, 'ab') as file:
+                offset = file.tell()
+                file.write(data)
+
+            if message_id is not None:
+                with open(offset_index_path(path), 'ab') as file:
+                    file.write(_OFFSET_RECORD.pack(message_id, date or 0, seq, offset, entry_length))
+
+        if not message:
+            return None
+
+        ref_path = os.path.relpath(segment_path(path, seq) if seq else path, self._data_dir)
+
+        if is_jsonl_log(path):
+            return format_message_ref(ref_path, offset, entry_length)
+
+        length = len(message.encode('utf-8'))
+
+        return format_message_ref(ref_path, offset + entry_length - length, length)
+
+    def _prepare_segment(self, path: str, incoming: int) -> int:
+        # once a log has a manifest, entries are referenced by segment even if rotation is turned off
+        if path in self._manifests:
+            manifest = self._manifests[path]
+        else:
+            manifest = self._manifests[path] = load_manifest(path)
+
+        if not self._rotates:
+            return manifest['active'] if manifest else 0
+
+        now = datetime.datetime.now()
+
+        if manifest is None:
+            has_legacy = os.path.isfile(path) and os.path.getsize(path) > 0
+            manifest = {'active': 1,
+                        'active_started': now.strftime(_MANIFEST_TIME_FORMAT),
+                        'legacy_segment': 1 if has_legacy else None,
+                        'segments': []}
+            _save_manifest(path, manifest)
+            self._manifests[path] = manifest
+
+        size = os.path.getsize(path) if os.path.isfile(path) else 0
+
+        if size > 0 and self._rotation_due(manifest, size + incoming, now):
+            self._rotate(path, manifest, size, now)
+
+        return manifest['active']
+
+    def _rotation_due(self, manifest: dict, new_size: int, now: datetime.datetime) -> bool:
+        if 0 < self._rotation.max_bytes < new_size:
+            return True
+
+        if self._rotation.interval != 'none':
+            interval_format = _INTERVAL_FORMATS[self._rotation.interval]
+            started = datetime.datetime.strptime(manifest['active_started'], _MANIFEST_TIME_FORMAT)
+            return started.strftime(interval_format) != now.strftime(interval_format)
+
+        return False
+
+    def _rotate(self, path: str, manifest: dict, size: int, now: datetime.datetime):
+        seq = manifest['active']
+        segment = segment_path(path, seq)
+
+        os.rename(path, segment)
+
+        manifest['segments'].append({'seq': seq,
+                                     'file': os.path.basename(segment),
+                                     'started': manifest['active_started'],
+                                     'closed': now.strftime(_MANIFEST_TIME_FORMAT),
+                                     'bytes': size})
+        manifest['active'] = seq + 1
+        manifest['active_started'] = now.strftime(_MANIFEST_TIME_FORMAT)
+
+        retain = self._rotation.retain
+        if retain and len(manifest['segments']) > retain:
+            expired = manifest['segments'][:-retain]
+            manifest['segments'] = manifest['segments'][-retain:]
+            for expired_segment in expired:
+                self.remove_segment(path, expired_segment)
+
+        _save_manifest(path, manifest)
+
+        extension = COMPRESSION_EXTENSIONS[self._rotation.compression]
+        if extension:
+            self._submit(path, seq, extension)
+
+    @staticmethod
+    def remove_segment(path: str, segment: dict):
+        """Delete the file of a closed segment, whether it is compressed or not.
+
+        :param path: Raw log path.
+        :param segment: Segment entry from the manifest, see :py:func:`load_manifest`.
+        """
+        base = segment_path(path, segment['seq'])
+        for extension in ('',) + tuple(_COMPRESSION_OPENERS.keys()):
+            try:
+                os.remove(base + extension)
+            except FileNotFoundError:
+                pass
+
+    def _submit(self, path: str, seq: int, extension: str):
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._compress_worker, name='RawLogCompressor', daemon=True)
+            self._worker.start()
+        self._jobs.put((path, seq, extension))
+
+    def _compress_worker(self):
+        while True:
+            job = self._jobs.get()
+            try:
+                if job is None:
+                    return
+                self._compress_segment(*job)
+            finally:
+                self._jobs.task_done()
+
+    def _compress_segment(self, path: str, seq: int, extension: str):
+        segment = segment_path(path, seq)
+        compressed = segment + extension
+
+        try:
+            with open(segment, 'rb') as source, _COMPRESSION_OPENERS[extension](compressed + '.tmp', 'wb') as dest:
+                shutil.copyfileobj(source, dest)
+        except FileNotFoundError:
+            # removed by retention before it was compressed
+            return
+
+        with self._lock:
+            manifest = self._manifests[path]
+            entry = next((s for s in manifest['segments'] if s['seq'] == seq), None)
+
+            if entry is None:
+                os.remove(compressed + '.tmp')
+                return
+
+            os.replace(compressed + '.tmp', compressed)
+            os.remove(segment)
+
+            entry['file'] = os.path.basename(compressed)
+            _save_manifest(path, manifest)
+
+    def close(self):
+        """Wait for pending segment compression to finish."""
+        if self._worker is not None:
+            self._jobs.put(None)
+            self._worker.join()
+            self._worker = None
+
+
+class RawLogReader:
+    """Reads messages referenced by the index from raw log files.
+
+    Files are kept open until :py:meth:`close`, since search results tend to
+    reference the same few logs.  Rotated and compressed segments are found
+    and decompressed transparently.
+    """
+
+    def __init__(self, data_dir: str):
+        self._data_dir = data_dir
+        self._files = dict()
+        self._offset_indexes = dict()
+
+    def _open(self, relpath: str):
+        file = self._files.get(relpath, None)
+
+        if file is None:
+            file = _open_ref_path(os.path.join(self._data_dir, relpath))
+            if file is not None:
+                self._files[relpath] = file
+
+        return file
+
+    def read_message(self, ref: str):
+        """Read a message referenced with :py:func:`format_message_ref`.
+
+        :param ref: Reference string.
+        :return: Message text, or None if the raw log is missing.
+        """
+        relpath, offset, length = parse_message_ref(ref)
+
+        file = self._open(relpath)
+        if file is None:
+            return None
+
+        file.seek(offset)
+        data = file.read(length).decode('utf-8', errors='replace')
+
+        return json.loads(data)['message'] if is_jsonl_log(relpath) else data
+
+    def _offset_index(self, relpath: str):
+        records = self._offset_indexes.get(relpath, None)
+
+        if records is None:
+            try:
+                with open(offset_index_path(os.path.join(self._data_dir, relpath)), 'rb') as file:
+                    records = file.read()
+            except FileNotFoundError:
+                records = b''
+
+            # ignore a record which is still being written
+            records = records[:len(records) - len(records) % _OFFSET_RECORD.size]
+            self._offset_indexes[relpath] = records
+
+        return records
+
+    @staticmethod
+    def _find_record(records: bytes, message_id: int, date: int):
+        size = _OFFSET_RECORD.size
+        count = len(records) // size
+
+        # records are in the order they were written, which is nearly date order,
+        # so look around the first record with the date before scanning everything
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if _OFFSET_RECORD.unpack_from(records, middle * size)[1] < date:
+                low = middle + 1
+            else:
+                high = middle
+
+        for position in itertools.chain(range(low, count), range(low - 1, -1, -1)):
+            if _OFFSET_RECORD.unpack_from(records, position * size)[0] == message_id:
+                return position
+
+        return None
+
+    def read_context(self, relpath: str, message_id: int, date: int, count: int):
+        """Read the entries around a message in a raw log, using the offset index of the log.
+
+        :param relpath: Raw log path relative to the data directory, see :py:func:`chat_log_relpath`.
+        :param message_id: Message ID.
+        :param date: Message date as a unix timestamp, speeds up finding the message.
+        :param count: Number of entries to read before and after the message.
+        :return: List of (entry, is_message) tuples in log order, or None if the message is not
+                 in the offset index.  Entries of JSONL logs are parsed with :py:func:`parse_jsonl_entry`,
+                 text entries are strings.  Entries in segments removed by retention are left out.
+        """
+        records = self._offset_index(relpath)
+
+        position = self._find_record(records, message_id, date)
+        if position is None:
+            return None
+
+        jsonl = is_jsonl_log(relpath)
+        total = len(records) // _OFFSET_RECORD.size
+
+        entries = []
+        for index in range(max(0, position - count), min(total, position + count + 1)):
+            _, _, seq, offset, length = _OFFSET_RECORD.unpack_from(records, index * _OFFSET_RECORD.size)
+
+            file = self._open(segment_path(relpath, seq) if seq else relpath)
+            if file is None:
+                continue
+
+            file.seek(offset)
+            entry = file.read(length).decode('utf-8', errors='replace')
+
+            entries.append((parse_jsonl_entry(entry) if jsonl else entry, index == position))
+
+        return entries
+
+    def close(self):
+        for file in self._files.values():
+            file.close()
+        self._files.clear()
+        self._offset_indexes.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
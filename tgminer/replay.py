@@ -0,0 +1,225 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import argparse
+import os.path
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import tgminer.capture
+import tgminer.config
+import tgminer.tgminer
+from tgminer import exits
+from tgminer.cio import enc_print
+
+REPLAY_SPEED_MAX = 'max'
+"""--speed value which replays updates without waiting between them."""
+
+
+class ReplayClient:
+    """Stands in for the pyrogram client of an account while replaying a capture.
+
+    Media downloads are skipped, so only the ingest work done by tgminer is measured.
+    """
+
+    is_started = False
+
+    def __init__(self, account: str):
+        self.account = account
+        self.downloads = 0
+
+    def download_media(self, message, file_name: str = '', block: bool = True, **kwargs):
+        self.downloads += 1
+        return None
+
+
+def replay_speed(parser: argparse.ArgumentParser):
+    def test(value):
+        if value == REPLAY_SPEED_MAX:
+            return None
+
+        # noinspection PyBroadException
+        try:
+            value = float(value)
+        except Exception:
+            parser.error(f'Replay speed must be a number or "{REPLAY_SPEED_MAX}".')
+
+        if value <= 0:
+            parser.error('Replay speed must be greater than 0.')
+        return value
+
+    return test
+
+
+def replay_client(config: tgminer.config.TGMinerConfig, data_dir: str) -> tgminer.tgminer.TGMinerClient:
+    """Create a tgminer client to replay captures into, which never connects to telegram.
+
+    :param config: The config, its **data_dir** is replaced and update capture is disabled.
+    :param data_dir: Data directory replayed messages are logged and indexed into.
+    :return: The client, with a :py:class:`ReplayClient` for each account of the config.
+    """
+    config.data_dir = data_dir
+
+    # never append to the capture being replayed
+    config.update_capture.enabled = False
+
+    stubs = {account['name']: ReplayClient(account['name']) for account in config.accounts}
+
+    return tgminer.tgminer.TGMinerClient(config, clients=stubs)
+
+
+def replay_capture(client: tgminer.tgminer.TGMinerClient, path: str, speed: float = None, workers: int = 1) -> int:
+    """Feed the updates in a capture file to a tgminer client, as its update threads would.
+
+    :param client: The client, see :py:func:`replay_client`.
+    :param path: Capture file path.
+    :param speed: Multiple of the original pace to replay updates at, or None to replay them without waiting.
+    :param workers: Number of update threads.
+    :return: Number of updates replayed.
+    """
+    stubs = dict()
+
+    # bounded like the pyrogram update queue would be by its workers keeping up
+    updates = queue.Queue(maxsize=workers * 64)
+
+    def work():
+        while True:
+            item = updates.get()
+            if item is None:
+                return
+            client.receive_update(item.account, stubs[item.account], item.update, item.users, item.chats)
+
+    threads = [threading.Thread(target=work, name=f'ReplayWorker#{i + 1}', daemon=True) for i in range(workers)]
+
+    for thread in threads:
+        thread.start()
+
+    count = 0
+    first = None
+    started = time.perf_counter()
+
+    try:
+        for item in tgminer.capture.read_capture(path):
+            if item.account not in stubs:
+                stubs[item.account] = ReplayClient(item.account)
+
+            if speed is not None:
+                if first is None:
+                    first = item.received
+
+                delay = started + (item.received - first) / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+            updates.put(item)
+            count += 1
+    finally:
+        for _ in threads:
+            updates.put(None)
+
+        for thread in threads:
+            thread.join()
+
+    return count
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Replay updates recorded with the "update_capture" config option through tgminer, '
+                    'without connecting to telegram, and report ingest throughput. Messages are logged '
+                    'and indexed into a temporary data directory, or the one given with --data-dir.',
+        prog='tgminer-replay'
+    )
+
+    arg_parser.add_argument('--version', action='version', version='%(prog)s ' + tgminer.__version__)
+
+    arg_parser.add_argument('capture', help='Update capture file.')
+
+    arg_parser.add_argument('--config',
+                            help='Path to TGMiner config file, defaults to "CWD/config.json". '
+                                 'This will override the environmental variable '
+                                 'TGMINER_CONFIG if it was defined.')
+
+    arg_parser.add_argument('--speed', default=1.0, type=replay_speed(arg_parser),
+                            help='Replay updates at this multiple of the pace they were captured at, '
+                                 f'or "{REPLAY_SPEED_MAX}" to replay them as fast as tgminer accepts them. '
+                                 'Default is 1.')
+
+    arg_parser.add_argument('--data-dir',
+                            help='Log and index replayed messages into this data directory, which must not be the '
+                                 'data directory of a running tgminer. Defaults to a temporary directory which '
+                                 'is removed afterwards.')
+
+    args = arg_parser.parse_args()
+
+    if not os.path.isfile(args.capture):
+        enc_print(f'Capture file "{args.capture}" does not exist.', file=sys.stderr)
+        exit(exits.EX_NOINPUT)
+
+    config_path = tgminer.config.get_config_path(args.config)
+
+    if not os.path.isfile(config_path):
+        enc_print(f'Config file "{config_path}" does not exist.', file=sys.stderr)
+        exit(exits.EX_NOINPUT)
+
+    try:
+        config = tgminer.config.TGMinerConfig(config_path)
+    except tgminer.config.TGMinerConfigException as e:
+        enc_print(str(e), file=sys.stderr)
+        exit(exits.EX_CONFIG)
+        return
+
+    data_dir = args.data_dir if args.data_dir else tempfile.mkdtemp(prefix='tgminer-replay-')
+
+    try:
+        client = replay_client(config, data_dir)
+
+        started = time.perf_counter()
+
+        try:
+            count = replay_capture(client, args.capture, args.speed, config.updates_workers)
+            received = time.perf_counter() - started
+        except ValueError as e:
+            client.stop()
+            enc_print(str(e), file=sys.stderr)
+            exit(exits.EX_NOINPUT)
+            return
+
+        # shutting down drains the pipeline, so this includes indexing everything replayed
+        client.stop()
+        finished = time.perf_counter() - started
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    enc_print(f'Replayed {count} update(s) in {received:.3f} seconds, '
+              f'{count / received if received else 0:.1f} updates/s.')
+
+    enc_print(f'Pipeline drained after {finished:.3f} seconds, '
+              f'{count / finished if finished else 0:.1f} updates/s.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import datetime
+
+
+def chat_rule(retention, chat_id) -> tuple:
+    """Find the retention limits of a chat.
+
+    :param retention: The retention config namespace.
+    :param chat_id: Chat ID, matched against the **chat_id** regex of each rule in **retention.chats**.
+    :return: (max_age_days, max_bytes) of the first matching rule, or the global max_age_days
+             and no size limit if no rule matches.  0 means no limit.
+    """
+    for rule in retention.chats:
+        if rule['chat_id'].match(str(chat_id)):
+            return rule['max_age_days'], rule['max_bytes']
+    return retention.max_age_days, 0
+
+
+def _size_cutoff(documents, max_bytes: int):
+    total = 0
+
+    # keep the newest documents which fit, the first which does not expires with everything
+    # older, and with documents of the same timestamp since a cutoff can not split them
+    for timestamp, size in sorted(documents, key=lambda document: document[0], reverse=True):
+        total += size
+        if total > max_bytes:
+            return timestamp + datetime.timedelta(microseconds=1)
+
+    return None
+
+
+def _latest(*cutoffs):
+    cutoffs = [cutoff for cutoff in cutoffs if cutoff is not None]
+    return max(cutoffs) if cutoffs else None
+
+
+def expiry_cutoffs(chats: dict, retention, now: datetime.datetime) -> dict:
+    """Work out which documents the retention config expires.
+
+    Each chat is limited by its own rule first, see :py:func:`chat_rule`.  The global
+    **max_bytes** limit then applies to what is left of every chat together, expiring the
+    oldest documents of any chat first.
+
+    :param chats: Dict of chat ID to a list of (timestamp, size in bytes) for each of its documents.
+    :param retention: The retention config namespace.
+    :param now: Current time, ages are measured from it.
+    :return: Dict of chat ID to a datetime, documents of the chat with an earlier timestamp are expired.
+             Chats with nothing to expire are left out.
+    """
+    cutoffs = dict()
+
+    for chat_id, documents in chats.items():
+        max_age_days, max_bytes = chat_rule(retention, chat_id)
+
+        cutoff = _latest(now - datetime.timedelta(days=max_age_days) if max_age_days else None,
+                         _size_cutoff(documents, max_bytes) if max_bytes else None)
+
+        if cutoff is not None:
+            cutoffs[chat_id] = cutoff
+
+    if retention.max_bytes:
+        remaining = [(timestamp, size) for chat_id, documents in chats.items() for timestamp, size in documents
+                     if chat_id not in cutoffs or timestamp >= cutoffs[chat_id]]
+
+        cutoff = _size_cutoff(remaining, retention.max_bytes)
+
+        if cutoff is not None:
+            for chat_id in chats:
+                cutoffs[chat_id] = _latest(cutoffs.get(chat_id, None), cutoff)
+
+    return {chat_id: cutoff for chat_id, cutoff in cutoffs.items()
+            if any(timestamp < cutoff for timestamp, _ in chats[chat_id])}
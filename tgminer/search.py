@@ -19,18 +19,24 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import argparse
+import contextlib
+import datetime
+import json
+import multiprocessing
 import os.path
 import re
+import sys
 
-import fasteners
 import kovit
 import kovit.iters
-import whoosh.index
-from whoosh.qparser import QueryParser, sys
+from slugify import slugify
 
+import tgminer.backend
 import tgminer.config
 import tgminer.fulltext
+import tgminer.rawlog
 from tgminer import exits
+from tgminer.wordindex import WordStateIndex, word_index_path
 from tgminer.cio import enc_print
 
 
@@ -64,6 +70,397 @@ def markov_state_size(parser: argparse.ArgumentParser):
     return test
 
 
+DATE_ARG_FORMATS = ('%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S')
+"""Formats accepted by --since and --until, in local time."""
+
+
+def date_arg(parser: argparse.ArgumentParser, option: str):
+    def test(value):
+        for date_format in DATE_ARG_FORMATS:
+            try:
+                return datetime.datetime.strptime(value, date_format)
+            except ValueError:
+                pass
+        parser.error(f'{option} must be a date in the form "YYYY-MM-DD", "YYYY-MM-DD HH:MM" '
+                     f'or "YYYY-MM-DD HH:MM:SS".')
+
+    return test
+
+
+def top_groups(parser: argparse.ArgumentParser):
+    def test(value):
+        # noinspection PyBroadException
+        try:
+            value = int(value)
+        except Exception:
+            parser.error('Top group count must be an integer.')
+
+        if value < 1:
+            parser.error('Top group count cannot be less than 1.')
+        return value
+
+    return test
+
+
+def markov_min_messages(parser: argparse.ArgumentParser):
+    def test(value):
+        # noinspection PyBroadException
+        try:
+            value = int(value)
+        except Exception:
+            parser.error('Markov minimum message count must be an integer.')
+
+        if value < 1:
+            parser.error('Markov minimum message count cannot be less than 1.')
+        return value
+
+    return test
+
+
+def context_count(parser: argparse.ArgumentParser):
+    def test(value):
+        # noinspection PyBroadException
+        try:
+            value = int(value)
+        except Exception:
+            parser.error('Context entry count must be an integer.')
+
+        if value < 0:
+            parser.error('Context entry count cannot be less than 0.')
+        return value
+
+    return test
+
+
+def process_count(parser: argparse.ArgumentParser):
+    def test(value):
+        # noinspection PyBroadException
+        try:
+            value = int(value)
+        except Exception:
+            parser.error('Process count must be an integer.')
+
+        if value < 1:
+            parser.error('Process count cannot be less than 1.')
+        return value
+
+    return test
+
+
+MARKOV_GROUP_BY_FIELDS = ('username', 'alias', 'chat')
+"""LogSchema fields which --markov-group-by can split chains by."""
+
+MARKOV_MANIFEST_NAME = 'manifest.json'
+"""Name of the file written into --markov OUT_DIR describing each grouped chain file."""
+
+
+class _MarkovGroup:
+    """Accumulates one group's messages into a markov chain.
+
+    Messages are buffered until the group reaches the minimum message count,
+    so groups which never qualify for their own model never build a chain.
+    """
+
+    def __init__(self, min_messages: int):
+        self.count = 0
+        self.chain = None
+        self.word_index = None
+        self._min_messages = min_messages
+        self._pending = []
+
+    def add(self, words: list, word_iter, state_size: int):
+        self.count += 1
+
+        if self.chain is None:
+            self._pending.append(words)
+            if self.count < self._min_messages:
+                return
+            self.chain = kovit.Chain()
+            self.word_index = WordStateIndex()
+            pending = self._pending
+            self._pending = None
+        else:
+            pending = (words,)
+
+        for message_words in pending:
+            for start, next_items in word_iter(message_words, state_size):
+                self.chain.add_to_bag(start, next_items)
+                self.word_index.add(start)
+
+
+def format_hit(config: tgminer.config.TGMinerConfig, hit: dict) -> str:
+    """Format a search result, or a JSONL raw log entry, the way tgminer prints raw log entries.
+
+    :param config: The config, for **timestamp_format**.
+    :param hit: Stored fields of the result.
+    :return: Formatted line.
+    """
+    message = hit.get('message', None)
+
+    username = hit.get('username', None)
+    alias = hit.get('alias', 'NO_ALIAS')
+
+    to_username = hit.get('to_username', None)
+    to_alias = hit.get('to_alias', None)
+    to_id = hit.get('to_id')
+
+    username_part = f' [@{username}]' if username else ''
+
+    timestamp = config.timestamp_format.format(hit['timestamp'])
+
+    chat_slug = hit['chat']
+
+    media = hit.get('media', None)
+
+    to_username_part = f' [@{to_username}]' if to_username else ''
+
+    to_user_part = f' to {to_alias}{to_username_part}' if to_alias or to_username_part else ''
+
+    repeats = hit.get('repeats', None)
+
+    repeats_part = f' (repeated {repeats} times)' if repeats else ''
+
+    if media:
+        caption_part = f' Caption: {message}' if message else ''
+
+        return f'{timestamp} chat="{chat_slug}" to_id="{to_id}"{to_user_part} | {alias}{username_part}: ' \
+               f'{media}{caption_part}{repeats_part}'
+    else:
+        return f'{timestamp} chat="{chat_slug}" to_id="{to_id}"{to_user_part} | {alias}{username_part}: ' \
+               f'{message}{repeats_part}'
+
+
+def read_hit_context(raw_logs: tgminer.rawlog.RawLogReader, hit: dict, count: int):
+    """Read the raw log entries around a search result.
+
+    Both raw log formats are tried, since the format may have been changed in the config
+    after the message was logged.  Direct chats are looked for in the log of the account
+    which received them first.
+
+    :param raw_logs: Raw log reader.
+    :param hit: Stored fields of the result.
+    :param count: Number of entries before and after the result.
+    :return: See :py:meth:`tgminer.rawlog.RawLogReader.read_context`, None if the result
+             has no offset index entry.
+    """
+    message_id = hit.get('message_id', None)
+    if message_id is None:
+        return None
+
+    date = hit.get('date', None)
+    date = int(date.timestamp()) if date else 0
+
+    # the first account logs direct chats without an account sub directory
+    accounts = (hit['account'], None) if hit.get('account', None) else (None,)
+
+    for account in accounts:
+        for log_format in tgminer.rawlog.LOG_FORMAT_EXTENSIONS.keys():
+            relpath = tgminer.rawlog.chat_log_relpath(hit['chat'], hit.get('to_id'), log_format, account)
+            entries = raw_logs.read_context(relpath, message_id, date, count)
+            if entries is not None:
+                return entries
+
+    return None
+
+
+def read_queries(path: str) -> list:
+    """Read a --queries-file, one query per line.
+
+    Blank lines and lines starting with # are skipped.
+
+    :param path: File path, "-" reads standard input.
+    :return: List of query strings.
+    """
+    if path == '-':
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path, 'r', encoding='utf-8') as file:
+            lines = file.read().splitlines()
+
+    return [line.strip() for line in lines if line.strip() and not line.lstrip().startswith('#')]
+
+
+def format_hit_json(query_text: str, hit: dict) -> str:
+    """Format a search result as a line of JSON tagged with the query which found it.
+
+    Fields are written the same way as JSONL raw log entries.
+
+    :param query_text: Query text.
+    :param hit: Stored fields of the result, with the message text read in.
+    :return: Single line of JSON.
+    """
+    fields = {name: value for name, value in hit.items() if name not in ('message_ref', 'ngram_fields')}
+
+    date = fields.get('date', None)
+    if date is not None:
+        fields['date'] = int(date.timestamp())
+
+    return tgminer.rawlog.format_jsonl_entry(dict(query=query_text, **fields))
+
+
+def run_batch_query(index: tgminer.backend.IndexBackend,
+                    raw_logs: tgminer.rawlog.RawLogReader,
+                    query_text: str,
+                    args) -> list:
+    """Run one query of a --queries-file batch.
+
+    :param index: The index, usually inside :py:meth:`tgminer.backend.IndexBackend.session`.
+    :param raw_logs: Raw log reader, for message text which is not stored in the index.
+    :param query_text: Query text.
+    :param args: Parsed arguments, for --limit, --since, --until, --count, --group-by and --top,
+                 and **ngram_fields** from :py:func:`tgminer.backend.routed_ngram_fields`.
+    :return: List of JSON lines, one per result, a single line with the counts when
+             counting, or a single line with an "error" if the query cannot be run.
+    """
+    try:
+        query = tgminer.backend.parse_query(query_text, args.ngram_fields)
+
+        if args.count or args.group_by:
+            total, groups = index.count(query, args.group_by, args.top, args.since, args.until)
+
+            entry = {'query': query_text, 'count': total}
+            if groups is not None:
+                entry['groups'] = [{'group': value or None, 'count': count} for value, count in groups]
+
+            return [json.dumps(entry, ensure_ascii=False)]
+
+        lines = []
+        for fields in index.search(query,
+                                   limit=None if args.limit < 1 else args.limit,
+                                   since=args.since,
+                                   until=args.until):
+            if 'message' not in fields and 'message_ref' in fields:
+                fields['message'] = raw_logs.read_message(fields['message_ref'])
+
+            lines.append(format_hit_json(query_text, fields))
+
+        return lines
+    except ValueError as e:
+        return [json.dumps({'query': query_text, 'error': str(e)}, ensure_ascii=False)]
+
+
+_batch_worker = None
+
+
+def _init_batch_worker(config_path: str, args):
+    global _batch_worker
+
+    config = tgminer.config.TGMinerConfig(config_path)
+
+    # left open until the pool ends the process
+    resources = contextlib.ExitStack()
+    index = resources.enter_context(tgminer.backend.open_index(config))
+    resources.enter_context(index.session())
+    raw_logs = resources.enter_context(tgminer.rawlog.RawLogReader(config.data_dir))
+
+    _batch_worker = (index, raw_logs, args, resources)
+
+
+def _run_batch_worker(query_text: str) -> list:
+    index, raw_logs, args, _ = _batch_worker
+    return run_batch_query(index, raw_logs, query_text, args)
+
+
+def run_query_batch(config: tgminer.config.TGMinerConfig, index: tgminer.backend.IndexBackend, args):
+    """Run every query in --queries-file against one searcher, printing JSONL in query order.
+
+    With --processes, queries are spread over a pool of processes which each open the index
+    once. The interprocess index lock is only held while a searcher is opened, so a running
+    tgminer can keep indexing during the batch.
+
+    :param config: The config.
+    :param index: The index, closed when done.
+    :param args: Parsed arguments.
+    """
+    try:
+        queries = read_queries(args.queries_file)
+    except OSError as e:
+        enc_print(f'Could not read queries file "{args.queries_file}", error: {e}', file=sys.stderr)
+        exit(exits.EX_NOINPUT)
+        return
+
+    with index:
+        if args.processes > 1:
+            with multiprocessing.Pool(args.processes, initializer=_init_batch_worker,
+                                      initargs=(config.config_path, args)) as pool:
+                for lines in pool.imap(_run_batch_worker, queries):
+                    for line in lines:
+                        enc_print(line)
+        else:
+            with index.session(), tgminer.rawlog.RawLogReader(config.data_dir) as raw_logs:
+                for query_text in queries:
+                    for line in run_batch_query(index, raw_logs, query_text, args):
+                        enc_print(line)
+
+
+def write_markov_chain(path: str, chain: kovit.Chain, word_index: WordStateIndex):
+    """Write a markov chain file, and the word index used by tgminer-markov for seeded generation.
+
+    :param path: Chain file path, the word index is written next to it.
+    :param chain: The chain.
+    :param word_index: The chain's word to state index.
+    """
+    with open(path, 'w', encoding='utf-8') as m_out:
+        chain.dump_json(m_out)
+
+    with open(word_index_path(path), 'w', encoding='utf-8') as m_out:
+        word_index.dump_json(m_out)
+
+
+def _markov_group_file_name(key: str, used: set) -> str:
+    base = slugify(key) or 'group'
+    name = base
+    suffix = 2
+    while name in used:
+        name = f'{base}-{suffix}'
+        suffix += 1
+    used.add(name)
+    return name + '.json'
+
+
+def write_grouped_markov_chains(args, hits, split_by_spaces, word_iter):
+    groups = dict()
+
+    for hit in hits:
+        message = hit.get('message', None)
+        key = hit.get(args.markov_group_by, None)
+        if not message or not key:
+            continue
+
+        group = groups.get(key, None)
+        if group is None:
+            group = groups[key] = _MarkovGroup(args.markov_min_messages)
+
+        group.add(split_by_spaces.split(message), word_iter, args.markov_state_size)
+
+    qualified = sorted(((key, group) for key, group in groups.items() if group.chain is not None),
+                       key=lambda item: item[0])
+
+    if not qualified:
+        enc_print('Query returned no groups with enough messages!', file=sys.stderr)
+        exit(exits.EX_SOFTWARE)
+
+    manifest = []
+    used_names = set()
+
+    try:
+        os.makedirs(args.markov, exist_ok=True)
+
+        for key, group in qualified:
+            file_name = _markov_group_file_name(key, used_names)
+
+            write_markov_chain(os.path.join(args.markov, file_name), group.chain, group.word_index)
+
+            manifest.append({args.markov_group_by: key, 'messages': group.count, 'chain': file_name})
+
+        with open(os.path.join(args.markov, MARKOV_MANIFEST_NAME), 'w', encoding='utf-8') as m_out:
+            json.dump(manifest, m_out, indent=4)
+    except OSError as e:
+        enc_print(f'Could not write markov chains to directory "{args.markov}", error: {e}',
+                  file=sys.stderr)
+        exit(exits.EX_CANTCREAT)
+
+
 def main():
     arg_parser = argparse.ArgumentParser(
         description='Perform a full-text search over stored telegram messages.',
@@ -72,21 +469,71 @@ def main():
 
     arg_parser.add_argument('--version', action='version', version='%(prog)s ' + tgminer.__version__)
 
-    arg_parser.add_argument('query', help='Query text.')
+    arg_parser.add_argument('query', nargs='?', default=None,
+                            help='Query text. Not used with --queries-file.')
 
     arg_parser.add_argument('--config',
                             help='Path to TGMiner config file, defaults to "CWD/config.json". '
                                  'This will override the environmental variable '
                                  'TGMINER_CONFIG if it was defined.')
 
-    arg_parser.add_argument('--limit', help='Results limit, 0 for infinite. Default is 10.',
+    arg_parser.add_argument('--limit', help='Results limit, 0 for infinite. Default is 10, '
+                                            'or infinite with --markov-group-by.',
                             type=query_limit(arg_parser),
-                            default=10)
+                            default=None)
+
+    arg_parser.add_argument('--since', default=None, type=date_arg(arg_parser, '--since'),
+                            help='Only search messages logged at or after this local date/time, '
+                                 'given as "YYYY-MM-DD", "YYYY-MM-DD HH:MM" or "YYYY-MM-DD HH:MM:SS".')
+
+    arg_parser.add_argument('--until', default=None, type=date_arg(arg_parser, '--until'),
+                            help='Only search messages logged before this local date/time, '
+                                 'in the same format as --since.')
+
+    arg_parser.add_argument('--queries-file', default=None, metavar='FILE',
+                            help='Run every query in FILE, one per line, against a single searcher, '
+                                 'and print the results as JSON lines tagged with their "query". '
+                                 'Blank lines and lines starting with # are skipped, "-" reads '
+                                 'standard input. --limit, --since, --until, --count, --group-by and '
+                                 '--top apply to every query.')
+
+    arg_parser.add_argument('--processes', default=None, type=process_count(arg_parser), metavar='N',
+                            help='Run the queries of --queries-file in a pool of N processes, for '
+                                 'CPU heavy queries. Default is 1.')
+
+    arg_parser.add_argument('--count', action='store_true', default=False,
+                            help='Only print the number of messages matching the query.')
+
+    arg_parser.add_argument('--group-by', default=None, choices=tuple(tgminer.fulltext.GROUP_BY_FIELDS.keys()),
+                            help='Only print the number of messages matching the query for each chat, '
+                                 'username, media type or account, largest first. Each line is the count '
+                                 'followed by a tab and the group.')
+
+    arg_parser.add_argument('--top', default=None, type=top_groups(arg_parser),
+                            help='Only print the N largest groups. Must be used in conjunction with --group-by.')
+
+    arg_parser.add_argument('--context', default=None, type=context_count(arg_parser), metavar='N',
+                            help='Also print the N raw log entries before and after each result, read '
+                                 'directly from the raw log using its offset index. Results logged before '
+                                 'raw logs had an offset index are printed without context.')
 
     arg_parser.add_argument('--markov',
-                            help='Generate a markov chain file from the messages in your query results.',
+                            help='Generate a markov chain file from the messages in your query results. '
+                                 'When used with --markov-group-by this is an output directory instead.',
                             metavar='OUT_FILE')
 
+    arg_parser.add_argument('--markov-group-by', default=None, choices=MARKOV_GROUP_BY_FIELDS,
+                            help='Generate one markov chain file per username, alias or chat found in your '
+                                 'query results, in a single pass over the index. --markov is treated as '
+                                 'an output directory, which receives one chain file per group and a '
+                                 f'"{MARKOV_MANIFEST_NAME}" file mapping each group to its chain file.')
+
+    arg_parser.add_argument('--markov-min-messages', default=None,
+                            help='The minimum number of messages a group must have before a chain file '
+                                 'is written for it, default is 1. Must be used in conjunction '
+                                 'with --markov-group-by.',
+                            type=markov_min_messages(arg_parser))
+
     arg_parser.add_argument('--markov-state-size', default=None,
                             help='The number of words to use in the markov model\'s state, default is 2. '
                                  'Must be used in conjunction with --markov.',
@@ -103,18 +550,55 @@ def main():
 
     args = arg_parser.parse_args()
 
+    if (args.query is None) == (args.queries_file is None):
+        arg_parser.error('Give either a query or --queries-file.')
+
+    if args.processes is not None and args.queries_file is None:
+        arg_parser.error('Must be using the --queries-file option to use --processes.')
+
+    if args.queries_file is not None and (args.markov is not None or args.context is not None):
+        arg_parser.error('--queries-file cannot be used with --markov or --context.')
+
     if args.markov_state_size is not None and args.markov is None:
         arg_parser.error('Must be using the --markov option to use --markov-state-size.')
 
     if args.markov_optimize is not None and args.markov is None:
         arg_parser.error('Must be using the --markov option to use --markov-optimize.')
 
+    if args.markov_group_by is not None and args.markov is None:
+        arg_parser.error('Must be using the --markov option to use --markov-group-by.')
+
+    if args.markov_min_messages is not None and args.markov_group_by is None:
+        arg_parser.error('Must be using the --markov-group-by option to use --markov-min-messages.')
+
+    if args.since is not None and args.until is not None and args.since >= args.until:
+        arg_parser.error('--since must be earlier than --until.')
+
+    if args.top is not None and args.group_by is None:
+        arg_parser.error('Must be using the --group-by option to use --top.')
+
+    if (args.count or args.group_by) and args.markov is not None:
+        arg_parser.error('--count and --group-by cannot be used with --markov.')
+
+    if args.context is not None and (args.count or args.group_by or args.markov is not None):
+        arg_parser.error('--context cannot be used with --count, --group-by or --markov.')
+
+    if args.limit is None:
+        # a chain per group needs every message of the group, not the first few results
+        args.limit = 0 if args.markov_group_by is not None else 10
+
     if args.markov_state_size is None:
         args.markov_state_size = 2
 
+    if args.markov_min_messages is None:
+        args.markov_min_messages = 1
+
     if args.markov_optimize is None:
         args.markov_optimize = 'accuracy'
 
+    if args.processes is None:
+        args.processes = 1
+
     config = None  # hush intellij highlighted undeclared variable use warning
 
     config_path = tgminer.config.get_config_path(args.config)
@@ -129,33 +613,74 @@ def main():
         enc_print(f'Cannot find tgminer config file: "{config_path}"')
         exit(exits.EX_NOINPUT)
 
-    index = whoosh.index.open_dir(os.path.join(config.data_dir, 'indexdir'))
+    if not tgminer.backend.index_exists(config):
+        enc_print(f'No "{config.index_backend}" index exists in "{config.data_dir}".', file=sys.stderr)
+        exit(exits.EX_NOINPUT)
+
+    index = tgminer.backend.open_index(config)
 
-    index_lock_path = os.path.join(config.data_dir, 'tgminer_mutex')
+    if args.group_by and not index.has_field(tgminer.fulltext.GROUP_BY_FIELDS[args.group_by]):
+        enc_print('Index has no "{}" field, run "tgminer-index migrate" to update it.'.format(
+            tgminer.fulltext.GROUP_BY_FIELDS[args.group_by]), file=sys.stderr)
+        exit(exits.EX_CONFIG)
 
-    schema = tgminer.fulltext.LogSchema()
+    args.ngram_fields = tgminer.backend.routed_ngram_fields(config, index)
 
-    query_parser = QueryParser('message', schema=schema)
+    if args.queries_file:
+        run_query_batch(config, index, args)
+        return
 
-    query = query_parser.parse(args.query)
+    query = tgminer.backend.parse_query(args.query, args.ngram_fields)
+
+    if args.count or args.group_by:
+        try:
+            with index:
+                total, groups = index.count(query, args.group_by, args.top, args.since, args.until)
+        except ValueError as e:
+            enc_print(str(e), file=sys.stderr)
+            exit(exits.EX_USAGE)
+            return
+
+        if groups is None:
+            enc_print(str(total))
+        else:
+            for value, count in groups:
+                enc_print(f'{count}\t{value if value else "None"}')
+        return
 
     def result_iter():
-        with fasteners.InterProcessLock(index_lock_path):
-            with index.searcher() as searcher:
-                yield from searcher.search(query,
-                                           limit=None if args.limit < 1 else args.limit,
-                                           sortedby='timestamp')
+        with index, tgminer.rawlog.RawLogReader(config.data_dir) as raw_logs:
+            try:
+                hits = index.search(query,
+                                    limit=None if args.limit < 1 else args.limit,
+                                    since=args.since,
+                                    until=args.until)
+
+                for fields in hits:
+                    # message text is only loaded for hits which are actually used
+                    if 'message' not in fields and 'message_ref' in fields:
+                        fields['message'] = raw_logs.read_message(fields['message_ref'])
+
+                    yield fields
+            except ValueError as e:
+                enc_print(str(e), file=sys.stderr)
+                exit(exits.EX_USAGE)
 
     if args.markov:
         split_by_spaces = re.compile('\s+')
 
-        chain = kovit.Chain()
-
         if args.markov_optimize == 'accuracy':
             word_iter = kovit.iters.iter_window
         else:
             word_iter = kovit.iters.iter_runs
 
+        if args.markov_group_by:
+            write_grouped_markov_chains(args, result_iter(), split_by_spaces, word_iter)
+            return
+
+        chain = kovit.Chain()
+        word_index = WordStateIndex()
+
         anything = False
         for hit in result_iter():
             message = hit.get('message', None)
@@ -163,51 +688,39 @@ def main():
                 anything = True
                 for start, next_items in word_iter(split_by_spaces.split(message), args.markov_state_size):
                     chain.add_to_bag(start, next_items)
+                    word_index.add(start)
 
         if not anything:
             enc_print('Query returned no messages!', file=sys.stderr)
             exit(exits.EX_SOFTWARE)
 
         try:
-            with open(args.markov, 'w', encoding='utf-8') as m_out:
-                chain.dump_json(m_out)
+            write_markov_chain(args.markov, chain, word_index)
         except OSError as e:
             enc_print(f'Could not write markov chain to file "{args.markov}", error: {e}',
                       file=sys.stderr)
             exit(exits.EX_CANTCREAT)
     else:
-        for hit in result_iter():
-
-            message = hit.get('message', None)
-
-            username = hit.get('username', None)
-            alias = hit.get('alias', 'NO_ALIAS')
-
-            to_username = hit.get('to_username', None)
-            to_alias = hit.get('to_alias', None)
-            to_id = hit.get('to_id')
-
-            username_part = f' [@{username}]' if username else ''
-
-            timestamp = config.timestamp_format.format(hit['timestamp'])
-
-            chat_slug = hit['chat']
-
-            media = hit.get('media', None)
-
-            to_username_part = f' [@{to_username}]' if to_username else ''
-
-            to_user_part = f' to {to_alias}{to_username_part}' if to_alias or to_username_part else ''
-
-            if media:
-                caption_part = f' Caption: {message}' if message else ''
-
-                enc_print(
-                    f'{timestamp} chat="{chat_slug}" to_id="{to_id}"{to_user_part} | {alias}{username_part}: {media}{caption_part}')
-            else:
-                enc_print(
-                    f'{timestamp} chat="{chat_slug}" to_id="{to_id}"{to_user_part} | {alias}{username_part}: {hit["message"]}')
-
+        with tgminer.rawlog.RawLogReader(config.data_dir) as raw_logs:
+            for hit in result_iter():
+                if args.context is None:
+                    enc_print(format_hit(config, hit))
+                    continue
+
+                entries = read_hit_context(raw_logs, hit, args.context)
+
+                if entries is None:
+                    enc_print(format_hit(config, hit))
+                else:
+                    for entry, is_hit in entries:
+                        if is_hit:
+                            enc_print(format_hit(config, hit))
+                        elif isinstance(entry, dict):
+                            enc_print(format_hit(config, entry))
+                        else:
+                            enc_print(entry)
+
+                enc_print('--')
 
 if __name__ == '__main__':
     main()
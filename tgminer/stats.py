@@ -0,0 +1,176 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import argparse
+import csv
+import io
+import json
+import os.path
+import sys
+from collections import Counter, OrderedDict
+
+import tgminer.backend
+import tgminer.config
+import tgminer.fulltext
+from tgminer import exits
+from tgminer.cio import enc_print
+
+TIME_BUCKET_FORMATS = OrderedDict([('hour', '%Y-%m-%d %H:00'),
+                                   ('day', '%Y-%m-%d'),
+                                   ('week', '%G-W%V'),
+                                   ('month', '%Y-%m'),
+                                   ('year', '%Y')])
+"""Maps --bucket choices to the strftime format used to label a time bucket."""
+
+
+def top_count(parser: argparse.ArgumentParser):
+    def test(value):
+        # noinspection PyBroadException
+        try:
+            value = int(value)
+        except Exception:
+            parser.error('Top row count must be an integer.')
+
+        if value < 0:
+            parser.error('Top row count cannot be less than 0.')
+        return value
+
+    return test
+
+
+def count_values(values, bucket: str = None) -> Counter:
+    """Count messages grouped by field values, see :py:meth:`tgminer.backend.IndexBackend.iter_values`.
+
+    :param values: Iterable of tuples of group values, with the **timestamp** last if **bucket** is given.
+    :param bucket: Time bucket, see :py:data:`TIME_BUCKET_FORMATS`, or None.
+    :return: Counter keyed by tuples of group values, with the bucket label last.
+    """
+    counts = Counter()
+
+    if bucket is None:
+        counts.update(values)
+        return counts
+
+    bucket_format = TIME_BUCKET_FORMATS[bucket]
+
+    for row in values:
+        counts[row[:-1] + (row[-1].strftime(bucket_format),)] += 1
+
+    return counts
+
+
+def count_rows(counts: Counter, group_by: list, bucket: str = None, top: int = 0) -> list:
+    columns = list(group_by) + (['bucket'] if bucket else [])
+
+    ordered = sorted(counts.items(), key=lambda item: (-item[1], tuple(str(v) for v in item[0])))
+
+    if top:
+        ordered = ordered[:top]
+
+    return [OrderedDict(list(zip(columns, key)) + [('count', count)]) for key, count in ordered]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Count stored telegram messages grouped by chat, user, media type and time.',
+        prog='tgminer-stats'
+    )
+
+    arg_parser.add_argument('--version', action='version', version='%(prog)s ' + tgminer.__version__)
+
+    arg_parser.add_argument('--config',
+                            help='Path to TGMiner config file, defaults to "CWD/config.json". '
+                                 'This will override the environmental variable '
+                                 'TGMINER_CONFIG if it was defined.')
+
+    arg_parser.add_argument('--group-by', nargs='+', default=[],
+                            choices=tuple(tgminer.fulltext.GROUP_BY_FIELDS.keys()),
+                            help='One or more fields to group message counts by.')
+
+    arg_parser.add_argument('--bucket', default=None, choices=tuple(TIME_BUCKET_FORMATS.keys()),
+                            help='Also group message counts by the time period they were logged in.')
+
+    arg_parser.add_argument('--query', default=None,
+                            help='Only count messages matching this tgminer-search query.')
+
+    arg_parser.add_argument('--top', default=0, type=top_count(arg_parser),
+                            help='Only output the N largest counts, 0 for all. Default is 0.')
+
+    arg_parser.add_argument('--format', default='json', choices=('json', 'csv'),
+                            help='Output format, default is json.')
+
+    args = arg_parser.parse_args()
+
+    config = None  # hush intellij highlighted undeclared variable use warning
+
+    config_path = tgminer.config.get_config_path(args.config)
+
+    if os.path.isfile(config_path):
+        try:
+            config = tgminer.config.TGMinerConfig(config_path)
+        except tgminer.config.TGMinerConfigException as e:
+            enc_print(str(e), file=sys.stderr)
+            exit(exits.EX_CONFIG)
+    else:
+        enc_print(f'Cannot find tgminer config file: "{config_path}"')
+        exit(exits.EX_NOINPUT)
+
+    if not tgminer.backend.index_exists(config):
+        enc_print(f'No "{config.index_backend}" index exists in "{config.data_dir}".', file=sys.stderr)
+        exit(exits.EX_NOINPUT)
+
+    index = tgminer.backend.open_index(config)
+
+    query = tgminer.backend.parse_query(
+        args.query, tgminer.backend.routed_ngram_fields(config, index)) if args.query else None
+
+    names = [tgminer.fulltext.GROUP_BY_FIELDS[name] for name in args.group_by]
+    if args.bucket:
+        names.append('timestamp')
+
+    stored = [name for name in names if not index.has_column(name)]
+    if stored:
+        enc_print('Index has no column storage for: {}, reading stored fields instead which is slow. '
+                  'Run "tgminer-index migrate" to add column storage.'.format(', '.join(stored)),
+                  file=sys.stderr)
+
+    try:
+        with index, index.session():
+            counts = count_values(index.iter_values(query, names), args.bucket)
+    except ValueError as e:
+        enc_print(str(e), file=sys.stderr)
+        exit(exits.EX_USAGE)
+        return
+
+    rows = count_rows(counts, args.group_by, args.bucket, args.top)
+
+    if args.format == 'json':
+        enc_print(json.dumps(rows, indent=4, sort_keys=False))
+    else:
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=list(args.group_by) +
+                                                (['bucket'] if args.bucket else []) + ['count'])
+        writer.writeheader()
+        writer.writerows(rows)
+        enc_print(out.getvalue(), end='')
+
+
+if __name__ == '__main__':
+    main()
@@ -20,74 +20,334 @@
 
 import argparse
 import datetime
-import errno
+import functools
 import json
 import mimetypes
 import pyrogram.api.types
 import os
+import signal
 import sys
 import threading
+import time
 import traceback
-import uuid
 from collections import OrderedDict
 
-import fasteners
 import pyrogram
 import pyrogram.session
-import whoosh.index
 from pyrogram.api import functions as api_functions
 from pyrogram.client.types import messages_and_media
 from pyrogram.client.types import user_and_chats
 from slugify import slugify
 
+import tgminer.backend
+import tgminer.capture
+import tgminer.cio
 import tgminer.config
+import tgminer.directory
+import tgminer.extract
+import tgminer.flood
 import tgminer.fulltext
+import tgminer.journal
+import tgminer.media
+import tgminer.pipeline
+import tgminer.profiling
+import tgminer.rawlog
 from tgminer import exits
 from tgminer.cio import enc_print
 
+_DOWNLOAD_POLL_INTERVAL = 0.5
+
 # silence pyrogram message on start
 pyrogram.session.Session.notice_displayed = True
 
 
-class TGMinerClient:
-    INDEX_DIR_NAME = 'indexdir'
-    INTERPROCESS_MUTEX = 'tgminer_mutex'
-    DIRECT_CHATS_SLUG = 'direct_chats'
-    CHANNELS_DIR_NAME = 'channels'
+def control_socket_path(config: tgminer.config.TGMinerConfig):
+    """Get the path of the control socket, relative paths are relative to the data directory.
+
+    :param config: The config.
+    :return: Socket path, or None if the control socket is disabled.
+    """
+    if not config.profiling.control_socket:
+        return None
+    return os.path.join(config.data_dir, config.profiling.control_socket)
+
+
+class _IngestItem:
+    """A message passing through the stages of the ingest pipeline."""
+
+    def __init__(self, message, user, to_user, to_id, chat_slug, log_folder, log_path, log_user_name, key, config,
+                 account, client):
+        self.message = message
+        self.config = config
+        self.account = account
+        self.client = client
+        self.user = user
+        self.to_user = to_user
+        self.to_id = to_id
+        self.chat_slug = chat_slug
+        self.log_folder = log_folder
+        self.log_path = log_path
+        self.log_user_name = log_user_name
+        self.key = key
+
+        self.media_info = None
+        self.text = None
+        self.log_entry = None
+        self.raw_log_entry = None
+        self.message_ref = None
+        self.document = None
+        self.document_path = None
+        self.trace = None
+
+        # repeat count from the flood filter, and whether the document was added to the index
+        self.repeats = 0
+        self.indexed = False
+
+
+class _DocumentText:
+    """The downloaded document of an indexed message, on its way to the text extraction stage."""
+
+    def __init__(self, item: _IngestItem):
+        self.item = item
+
+
+class _DownloadWatcher:
+    """Hands documents to a stage once their non-blocking download has finished.
+
+    Every download is polled from one thread, so a stalled download only holds a place in the
+    watch list until its deadline, and never a worker of the stage.  Added to a
+    :py:class:`tgminer.pipeline.Pipeline` like a stage, after the stages which watch downloads.
+    """
+
+    def __init__(self, stage: tgminer.pipeline.Stage, size: int, on_dropped):
+        """
+        :param stage: Stage finished downloads are put on.
+        :param size: Maximum number of downloads watched at once, 0 for no limit.
+        :param on_dropped: Called with a job which could not be watched because the list is full.
+        """
+        self._stage = stage
+        self._size = size
+        self._on_dropped = on_dropped
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+        # [job, path, expected size, deadline, last size seen]
+        self._watched = []
+
+        self._thread = threading.Thread(target=self._work, name='DownloadWatcher', daemon=True)
+
+    def watch(self, job, path: str, size: int, timeout: int):
+        """Put a job on the stage once a file is downloaded.
+
+        :param job: Item for the stage.
+        :param path: Downloaded file path.
+        :param size: Expected file size, None or 0 if unknown.
+        :param timeout: Seconds to wait for the download, 0 to wait until tgminer stops.
+        """
+        with self._lock:
+            if not self._size or len(self._watched) < self._size:
+                self._watched.append([job, path, size, time.monotonic() + timeout if timeout else None, None])
+                return
+
+        self._on_dropped(job)
+
+    def _poll(self):
+        now = time.monotonic()
 
-    def __init__(self, config: tgminer.config.TGMinerConfig):
+        with self._lock:
+            watched = []
+
+            for entry in self._watched:
+                job, path, size, deadline, last_size = entry
+                current_size = os.path.getsize(path) if os.path.isfile(path) else None
+
+                # pyrogram moves finished downloads into place, possibly copying them across file systems
+                if current_size is not None and (current_size == size if size else current_size == last_size):
+                    # kept while the stage is full, and tried again on the next poll
+                    if not self._stage.try_put(job):
+                        watched.append(entry)
+                elif deadline is None or now <= deadline:
+                    entry[4] = current_size
+                    watched.append(entry)
+
+            self._watched = watched
+
+    def _work(self):
+        while not self._stop.wait(_DOWNLOAD_POLL_INTERVAL):
+            self._poll()
+
+    def start(self):
+        self._thread.start()
 
-        session_path_dir = os.path.dirname(config.session_path)
+    def close(self):
+        """Stop watching, once finished downloads are handed to the stage."""
+        self._stop.set()
+        self._thread.join()
+        self._poll()
+
+
+class _RepeatCount:
+    """The repeat count of an ingested message, on its way to the index stage."""
+
+    def __init__(self, item: _IngestItem, repeats: int):
+        self.item = item
+        self.repeats = repeats
+
+
+class TGMinerClient:
+    INDEX_DIR_NAME = tgminer.backend.INDEX_DIR_NAME
+    INTERPROCESS_MUTEX = tgminer.backend.INTERPROCESS_MUTEX
+    DIRECT_CHATS_SLUG = tgminer.rawlog.DIRECT_CHATS_DIR_NAME
+    CHANNELS_DIR_NAME = tgminer.rawlog.CHANNELS_DIR_NAME
+
+    def __init__(self, config: tgminer.config.TGMinerConfig, mine: bool = True, clients: dict = None):
+        """
+        :param config: The config.
+        :param mine: Receive and store messages.  False for a client which only looks up chats
+                     and peers, which leaves the index, raw logs and journal alone.
+        :param clients: Maps account names to objects used in place of their pyrogram clients,
+                        which are then not created.  Updates for these accounts are passed to
+                        :py:meth:`receive_update` by the caller, see :py:mod:`tgminer.replay`.
+        """
 
         self._config = config
+        self._mining = mine
 
-        if session_path_dir:
-            os.makedirs(session_path_dir, exist_ok=True)
+        self._reload_lock = threading.RLock()
+        self._config_mtime = self._get_config_mtime()
+        self._stop_watching = threading.Event()
 
         pyrogram.Client.UPDATES_WORKERS = config.updates_workers
         pyrogram.Client.DOWNLOAD_WORKERS = config.download_workers
 
-        self._client = pyrogram.Client(config.session_path,
-                                       api_id=config.api_key.id,
-                                       api_hash=config.api_key.hash)
+        # (account name, client), every account feeds the same pipeline, index and raw logs
+        self._clients = []
+
+        for account in config.accounts:
+            if clients is not None:
+                self._clients.append((account['name'], clients[account['name']]))
+                continue
+
+            session_path_dir = os.path.dirname(account['session_path'])
+
+            if session_path_dir:
+                os.makedirs(session_path_dir, exist_ok=True)
+
+            client = pyrogram.Client(account['session_path'],
+                                     api_id=account['api_key']['id'],
+                                     api_hash=account['api_key']['hash'])
+
+            if mine:
+                client.add_handler(pyrogram.RawUpdateHandler(
+                    functools.partial(self.receive_update, account['name'])))
+
+            self._clients.append((account['name'], client))
 
-        self._client.add_handler(pyrogram.RawUpdateHandler(self._update_handler))
+        # the first account keeps the message keys and direct chat logs used before accounts existed
+        self._primary_account, self._client = self._clients[0]
 
         os.makedirs(config.data_dir, exist_ok=True)
 
-        self._indexdir = os.path.join(config.data_dir, TGMinerClient.INDEX_DIR_NAME)
+        self._directory = tgminer.directory.ChatDirectory(
+            os.path.join(config.data_dir, tgminer.directory.DIRECTORY_FILE_NAME), config.directory_ttl)
 
-        # interprocess lock only
-        self._index_lock_path = os.path.join(config.data_dir, TGMinerClient.INTERPROCESS_MUTEX)
+        if not mine:
+            return
 
-        self._index_lock = threading.Lock()
+        self._raw_log = tgminer.rawlog.RawLogWriter(config.data_dir, config.raw_log_rotation)
 
-        try:
-            os.makedirs(self._indexdir)
-            self._index = whoosh.index.create_in(self._indexdir, tgminer.fulltext.LogSchema)
-        except OSError as e:
-            if e.errno == errno.EEXIST:
-                self._index = whoosh.index.open_dir(self._indexdir)
+        self._journal = None
+
+        self._index = tgminer.backend.open_index(config, create=True)
+
+        if config.index_journal:
+            self._journal, replayed = tgminer.journal.open_journal(config.data_dir, self._index)
+            if replayed:
+                enc_print(f'Recovered {replayed} message(s) from the index journal.', file=sys.stderr)
+
+        # keys of messages in the pipeline, which are not indexed yet
+        self._in_flight = set()
+        self._in_flight_lock = threading.Lock()
+
+        self._offload_message = config.index_message_storage == tgminer.config.MESSAGE_STORAGE_RAW_LOG
+
+        stages = config.pipeline
+
+        self._profiler = tgminer.profiling.Profiler(config.data_dir, config.profiling.sample_interval_ms)
+
+        self._slow_messages = tgminer.profiling.SlowMessageLog(
+            os.path.join(config.data_dir, tgminer.profiling.SLOW_MESSAGE_LOG_NAME),
+            config.profiling.slow_message_ms)
+
+        self._control_server = None
+
+        # chat_stdout can be turned on by a reload, so the sink always exists
+        self._console = tgminer.cio.ConsoleSink(config.chat_stdout_buffer)
+
+        self._extract_dropped = 0
+        self._extract_dropped_lock = threading.Lock()
+
+        self._capture = None
+
+        if config.update_capture.enabled:
+            self._capture = tgminer.capture.UpdateCaptureWriter(tgminer.capture.capture_path(config))
+
+        self._flood_filter = None
+
+        # orders repeat counts with the index write of the first copy
+        self._repeats_lock = threading.Lock()
+
+        if config.flood_filter.enabled:
+            self._flood_filter = tgminer.flood.FloodFilter(config.flood_filter.window_seconds,
+                                                           config.flood_filter.window_size,
+                                                           config.flood_filter.similarity,
+                                                           config.flood_filter.shingle_size,
+                                                           config.flood_filter.min_length,
+                                                           self._queue_repeat_count)
+
+        self._pipeline = tgminer.pipeline.Pipeline()
+
+        self._dispatch_stage = tgminer.pipeline.Stage(
+            'Dispatch', self._dispatch_message, stages.dispatch_workers, stages.queue_size,
+            self._profiler, self._slow_messages.finished)
+
+        self._index_stage = tgminer.pipeline.Stage(
+            'Index', self._index_message, stages.index_workers, stages.queue_size,
+            self._profiler, self._slow_messages.finished)
+
+        self._raw_log_stage = tgminer.pipeline.Stage(
+            'RawLog', self._write_raw_log, stages.raw_log_workers, stages.queue_size,
+            self._profiler, self._slow_messages.finished)
+
+        # untraced, downloads and extraction happen after the message has left the other stages
+        self._extract_stage = tgminer.pipeline.Stage(
+            'Extract', self._extract_document_text, config.document_text.workers, config.document_text.queue_size,
+            self._profiler)
+
+        self._download_watcher = _DownloadWatcher(self._extract_stage, config.document_text.queue_size,
+                                                  self._drop_document_text)
+
+        self._console_stage = tgminer.pipeline.Stage(
+            'Console', self._print_message, stages.console_workers, stages.queue_size,
+            self._profiler, self._slow_messages.finished)
+
+        # stages are closed in this order, which must follow the order messages pass through them
+        self._pipeline.add(self._dispatch_stage)
+
+        if self._offload_message:
+            # the index can only reference the message once it is in the raw log
+            self._pipeline.add(self._raw_log_stage)
+            self._pipeline.add(self._index_stage)
+        else:
+            self._pipeline.add(self._index_stage)
+            self._pipeline.add(self._raw_log_stage)
+
+        self._pipeline.add(self._download_watcher)
+        self._pipeline.add(self._extract_stage)
+        self._pipeline.add(self._console_stage)
+
+        self._pipeline.start()
 
     @staticmethod
     def _guess_extension(mime_type):
@@ -137,6 +397,14 @@ class TGMinerClient:
 
         return '.none'
 
+    @staticmethod
+    def _get_media_type(message: messages_and_media.Message):
+        for media_type in ('document', 'photo', 'sticker', 'animation',
+                           'video', 'video_note', 'voice', 'audio'):
+            if getattr(message, media_type, None):
+                return media_type
+        return None
+
     @staticmethod
     def _get_user_alias(user: user_and_chats.user.User):
         if user.first_name:
@@ -162,43 +430,68 @@ class TGMinerClient:
         else:
             return 'None'
 
-    def _index_log_message(self,
-                           from_user: user_and_chats.user.User,
-                           to_user: user_and_chats.user.User,
-                           to_id: int,
-                           media_info: str,
-                           message_text: str,
-                           chat_slug: str):
-
-        with self._index_lock, fasteners.InterProcessLock(self._index_lock_path):
-
-            writer = self._index.writer()
-
-            username = from_user.username
-
-            alias = self._get_user_alias(from_user)
-
-            if to_user:
-                to_username = to_user.username
-                to_alias = self._get_user_alias(to_user)
-            else:
-                to_username = None
-                to_alias = None
+    def _is_message_indexed(self, key: str) -> bool:
+        return self._index.contains(key)
+
+    def _build_document(self,
+                        from_user: user_and_chats.user.User,
+                        to_user: user_and_chats.user.User,
+                        to_id: int,
+                        message_id: int,
+                        message_date: int,
+                        media_type: str,
+                        media_info: str,
+                        message_text: str,
+                        message_ref: str,
+                        chat_slug: str,
+                        key: str,
+                        account: str,
+                        ngram_fields: list) -> dict:
+
+        username = from_user.username
+
+        alias = self._get_user_alias(from_user)
+
+        if to_user:
+            to_username = to_user.username
+            to_alias = self._get_user_alias(to_user)
+        else:
+            to_username = None
+            to_alias = None
+
+        fields = dict(username=username, alias=alias,
+                      to_username=to_username, to_alias=to_alias,
+                      media=media_info, media_type=media_type, message=message_text,
+                      timestamp=datetime.datetime.now(),
+                      date=datetime.datetime.fromtimestamp(message_date) if message_date else None,
+                      chat=chat_slug, to_id=str(to_id),
+                      chat_id=to_id, from_id=from_user.id,
+                      message_id=message_id, message_key=key, account=account,
+                      ngram_fields=' '.join(ngram_fields) or None)
+
+        if message_ref:
+            # index the text, but only store where to find it in the raw log
+            fields.update(_stored_message=None, message_ref=message_ref)
+
+        return tgminer.fulltext.fill_sortable_fields(fields)
+
+    def _index_document(self, fields: dict):
+        """Add a document unless its message is already indexed.
+
+        :return: True if added, False if it was a duplicate, None if writing the index failed.
+        """
+        try:
+            return self._index.add(fields)
+        except Exception:
+            traceback.print_exc()
+            return None
 
-            try:
-                writer.add_document(username=username, alias=alias,
-                                    to_username=to_username, to_alias=to_alias,
-                                    media=media_info, message=message_text,
-                                    timestamp=datetime.datetime.now(),
-                                    chat=chat_slug, to_id=str(to_id))
-                writer.commit()
-            except Exception as e:
-                traceback.print_exc()
-
-    def _timestamp(self):
-        return self._config.timestamp_format.format(datetime.datetime.now())
+    @staticmethod
+    def _timestamp(config: tgminer.config.TGMinerConfig):
+        return config.timestamp_format.format(datetime.datetime.now())
 
     def _filter_group_chat_check(self,
+                                 config: tgminer.config.TGMinerConfig,
                                  title: str,
                                  chat_slug: str,
                                  chat_id: int,
@@ -206,13 +499,13 @@ class TGMinerClient:
                                  user_alias: str,
                                  user_id: int) -> bool:
 
-        filter_title = self._config.group_filters.title
-        filter_id = self._config.group_filters.id
-        filter_title_slug = self._config.group_filters.title_slug
+        filter_title = config.group_filters.title
+        filter_id = config.group_filters.id
+        filter_title_slug = config.group_filters.title_slug
 
-        filter_username = self._config.group_filters.username
-        filter_user_alias = self._config.group_filters.user_alias
-        filter_user_id = self._config.group_filters.user_id
+        filter_username = config.group_filters.username
+        filter_user_alias = config.group_filters.user_alias
+        filter_user_id = config.group_filters.user_id
 
         return not (filter_title.match(title) and
                     filter_id.match(str(chat_id)) and
@@ -222,63 +515,86 @@ class TGMinerClient:
                     filter_user_id.match(str(user_id)))
 
     def _filter_direct_chat_check(self,
+                                  config: tgminer.config.TGMinerConfig,
                                   username: str,
                                   alias: str,
                                   from_id: int) -> bool:
 
-        filter_username = self._config.direct_chat_filters.username
-        filter_alias = self._config.direct_chat_filters.alias
-        filter_id = self._config.direct_chat_filters.id
+        filter_username = config.direct_chat_filters.username
+        filter_alias = config.direct_chat_filters.alias
+        filter_id = config.direct_chat_filters.id
 
         return not (filter_username.match(username) and
                     filter_alias.match(alias) and
                     filter_id.match(str(from_id)))
 
     def _filter_users_check(self,
+                            config: tgminer.config.TGMinerConfig,
                             username: str,
                             alias: str,
                             from_id: int) -> bool:
 
-        filter_username = self._config.user_filters.username
-        filter_alias = self._config.user_filters.alias
-        filter_id = self._config.user_filters.id
+        filter_username = config.user_filters.username
+        filter_alias = config.user_filters.alias
+        filter_id = config.user_filters.id
 
         return not (filter_username.match(username) and
                     filter_alias.match(alias) and
                     filter_id.match(str(from_id)))
 
-    def _update_handler(self, client, update, users: dict, chats: dict):
+    def receive_update(self, account: str, client, update, users: dict, chats: dict):
+        """Handle an update, as the update threads of the pyrogram clients do.
+
+        :param account: Name of the account which received the update.
+        :param client: Client of the account, media is downloaded through it.
+        :param update: The update.
+        :param users: Users referenced by the update, by id.
+        :param chats: Chats referenced by the update, by id.
+        """
+        if self._capture is not None:
+            self._capture.write(account, update, users, chats)
+
+        self._profiler.call(self._update_handler, account, client, update, users, chats)
+
+    def _update_handler(self, account: str, client, update, users: dict, chats: dict):
+        received = time.perf_counter()
 
         if not isinstance(update, messages_and_media.Message):
             return
 
         update_message: messages_and_media.Message = update
 
+        # every stage handles the message with the config it was received under
+        config = self._config
+
         is_peer_user = update_message.chat.type == "private"
 
-        if is_peer_user and not self._config.log_direct_chats:
+        if is_peer_user and not config.log_direct_chats:
             return
 
         is_peer_channel = update_message.chat.type == "supergroup"
         is_peer_chat = update_message.chat.type == "group"
 
-        if (is_peer_channel or is_peer_chat) and not self._config.log_group_chats:
+        if (is_peer_channel or is_peer_chat) and not config.log_group_chats:
             return
 
         user: user_and_chats.user.User = update_message.from_user
 
+        self._directory.remember_user(user)
+
         user_name = user.username if user.username else ''
 
         user_alias = self._get_user_alias(user)
         log_user_name = self._get_log_username(user)
 
         chat_slug = TGMinerClient.DIRECT_CHATS_SLUG
-        log_folder = os.path.join(self._config.data_dir, TGMinerClient.DIRECT_CHATS_SLUG)
-        log_name = 'log.txt'
+        log_folder = os.path.join(config.data_dir, TGMinerClient.DIRECT_CHATS_SLUG)
+        log_extension = tgminer.rawlog.LOG_FORMAT_EXTENSIONS[config.raw_log_format]
+        log_name = 'log' + log_extension
 
         to_user = None
 
-        if self._config.log_update_threads:
+        if config.log_update_threads:
             print("Update thread: " + threading.current_thread().name)
             print("Other threads: " +
                   (',\n' + ' ' * 15).join(x.name for x in threading.enumerate() if x.name != 'MainThread'))
@@ -289,7 +605,8 @@ class TGMinerClient:
 
             chat_slug = slugify(channel.title)
 
-            if self._filter_group_chat_check(title=channel.title,
+            if self._filter_group_chat_check(config=config,
+                                             title=channel.title,
                                              chat_slug=chat_slug,
                                              chat_id=to_id,
                                              username=user_name,
@@ -297,84 +614,299 @@ class TGMinerClient:
                                              user_id=user.id):
                 return
 
-            log_folder = os.path.join(self._config.data_dir, TGMinerClient.CHANNELS_DIR_NAME,
+            log_folder = os.path.join(config.data_dir, TGMinerClient.CHANNELS_DIR_NAME,
                                       str(channel.id))
-            log_name = chat_slug + '.log.txt'
+            log_name = chat_slug + '.log' + log_extension
+
+            # basic group message ids are only unique within an account, like their keys
+            if is_peer_chat and account != self._primary_account:
+                log_folder = os.path.join(log_folder, account)
 
         elif is_peer_user:
             chat: user_and_chats.Chat = update_message.chat
 
-            to_user = users[chat.id]
+            # users missing from the update are resolved without asking telegram
+            to_user = users.get(chat.id, None) or self._directory.user(chat.id) or chat
             to_id = to_user.id
 
-            if self._filter_direct_chat_check(username=user_name,
+            if account != self._primary_account:
+                log_folder = os.path.join(log_folder, account)
+
+            if self._filter_direct_chat_check(config=config,
+                                              username=user_name,
                                               alias=user_alias,
                                               from_id=user.id):
                 return
         else:
             return
 
-        if self._filter_users_check(username=user_name,
+        if self._filter_users_check(config=config,
+                                    username=user_name,
                                     alias=user_alias,
                                     from_id=user.id):
             return
 
-        if (self._config.download_photos or
-                self._config.download_documents or
-                self._config.write_raw_logs):
-            os.makedirs(log_folder, exist_ok=True)
+        # supergroup and channel message ids are shared by every account, so a message
+        # seen by more than one account is only indexed once
+        key = tgminer.fulltext.message_key(
+            to_id, update_message.message_id,
+            None if is_peer_channel or account == self._primary_account else account)
+
+        # replayed or re-fetched message, skip it before any media is downloaded
+        with self._in_flight_lock:
+            if key in self._in_flight:
+                return
+            self._in_flight.add(key)
+
+        dispatched = False
+
+        try:
+            # checked once the key is in flight, a copy indexed before that is visible to the lookup,
+            # and the lookup is outside the lock so other update threads do not queue up behind it
+            if self._is_message_indexed(key):
+                return
+
+            item = _IngestItem(message=update_message,
+                               user=user,
+                               to_user=to_user,
+                               to_id=to_id,
+                               chat_slug=chat_slug,
+                               log_folder=log_folder,
+                               log_path=os.path.join(log_folder, log_name),
+                               log_user_name=log_user_name,
+                               key=key,
+                               config=config,
+                               account=account,
+                               client=client)
+
+            if self._flood_filter is not None and config.flood_filter.chat_id.match(str(to_id)):
+                text = update_message.text or update_message.caption
+
+                # only the first copy is indexed and logged, it records how many times it was repeated
+                if text and self._flood_filter.check(to_id, str(text), item):
+                    return
+
+            if self._slow_messages.threshold_ms:
+                item.trace = tgminer.profiling.MessageTrace(key, received)
+                item.trace.record('Receive', 0, time.perf_counter() - received)
+
+            self._dispatch_stage.put(item)
+            dispatched = True
+        finally:
+            # the pipeline releases the key of a dispatched message, anything else must not keep
+            # the message from being received again, including a failed lookup
+            if not dispatched:
+                with self._in_flight_lock:
+                    self._in_flight.discard(key)
+
+    def _release_message(self, item: _IngestItem):
+        with self._in_flight_lock:
+            self._in_flight.discard(item.key)
+
+    def _dispatch_message(self, item: _IngestItem):
+        try:
+            self._prepare_message(item)
+        except Exception:
+            self._release_message(item)
+            raise
+
+    def _prepare_message(self, item: _IngestItem):
+        update_message = item.message
+        config = item.config
 
-        indexed_media_info = None
-        indexed_message = None
+        if (config.download_photos or
+                config.download_documents or
+                config.write_raw_logs):
+            os.makedirs(item.log_folder, exist_ok=True)
 
         if update_message.media:
             result = self._handle_media_message(
-                log_folder,
-                log_user_name,
-                update_message)
-
-            if result is not None:
-                (indexed_media_info, indexed_message, short_log_entry) = result
-            else:
+                config,
+                item.client,
+                item.log_folder,
+                item.log_user_name,
+                update_message,
+                item)
+
+            if result is None:
+                self._release_message(item)
                 return
+
+            (item.media_info, item.text, short_log_entry) = result
         else:
-            if update_message.text:
-                indexed_message = str(update_message.text)
-            else:
+            if not update_message.text:
+                self._release_message(item)
                 return
 
-            short_log_entry = f'{log_user_name}: {indexed_message}'
+            item.text = str(update_message.text)
+
+            short_log_entry = f'{item.log_user_name}: {item.text}'
 
-        self._index_log_message(from_user=user,
-                                to_user=to_user,
-                                to_id=to_id,
-                                media_info=indexed_media_info,
-                                message_text=indexed_message,
-                                chat_slug=chat_slug)
+        to_user = item.to_user
 
-        log_entry = '{} chat="{}" to_id="{}"{} | {}'.format(
-            self._timestamp(), chat_slug, to_id,
+        item.log_entry = '{} chat="{}" to_id="{}"{} | {}'.format(
+            self._timestamp(config), item.chat_slug, item.to_id,
             f' to {self._get_log_username(to_user)}' if to_user else '',
             short_log_entry)
 
-        if self._config.chat_stdout:
-            enc_print(log_entry)
+        if config.raw_log_format == 'jsonl':
+            item.raw_log_entry = tgminer.rawlog.format_jsonl_entry(dict(
+                timestamp=datetime.datetime.now(),
+                date=update_message.date,
+                chat=item.chat_slug, chat_id=item.to_id, to_id=str(item.to_id),
+                message_id=update_message.message_id,
+                from_id=item.user.id, username=item.user.username, alias=self._get_user_alias(item.user),
+                to_username=to_user.username if to_user else None,
+                to_alias=self._get_user_alias(to_user) if to_user else None,
+                media_type=self._get_media_type(update_message),
+                media=item.media_info,
+                message=item.text,
+                account=item.account))
+        else:
+            item.raw_log_entry = item.log_entry
+
+        if self._offload_message:
+            self._raw_log_stage.put(item)
+        else:
+            self._queue_document(item)
+
+    def _queue_document(self, item: _IngestItem):
+        item.document = self._build_document(from_user=item.user,
+                                             to_user=item.to_user,
+                                             to_id=item.to_id,
+                                             message_id=item.message.message_id,
+                                             message_date=item.message.date,
+                                             media_type=self._get_media_type(item.message),
+                                             media_info=item.media_info,
+                                             message_text=item.text,
+                                             message_ref=item.message_ref,
+                                             chat_slug=item.chat_slug,
+                                             key=item.key,
+                                             account=item.account,
+                                             ngram_fields=item.config.ngram_fields)
+
+        if self._journal is not None:
+            # the document survives a crash from here on, until it is committed
+            self._journal.append(item.document)
+
+        self._index_stage.put(item)
+
+    def _write_raw_log(self, item: _IngestItem):
+        try:
+            message_ref = self._raw_log.append(item.log_path, item.raw_log_entry,
+                                               item.text if self._offload_message else None,
+                                               message_id=item.message.message_id,
+                                               date=item.message.date)
+        except Exception:
+            if self._offload_message:
+                self._release_message(item)
+            raise
+
+        if self._offload_message:
+            item.message_ref = message_ref
+            self._queue_document(item)
+
+    def _queue_repeat_count(self, item: _IngestItem, repeats: int):
+        with self._repeats_lock:
+            item.repeats = repeats
+
+            # not in the index yet, the count is added with the document by _index_message
+            if not item.indexed:
+                return
+
+        self._index_stage.put(_RepeatCount(item, repeats))
+
+    def _index_repeat_count(self, repeat_count: _RepeatCount):
+        # later rewrites of the whole document, such as by document text extraction, keep the count
+        repeat_count.item.document['repeats'] = repeat_count.repeats
+
+        self._index.set_repeats(repeat_count.item.document, repeat_count.repeats)
+
+    def _index_message(self, item: _IngestItem):
+        if isinstance(item, _RepeatCount):
+            self._index_repeat_count(item)
+            return
+
+        with self._repeats_lock:
+            if item.repeats:
+                item.document['repeats'] = item.repeats
+
+        try:
+            indexed = self._index_document(item.document)
+        finally:
+            self._release_message(item)
+
+        with self._repeats_lock:
+            item.indexed = bool(indexed)
+            # a count which arrived while the document was being added
+            repeats = item.repeats if indexed and item.repeats != item.document.get('repeats', 0) else 0
+
+        if repeats:
+            self._index_repeat_count(_RepeatCount(item, repeats))
+
+        # failed documents stay in the journal and are replayed on the next start
+        if self._journal is not None:
+            if indexed is None:
+                self._journal.failed(item.document)
+            else:
+                self._journal.done()
+
+        if not indexed:
+            return
+
+        config = item.config
+
+        # the index stage must not wait for downloads or slow extraction, documents are skipped while
+        # too many are waiting
+        if item.document_path is not None:
+            self._download_watcher.watch(_DocumentText(item), item.document_path, item.message.document.file_size,
+                                         config.document_text.download_timeout_seconds)
+
+        if config.chat_stdout:
+            self._console_stage.put(item)
+
+        if config.write_raw_logs and not self._offload_message:
+            self._raw_log_stage.put(item)
+
+    def _print_message(self, item: _IngestItem):
+        self._console.write(item.log_entry)
+
+    def _drop_document_text(self, job: _DocumentText):
+        with self._extract_dropped_lock:
+            self._extract_dropped += 1
 
-        if self._config.write_raw_logs:
-            with open(os.path.join(log_folder, log_name), 'a', encoding='utf-8') as file_handle:
-                print(log_entry, file=file_handle)
+    def _extract_document_text(self, job: _DocumentText):
+        item = job.item
+        config = item.config.document_text
+        doc: messages_and_media.Document = item.message.document
+
+        try:
+            text = tgminer.extract.extract_text(item.document_path, doc.mime_type,
+                                                config.max_chars, config.timeout_seconds)
+        except tgminer.extract.ExtractionError as e:
+            enc_print(str(e), file=sys.stderr)
+            return
+
+        if not text.strip():
+            return
+
+        item.document['document_text'] = text
+
+        self._index.set_document_text(item.document, text)
 
     def _handle_photo_message(self,
+                              config: tgminer.config.TGMinerConfig,
+                              client: pyrogram.Client,
                               log_folder: str,
                               log_user_name: str,
                               update_message: messages_and_media.Message):
 
-        if self._config.download_photos:
+        if config.download_photos:
 
             media_file_path = os.path.abspath(
-                os.path.join(log_folder, str(uuid.uuid4())) + self._get_media_ext(update_message))
+                self._new_media_path(config, log_folder, update_message) + self._get_media_ext(update_message))
 
-            self._client.download_media(update_message, file_name=media_file_path, block=False)
+            client.download_media(update_message, file_name=media_file_path, block=False)
 
             indexed_media_info = f'(Photo: {media_file_path})'
         else:
@@ -387,13 +919,48 @@ class TGMinerClient:
 
         return indexed_media_info, indexed_message, log_entry
 
+    @staticmethod
+    def _new_media_path(config: tgminer.config.TGMinerConfig,
+                        log_folder: str,
+                        update_message: messages_and_media.Message) -> str:
+        date = datetime.datetime.fromtimestamp(update_message.date) if update_message.date else None
+        return tgminer.media.new_media_path(config.media_layout, log_folder, date)
+
+    @staticmethod
+    def _download_or_thumbnail(client: pyrogram.Client,
+                               update_message: messages_and_media.Message,
+                               media,
+                               file_path: str,
+                               size_limit: int) -> str:
+        """Download the media of a message, or only its thumbnail if the media is larger than **size_limit**.
+
+        :param media: The video, animation or document of the message.
+        :param size_limit: Size limit in bytes, 0 for no limit.
+        :return: Path shown in the media info, with the original size when only the thumbnail is downloaded.
+        """
+        if not size_limit or not media.file_size or media.file_size <= size_limit:
+            client.download_media(update_message, file_name=file_path, block=False)
+            return file_path
+
+        if media.thumb is None:
+            return f'OVER SIZE LIMIT ({media.file_size} BYTES), NO THUMBNAIL'
+
+        thumb_path = os.path.splitext(file_path)[0] + '.thumb.jpg'
+
+        client.download_media(media.thumb, file_name=thumb_path, block=False)
+
+        return f'OVER SIZE LIMIT ({media.file_size} BYTES), THUMBNAIL: {thumb_path}'
+
     def _handle_document_message(self,
+                                 config: tgminer.config.TGMinerConfig,
+                                 client: pyrogram.Client,
                                  log_folder: str,
                                  log_user_name: str,
-                                 update_message: messages_and_media.Message):
+                                 update_message: messages_and_media.Message,
+                                 item: _IngestItem):
 
         doc_file_path = os.path.abspath(
-            os.path.join(log_folder, str(uuid.uuid4())) + self._get_media_ext(update_message))
+            self._new_media_path(config, log_folder, update_message) + self._get_media_ext(update_message))
 
         indexed_message = str(update_message.caption) if update_message.caption else None
 
@@ -403,9 +970,17 @@ class TGMinerClient:
 
         displayed_path = doc_file_path
 
-        if self._config.download_documents and (not og_file_name or self._config.docname_filter.match(og_file_name)):
-            self._client.download_media(update_message, file_name=doc_file_path, block=False)
-        elif not self._config.download_documents:
+        if config.download_documents and (not og_file_name or config.docname_filter.match(og_file_name)):
+            displayed_path = self._download_or_thumbnail(client, update_message, doc, doc_file_path,
+                                                         config.download_size_limits.documents)
+
+            text_config = config.document_text
+
+            if (text_config.enabled and displayed_path == doc_file_path and
+                    tgminer.extract.can_extract(doc.mime_type) and
+                    (not text_config.max_bytes or (doc.file_size or 0) <= text_config.max_bytes)):
+                item.document_path = doc_file_path
+        elif not config.download_documents:
             displayed_path = "DOCUMENT DOWNLOADS DISABLED"
         else:
             displayed_path = "DOCNAME_FILTER DISCARDED FILE"
@@ -421,6 +996,8 @@ class TGMinerClient:
         return indexed_media_info, indexed_message, log_entry
 
     def _handle_animation_message(self,
+                                  config: tgminer.config.TGMinerConfig,
+                                  client: pyrogram.Client,
                                   log_folder: str,
                                   log_user_name: str,
                                   update_message: messages_and_media.Message):
@@ -428,7 +1005,7 @@ class TGMinerClient:
         anim: messages_and_media.Animation = update_message.animation
 
         anim_file_path = os.path.abspath(
-            os.path.join(log_folder, str(uuid.uuid4())) + self._get_media_ext(update_message))
+            self._new_media_path(config, log_folder, update_message) + self._get_media_ext(update_message))
 
         og_file_name = anim.file_name if anim.file_name else ''
 
@@ -436,8 +1013,9 @@ class TGMinerClient:
 
         indexed_message = str(update_message.caption) if update_message.caption else None
 
-        if self._config.download_animations:
-            self._client.download_media(update_message, file_name=anim_file_path, block=False)
+        if config.download_animations:
+            displayed_path = self._download_or_thumbnail(client, update_message, anim, anim_file_path,
+                                                         config.download_size_limits.animations)
         else:
             displayed_path = "ANIMATION DOWNLOADS DISABLED"
 
@@ -452,6 +1030,8 @@ class TGMinerClient:
         return indexed_media_info, indexed_message, log_entry
 
     def _handle_video_message(self,
+                              config: tgminer.config.TGMinerConfig,
+                              client: pyrogram.Client,
                               log_folder: str,
                               log_user_name: str,
                               update_message: messages_and_media.Message):
@@ -459,7 +1039,7 @@ class TGMinerClient:
         video: messages_and_media.Video = update_message.video
 
         video_file_path = os.path.abspath(
-            os.path.join(log_folder, str(uuid.uuid4())) + self._get_media_ext(update_message))
+            self._new_media_path(config, log_folder, update_message) + self._get_media_ext(update_message))
 
         og_file_name = video.file_name if video.file_name else ''
 
@@ -467,8 +1047,9 @@ class TGMinerClient:
 
         indexed_message = str(update_message.caption) if update_message.caption else None
 
-        if self._config.download_videos:
-            self._client.download_media(update_message, file_name=video_file_path, block=False)
+        if config.download_videos:
+            displayed_path = self._download_or_thumbnail(client, update_message, video, video_file_path,
+                                                         config.download_size_limits.videos)
         else:
             displayed_path = "VIDEO DOWNLOADS DISABLED"
 
@@ -483,6 +1064,8 @@ class TGMinerClient:
         return indexed_media_info, indexed_message, log_entry
 
     def _handle_video_note_message(self,
+                              config: tgminer.config.TGMinerConfig,
+                              client: pyrogram.Client,
                               log_folder: str,
                               log_user_name: str,
                               update_message: messages_and_media.Message):
@@ -490,14 +1073,14 @@ class TGMinerClient:
         video_note: messages_and_media.VideoNote = update_message.video_note
 
         video_file_path = os.path.abspath(
-            os.path.join(log_folder, str(uuid.uuid4())) + self._get_media_ext(update_message))
+            self._new_media_path(config, log_folder, update_message) + self._get_media_ext(update_message))
 
         displayed_path = video_file_path
 
         indexed_message = str(update_message.caption) if update_message.caption else None
 
-        if self._config.download_video_notes:
-            self._client.download_media(update_message, file_name=video_file_path, block=False)
+        if config.download_video_notes:
+            client.download_media(update_message, file_name=video_file_path, block=False)
         else:
             displayed_path = "VIDEO NOTE DOWNLOADS DISABLED"
 
@@ -511,6 +1094,8 @@ class TGMinerClient:
         return indexed_media_info, indexed_message, log_entry
 
     def _handle_sticker_message(self,
+                                   config: tgminer.config.TGMinerConfig,
+                                   client: pyrogram.Client,
                                    log_folder: str,
                                    log_user_name: str,
                                    update_message: messages_and_media.Message):
@@ -518,7 +1103,7 @@ class TGMinerClient:
         sticker: messages_and_media.Sticker = update_message.sticker
 
         sticker_file_path = os.path.abspath(
-            os.path.join(log_folder, str(uuid.uuid4())) + self._get_media_ext(update_message))
+            self._new_media_path(config, log_folder, update_message) + self._get_media_ext(update_message))
 
         og_file_name = sticker.file_name if sticker.file_name else ''
 
@@ -526,8 +1111,8 @@ class TGMinerClient:
 
         indexed_message = str(update_message.caption) if update_message.caption else None
 
-        if self._config.download_stickers:
-            self._client.download_media(update_message, file_name=sticker_file_path, block=False)
+        if config.download_stickers:
+            client.download_media(update_message, file_name=sticker_file_path, block=False)
         else:
             displayed_path = "STICKER DOWNLOADS DISABLED"
 
@@ -542,6 +1127,8 @@ class TGMinerClient:
         return indexed_media_info, indexed_message, log_entry
 
     def _handle_voice_message(self,
+                              config: tgminer.config.TGMinerConfig,
+                              client: pyrogram.Client,
                               log_folder: str,
                               log_user_name: str,
                               update_message: messages_and_media.Message):
@@ -551,14 +1138,14 @@ class TGMinerClient:
         ext = self._get_media_ext(update_message)
 
         voice_file_path = os.path.abspath(
-            os.path.join(log_folder, str(uuid.uuid4())) + ext)
+            self._new_media_path(config, log_folder, update_message) + ext)
 
         displayed_path = voice_file_path
 
         indexed_message = str(update_message.caption) if update_message.caption else None
 
-        if self._config.download_voice:
-            self._client.download_media(update_message, file_name=voice_file_path, block=False)
+        if config.download_voice:
+            client.download_media(update_message, file_name=voice_file_path, block=False)
         else:
             displayed_path = "VOICE DOWNLOADS DISABLED"
 
@@ -572,6 +1159,8 @@ class TGMinerClient:
         return indexed_media_info, indexed_message, log_entry
 
     def _handle_audio_message(self,
+                              config: tgminer.config.TGMinerConfig,
+                              client: pyrogram.Client,
                               log_folder: str,
                               log_user_name: str,
                               update_message: messages_and_media.Message):
@@ -579,7 +1168,7 @@ class TGMinerClient:
         audio: messages_and_media.Audio = update_message.audio
 
         audio_file_path = os.path.abspath(
-            os.path.join(log_folder, str(uuid.uuid4())) + self._get_media_ext(update_message))
+            self._new_media_path(config, log_folder, update_message) + self._get_media_ext(update_message))
 
         og_file_name = audio.file_name if audio.file_name else ''
 
@@ -587,8 +1176,8 @@ class TGMinerClient:
 
         indexed_message = str(update_message.caption) if update_message.caption else None
 
-        if self._config.download_audio:
-            self._client.download_media(update_message, file_name=audio_file_path, block=False)
+        if config.download_audio:
+            client.download_media(update_message, file_name=audio_file_path, block=False)
         else:
             displayed_path = "AUDIO DOWNLOADS DISABLED"
 
@@ -603,56 +1192,98 @@ class TGMinerClient:
         return indexed_media_info, indexed_message, log_entry
 
     def _handle_media_message(self,
+                              config: tgminer.config.TGMinerConfig,
+                              client: pyrogram.Client,
                               log_folder: str,
                               log_user_name: str,
-                              update_message: messages_and_media.Message):
+                              update_message: messages_and_media.Message,
+                              item: _IngestItem):
 
         if update_message.document:
-            return self._handle_document_message(log_folder, log_user_name, update_message)
+            return self._handle_document_message(config, client, log_folder, log_user_name, update_message, item)
         elif update_message.photo:
-            return self._handle_photo_message(log_folder, log_user_name, update_message)
+            return self._handle_photo_message(config, client, log_folder, log_user_name, update_message)
         elif update_message.sticker:
-            return self._handle_sticker_message(log_folder, log_user_name, update_message)
+            return self._handle_sticker_message(config, client, log_folder, log_user_name, update_message)
         elif update_message.animation:
-            return self._handle_animation_message(log_folder, log_user_name, update_message)
+            return self._handle_animation_message(config, client, log_folder, log_user_name, update_message)
         elif update_message.video:
-            return self._handle_video_message(log_folder, log_user_name, update_message)
+            return self._handle_video_message(config, client, log_folder, log_user_name, update_message)
         elif update_message.video_note:
-            return self._handle_video_note_message(log_folder, log_user_name, update_message)
+            return self._handle_video_note_message(config, client, log_folder, log_user_name, update_message)
         elif update_message.voice:
-            return self._handle_voice_message(log_folder, log_user_name, update_message)
+            return self._handle_voice_message(config, client, log_folder, log_user_name, update_message)
         elif update_message.audio:
-            return self._handle_audio_message(log_folder, log_user_name, update_message)
+            return self._handle_audio_message(config, client, log_folder, log_user_name, update_message)
 
-    def get_chats_info(self) -> list:
+    def chats_cached(self) -> bool:
+        """Test if :py:meth:`get_chats_info` can answer from the directory cache without a telegram connection."""
+        return self._directory.chats_fresh()
 
-        r = self._client.send(api_functions.messages.GetAllChats([]))
+    def peers_cached(self) -> bool:
+        """Test if :py:meth:`get_peers_info` can answer from the directory cache without a telegram connection."""
+        return self._directory.peers_fresh()
 
-        data = []
+    def get_chats_info(self, refresh: bool = False) -> list:
 
-        for i in r.chats:
-            if type(i) is pyrogram.api.types.Channel:
-                chat_id = int("-100"+str(i.id))
-            else:
-                chat_id = -i.id
+        if refresh or not self._directory.chats_fresh():
+            chats = OrderedDict()
 
-            storage = os.path.abspath(os.path.join(self._config.data_dir, self.CHANNELS_DIR_NAME, str(chat_id)))
-            if not os.path.isdir(storage):
-                storage = None
+            for _, client in self._clients:
+                r = client.send(api_functions.messages.GetAllChats([]))
 
-            data.append(OrderedDict([('type', type(i).__name__),
-                                     ('id', chat_id),
-                                     ('title', i.title),
-                                     ('slug', slugify(i.title)),
-                                     ('storage', storage)]))
+                for i in r.chats:
+                    if type(i) is pyrogram.api.types.Channel:
+                        chat_id = int("-100"+str(i.id))
+                    else:
+                        chat_id = -i.id
+
+                    chats[chat_id] = OrderedDict([('type', type(i).__name__),
+                                                  ('id', chat_id),
+                                                  ('title', i.title),
+                                                  ('slug', slugify(i.title))])
+
+            self._directory.set_chats(list(chats.values()))
+            self._directory.save()
+
+        channels_dir = os.path.abspath(os.path.join(self._config.data_dir, self.CHANNELS_DIR_NAME))
+
+        stored = set(os.listdir(channels_dir)) if os.path.isdir(channels_dir) else set()
+
+        data = []
+
+        for chat in self._directory.chats():
+            chat = OrderedDict(chat)
+            chat['storage'] = os.path.join(channels_dir, str(chat['id'])) if str(chat['id']) in stored else None
+            data.append(chat)
 
         return data
 
-    def dump_chats_info(self, file):
-        enc_print(json.dumps(self.get_chats_info(), indent=4, sort_keys=False), file=file)
+    def dump_chats_info(self, file, refresh: bool = False):
+        enc_print(json.dumps(self.get_chats_info(refresh), indent=4, sort_keys=False), file=file)
+
+    def get_peers_info(self, refresh: bool = False) -> list:
 
-    def get_peers_info(self) -> list:
-        r = self._client.send(api_functions.users.GetUsers([*self._client.peers_by_id.values()]))
+        if refresh or not self._directory.peers_fresh():
+            peers = OrderedDict()
+
+            # peers are looked up with the account that knows their access hash
+            for _, client in self._clients:
+                input_peers = [*client.peers_by_id.values()]
+
+                # one request for thousands of peers is slow and can fail outright
+                for start in range(0, len(input_peers), tgminer.directory.PEER_CHUNK_SIZE):
+                    r = client.send(api_functions.users.GetUsers(
+                        input_peers[start:start + tgminer.directory.PEER_CHUNK_SIZE]))
+
+                    for user in r:
+                        peers[user.id] = OrderedDict([('id', user.id),
+                                                      ('username', user.username),
+                                                      ('first_name', user.first_name),
+                                                      ('last_name', user.last_name)])
+
+            self._directory.set_peers(list(peers.values()))
+            self._directory.save()
 
         data = []
 
@@ -661,7 +1292,7 @@ class TGMinerClient:
         if not os.path.isdir(storage):
             storage = None
 
-        for user in r:
+        for user in map(lambda peer: self._directory.user(peer['id']), self._directory.peers()):
             data.append(OrderedDict([('type', 'User'), ('id', user.id),
                                      ('alias', self._get_user_alias(user)),
                                      ('username', user.username),
@@ -669,21 +1300,174 @@ class TGMinerClient:
 
         return data
 
-    def dump_peers_info(self, file):
-        enc_print(json.dumps(self.get_peers_info(), indent=4, sort_keys=False), file=file)
+    def dump_peers_info(self, file, refresh: bool = False):
+        enc_print(json.dumps(self.get_peers_info(refresh), indent=4, sort_keys=False), file=file)
+
+    def dump_chats_and_peers_info(self, file, refresh: bool = False):
+        enc_print(json.dumps(self.get_chats_info(refresh) + self.get_peers_info(refresh),
+                             indent=4, sort_keys=False), file=file)
 
-    def dump_chats_and_peers_info(self, file):
-        enc_print(json.dumps(self.get_chats_info() + self.get_peers_info(), indent=4, sort_keys=False), file=file)
+    def _get_config_mtime(self):
+        try:
+            return os.stat(self._config.config_path).st_mtime
+        except OSError:
+            return None
+
+    def reload_config(self) -> bool:
+        """Load the config file again and use it for every message received from now on.
+
+        Messages already being handled finish with the config they were received under.
+        If the file is not valid, the current config is kept.
+
+        :return: True if the new config is in use.
+        """
+        with self._reload_lock:
+            self._config_mtime = self._get_config_mtime()
+
+            try:
+                config, ignored = self._config.reload()
+            except tgminer.config.TGMinerConfigException as e:
+                enc_print(f'{e}\nConfig reload failed, keeping the current config.', file=sys.stderr)
+                return False
+
+            if ignored:
+                enc_print('Config options which require a restart were changed and are ignored: ' +
+                          ', '.join(ignored), file=sys.stderr)
+
+            self._config = config
+
+            enc_print(f'Config reloaded from "{config.config_path}".', file=sys.stderr)
+            return True
+
+    def _watch_config(self, interval: int):
+        while not self._stop_watching.wait(interval):
+            if self._get_config_mtime() != self._config_mtime:
+                self.reload_config()
+
+    def toggle_profiling(self, mode: str = None):
+        """Start profiling the process, or stop it and write the profile into the data directory.
+
+        :param mode: Profiling mode, defaults to the **profiling.mode** config option.
+        :return: Path of the written profile, or None if profiling was started.
+        """
+        path = self._profiler.toggle(mode if mode else self._config.profiling.mode)
+        if path is None:
+            enc_print('Profiling started.', file=sys.stderr)
+        else:
+            enc_print(f'Profiling stopped, profile written to "{path}".', file=sys.stderr)
+        return path
+
+    def _control_profile(self, args: list) -> str:
+        if len(args) == 0 or args[0] not in ('start', 'stop'):
+            return 'error: usage: profile start [{}] | profile stop'.format('|'.join(tgminer.profiling.PROFILE_MODES))
+
+        if args[0] == 'start':
+            mode = args[1] if len(args) > 1 else self._config.profiling.mode
+            if mode not in tgminer.profiling.PROFILE_MODES:
+                return f'error: unknown profiling mode "{mode}"'
+            if self._profiler.running:
+                return 'error: already profiling'
+            self.toggle_profiling(mode)
+            return 'ok: profiling started'
+
+        if not self._profiler.running:
+            return 'error: not profiling'
+
+        return f'ok: {self.toggle_profiling()}'
+
+    def _control_slowlog(self, args: list) -> str:
+        if args:
+            try:
+                threshold_ms = int(args[0])
+                if threshold_ms < 0:
+                    raise ValueError()
+            except ValueError:
+                return 'error: usage: slowlog [THRESHOLD_MS], 0 disables'
+            self._slow_messages.threshold_ms = threshold_ms
+
+        return f'ok: slow message threshold is {self._slow_messages.threshold_ms} ms, ' \
+               f'log file "{self._slow_messages.path}"'
+
+    def _control_reload(self, args: list) -> str:
+        return 'ok: config reloaded' if self.reload_config() else 'error: config reload failed, see tgminer output'
 
     def start(self):
-        self._client.start()
+        for _, client in self._clients:
+            client.start()
+
+        if not self._mining:
+            return
+
+        if hasattr(signal, 'SIGUSR1') and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.toggle_profiling())
+
+        control_socket = control_socket_path(self._config)
+        if control_socket:
+            self._control_server = tgminer.profiling.ControlServer(control_socket, {
+                'profile': self._control_profile,
+                'slowlog': self._control_slowlog,
+                'reload': self._control_reload
+            })
+            self._control_server.start()
+
+        if hasattr(signal, 'SIGHUP') and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGHUP, lambda signum, frame: self.reload_config())
+
+        if self._config.config_watch_interval:
+            threading.Thread(target=self._watch_config, args=(self._config.config_watch_interval,),
+                             name='ConfigWatcher', daemon=True).start()
+
+    def _shutdown(self):
+        self._stop_watching.set()
+
+        if not self._mining:
+            self._directory.save()
+            return
+
+        if self._control_server is not None:
+            self._control_server.close()
+
+        if self._profiler.running:
+            self.toggle_profiling()
+
+        if self._flood_filter is not None:
+            self._flood_filter.drain()
+
+        # downloads stopped with the clients, extraction only finishes documents already downloaded
+        self._pipeline.close()
+        self._console.close()
+        self._index.close()
+        self._raw_log.close()
+        self._directory.save()
+
+        if self._journal is not None:
+            self._journal.close()
+
+        if self._capture is not None:
+            self._capture.close()
+
+            if self._capture.skipped:
+                enc_print(f'{self._capture.skipped} update(s) could not be captured.', file=sys.stderr)
+
+        if self._extract_dropped:
+            enc_print(f'Text was not extracted from {self._extract_dropped} document(s), '
+                      'the extraction queue was full.', file=sys.stderr)
 
     def stop(self):
-        self._client.stop()
+        for _, client in self._clients:
+            if client.is_started:
+                client.stop()
+        self._shutdown()
 
     def idle(self):
+        # pyrogram stops the client itself once idling ends
         self._client.idle()
 
+        for _, client in self._clients[1:]:
+            if client.is_started:
+                client.stop()
+        self._shutdown()
+
 
 def main():
     arg_parser = argparse.ArgumentParser(description='Passive telegram mining client.', prog='tgminer')
@@ -706,17 +1490,56 @@ def main():
                                  'into one JSON list.',
                             action='store_true')
 
+    arg_parser.add_argument('--refresh',
+                            help='Fetch the information printed by --show-chats and --show-peers from telegram, '
+                                 'even if the directory cache in the data directory is not older than the '
+                                 '"directory_ttl" config option.',
+                            action='store_true')
+
+    arg_parser.add_argument('--control', metavar='COMMAND',
+                            help='Send a command to the control socket of the running tgminer using the same '
+                                 'config, print the reply and exit. Commands are "profile start [sample|cprofile]", '
+                                 '"profile stop", "slowlog [THRESHOLD_MS]" and "reload".')
+
     args = arg_parser.parse_args()
 
+    if args.refresh and not (args.show_chats or args.show_peers):
+        arg_parser.error('--refresh must be used with --show-chats or --show-peers.')
+
     config_path = tgminer.config.get_config_path(args.config)
 
     if not os.path.isfile(config_path):
         enc_print(f'Config file "{config_path}" does not exist.', file=sys.stderr)
         exit(exits.EX_NOINPUT)
 
+    if args.control:
+        try:
+            config = tgminer.config.TGMinerConfig(config_path)
+        except tgminer.config.TGMinerConfigException as e:
+            enc_print(str(e), file=sys.stderr)
+            exit(exits.EX_CONFIG)
+            return
+
+        control_socket = control_socket_path(config)
+        if not control_socket:
+            enc_print('The control socket is not enabled, set "profiling.control_socket" in the config.',
+                      file=sys.stderr)
+            exit(exits.EX_CONFIG)
+
+        try:
+            reply = tgminer.profiling.send_control_command(control_socket, args.control)
+        except (OSError, AttributeError) as e:
+            enc_print(f'Could not connect to control socket "{control_socket}": {e}', file=sys.stderr)
+            exit(exits.EX_UNAVAILABLE)
+            return
+
+        enc_print(reply)
+        exit(0 if reply.startswith('ok') else exits.EX_SOFTWARE)
+
     try:
         # noinspection PyTypeChecker
-        client = TGMinerClient(tgminer.config.TGMinerConfig(config_path))
+        client = TGMinerClient(tgminer.config.TGMinerConfig(config_path),
+                               mine=not (args.show_chats or args.show_peers))
     except tgminer.config.TGMinerConfigException as e:
         enc_print(str(e), file=sys.stderr)
         exit(exits.EX_CONFIG)
@@ -725,13 +1548,18 @@ def main():
     try:
         if args.show_chats or args.show_peers:
             try:
-                client.start()
+                # the directory cache can answer without connecting to telegram
+                if (args.refresh or
+                        (args.show_chats and not client.chats_cached()) or
+                        (args.show_peers and not client.peers_cached())):
+                    client.start()
+
                 if args.show_chats and args.show_peers:
-                    client.dump_chats_and_peers_info(sys.stdout)
+                    client.dump_chats_and_peers_info(sys.stdout, args.refresh)
                 elif args.show_chats:
-                    client.dump_chats_info(sys.stdout)
+                    client.dump_chats_info(sys.stdout, args.refresh)
                 elif args.show_peers:
-                    client.dump_peers_info(sys.stdout)
+                    client.dump_peers_info(sys.stdout, args.refresh)
             finally:
                 client.stop()
         else:
@@ -0,0 +1,133 @@
+# Copyright (c) 2018, Teriks
+# All rights reserved.
+#
+# TGMiner is distributed under the following BSD 3-Clause License
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+import random
+import re
+
+WORD_INDEX_EXTENSION = '.words'
+"""Extension appended to a markov chain file path to get the path of its word index."""
+
+_STRIP_PUNCTUATION = re.compile(r'^\W+|\W+$')
+
+
+def word_index_path(chain_path: str) -> str:
+    """Get the path of the word index file which accompanies a markov chain file.
+
+    :param chain_path: Path to the markov chain file.
+    :return: Path to the word index file.
+    """
+    return chain_path + WORD_INDEX_EXTENSION
+
+
+def normalize_word(word: str) -> str:
+    """Normalize a word for lookup in a :py:class:`WordStateIndex`.
+
+    Case is folded and leading/trailing punctuation is removed.
+
+    :param word: The word.
+    :return: The normalized word.
+    """
+    return _STRIP_PUNCTUATION.sub('', word).casefold()
+
+
+class WordStateIndex:
+    """Maps each word in a markov chain to the chain states which contain it.
+
+    States are recorded exactly as they were added to the chain, so a state
+    chosen from the index can be returned directly by a start chooser passed
+    to :py:meth:`kovit.Chain.walk`.
+    """
+
+    def __init__(self):
+        self._states = []
+        self._state_ids = dict()
+        self._words = dict()
+
+    def add(self, state):
+        """Record a chain state, this should be called with every start state added to the chain.
+
+        :param state: The state, a word or sequence of words.
+        """
+        key = state if isinstance(state, str) else tuple(state)
+
+        if key in self._state_ids:
+            return
+
+        state_id = len(self._states)
+        self._state_ids[key] = state_id
+        self._states.append(key)
+
+        for word in set(normalize_word(w) for w in self._state_words(key)):
+            if word:
+                self._words.setdefault(word, []).append(state_id)
+
+    @staticmethod
+    def _state_words(state):
+        return (state,) if isinstance(state, str) else state
+
+    def containing(self, word: str) -> list:
+        """Get every state which contains a word.
+
+        :param word: The word, it will be normalized with :py:func:`normalize_word`.
+        :return: List of states.
+        """
+        return [self._states[i] for i in self._words.get(normalize_word(word), ())]
+
+    def starting_with(self, word: str) -> list:
+        """Get every state whose first word is a given word.
+
+        :param word: The word, it will be normalized with :py:func:`normalize_word`.
+        :return: List of states.
+        """
+        word = normalize_word(word)
+        return [state for state in self.containing(word)
+                if normalize_word(self._state_words(state)[0]) == word]
+
+    @staticmethod
+    def choose(states: list):
+        """Choose a random state from a list of states returned by this index.
+
+        :param states: List of states.
+        :return: The chosen state.
+        """
+        return random.choice(states)
+
+    def dump_json(self, file):
+        """Write the index to a text mode file object as JSON.
+
+        :param file: The file object.
+        """
+        json.dump({'states': [s if isinstance(s, str) else list(s) for s in self._states],
+                   'words': self._words}, file)
+
+    def load_json(self, file):
+        """Load the index from a file object previously written with :py:meth:`dump_json`.
+
+        :param file: The file object.
+        """
+        data = json.load(file)
+
+        self._states = [s if isinstance(s, str) else tuple(s) for s in data['states']]
+        self._state_ids = {s: i for i, s in enumerate(self._states)}
+        self._words = data['words']
+
+    def __len__(self):
+        return len(self._states)